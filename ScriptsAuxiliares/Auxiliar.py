@@ -1,10 +1,13 @@
+import functools
 import os
 
 
 class Auxiliar:
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def getProjectRootDir():
+        # o resultado é guardado: a busca pela pasta de referência percorre o sistema de arquivos
         # Obtém o diretório do script atual
         diretorio_atual = os.path.abspath(os.path.dirname(__file__))
 
@@ -1,28 +1,255 @@
+import json
+from typing import Iterable, Iterator
+
 import sqlalchemy as sa
-from conf.db_session import createSession
+from sqlalchemy.exc import IntegrityError
+from conf.db_session import sessionScope, registrarModels
+from conf.logger import getLogger
+
+log = getLogger('DataBaseFeatures')
+
+# Limite de variáveis por comando no SQLite. Versões anteriores à 3.32 aceitam no máximo 999 parâmetros,
+# por isso as listas de ids são quebradas em blocos com uma folga abaixo desse valor.
+LIMITE_VARIAVEIS_SQLITE = 900
+
+# tabelas derivadas já avisadas neste processo, ver DataBaseFeatures.avisarSemTriggers
+_avisadas_sem_triggers: set[str] = set()
 
 
 class DataBaseFeatures:
 
     @staticmethod
-    def findTabelsWithFkTo(table_name: str):
-        """Encontra todas as tabelas que têm uma FK para a tabela especificada.
+    def avisarSemTriggers(tabela: str, dialeto: str, reparo: str) -> None:
+        """Avisa, uma única vez por processo, que uma tabela derivada (catálogo ou rollup) está sendo usada em um banco
+        que não é o sqlite: os triggers que a mantêm existem somente no sqlite, e nos demais bancos ela não acompanha as
+        escritas até ser recalculada.
+        :param tabela: str: nome da tabela derivada, ex.: 'picole_stock'
+        :param dialeto: str: nome do dialeto da conexão, ex.: 'sqlite', 'postgresql'
+        :param reparo: str: comando que recalcula a tabela, ex.: 'python repair_rollups_main.py'
+        """
+        if dialeto == 'sqlite' or tabela in _avisadas_sem_triggers:
+            return
+        _avisadas_sem_triggers.add(tabela)
+        log.warning('A tabela %s é mantida por triggers somente no sqlite: no %s ela não acompanha as escritas e pode '
+                    'estar desatualizada. Recalcule-a depois das escritas com: %s', tabela, dialeto, reparo)
+
+    @staticmethod
+    async def findTabelsWithFkTo(table_name: str) -> list[str]:
+        """Encontra, consultando o catálogo do banco, todas as tabelas que têm uma FK para a tabela especificada.
+        Usa a sessão ambiente do contexto quando chamado dentro de outra operação, sem retirar outra conexão do pool.
         :param table_name: Nome da tabela para a qual você deseja encontrar as FKs.
-        :param engine: Objeto de conexão do SQLAlchemy.
         :return: Lista de nomes de tabelas que têm FK para a tabela especificada.
         """
-        try:
-            engine = createSession().get_bind()
-            inspector = sa.inspect(engine)
-            fk_tables = []
 
+        def _buscar(conexao) -> list[str]:
+            inspector = sa.inspect(conexao)
+            fk_tables = []
             for table in inspector.get_table_names():
                 for fk in inspector.get_foreign_keys(table):
                     if fk['referred_table'] == table_name:
                         fk_tables.append(table)
-
             return fk_tables
-        except Exception as e:
-            print(f'Erro ao tentar encontrar tabelas com FK para "{table_name}": {e}')
-            return []
 
+        async with sessionScope(savepoint=False) as session:
+            conexao = await session.connection()
+            return await conexao.run_sync(_buscar)
+
+    @staticmethod
+    def chunks(ids: Iterable[int], tamanho: int = LIMITE_VARIAVEIS_SQLITE) -> Iterator[list[int]]:
+        """Quebra uma lista de ids em blocos de no máximo 'tamanho' elementos.
+        :param ids: Iterable[int]: ids a serem quebrados
+        :param tamanho: int: quantidade máxima de ids por bloco
+        :return: Iterator[list[int]]: blocos de ids
+        """
+        bloco = []
+        for id_ in ids:
+            bloco.append(id_)
+            if len(bloco) >= tamanho:
+                yield bloco
+                bloco = []
+        if bloco:
+            yield bloco
+
+    @staticmethod
+    def filtroIdsParametroUnico(coluna, ids: list[int], dialeto: str):
+        """Monta o filtro 'coluna IN ids' com todos os ids em um único parâmetro, de modo que a consulta não precise
+        ser quebrada em blocos: no postgres, coluna = ANY(:ids) com um array; no sqlite, um IN sobre json_each(:ids).
+        :param coluna: coluna filtrada, ex.: IngredientePicole.picole_fk
+        :param ids: list[int]: ids procurados
+        :param dialeto: str: nome do dialeto da conexão, ex.: 'sqlite', 'postgresql'
+        :return: expressão booleana do SQLAlchemy
+        """
+        if dialeto == 'postgresql':
+            # importado somente aqui: o dialeto do postgres inteiro é carregado junto, e custa dezenas de ms na
+            # importação dos models quando o banco é o sqlite
+            from sqlalchemy.dialects import postgresql
+            return coluna == sa.any_(sa.bindparam('ids', ids, type_=postgresql.ARRAY(sa.BigInteger)))
+        valores = sa.func.json_each(sa.bindparam('ids', json.dumps(ids))).table_valued('value')
+        return coluna.in_(sa.select(valores.c.value))
+
+    @staticmethod
+    def findColunasDependentes(model) -> list[sa.Column]:
+        """Encontra, a partir dos metadados do ModelBase, as colunas de outras tabelas que são FK para o model.
+        Diferente de findTabelsWithFkTo, não abre sessão nem consulta o catálogo do banco.
+        :param model: classe do model referenciado
+        :return: list[sa.Column]: colunas FK que apontam para a tabela do model
+        """
+        # garante que todas as tabelas estejam registradas no metadata
+        registrarModels()
+
+        colunas = []
+        for tabela in model.metadata.sorted_tables:
+            for fk in tabela.foreign_keys:
+                if fk.column.table is model.__table__:
+                    colunas.append(fk.parent)
+        return colunas
+
+    @staticmethod
+    async def contarDependentes(session, model, ids: list[int] = None, filtro=None) -> dict[str, int]:
+        """Conta, com uma consulta agregada por tabela dependente, as linhas que referenciam os registros do model.
+        Os registros podem ser informados por lista de ids (quebrada em blocos) ou por um filtro (subconsulta).
+        :param session: AsyncSession: sessão já aberta
+        :param model: classe do model referenciado
+        :param ids: list[int]: ids dos registros do model
+        :param filtro: expressão booleana do SQLAlchemy que seleciona os registros do model
+        :return: dict[str, int]: quantidade de linhas dependentes por tabela, somente as tabelas com dependentes
+        """
+        dependentes = {}
+        for coluna in DataBaseFeatures.findColunasDependentes(model):
+            total = 0
+            if filtro is not None:
+                alvo = sa.select(model.__table__.c.id).where(filtro)
+                consulta = sa.select(sa.func.count()).select_from(coluna.table).where(coluna.in_(alvo))
+                total = (await session.execute(consulta)).scalar_one()
+            else:
+                for bloco in DataBaseFeatures.chunks(ids):
+                    consulta = sa.select(sa.func.count()).select_from(coluna.table).where(coluna.in_(bloco))
+                    total += (await session.execute(consulta)).scalar_one()
+
+            if total:
+                dependentes[coluna.table.name] = dependentes.get(coluna.table.name, 0) + total
+        return dependentes
+
+    @staticmethod
+    async def selectManyById(model, ids: Iterable[int]) -> dict:
+        """Seleciona vários registros do model por id, com uma consulta por bloco de ids. No sqlite os ids são
+        quebrados em blocos abaixo do limite de variáveis; no postgres vão em um único array, com id = ANY(:ids).
+        :param model: classe do model
+        :param ids: Iterable[int]: ids dos registros, repetições são ignoradas
+        :return: dict[int, model]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        ids = list(dict.fromkeys(ids))
+        if not all(isinstance(id_, int) for id_ in ids):
+            raise TypeError(f'ids do {model.__name__} devem ser inteiros!')
+        if not ids:
+            return {}
+
+        registros = {}
+        async with sessionScope(savepoint=False) as session:
+            conexao = await session.connection()
+            if conexao.dialect.name == 'postgresql':
+                # filtroIdsParametroUnico importa o dialeto do postgres somente quando ele é usado
+                consultas = [sa.select(model).where(DataBaseFeatures.filtroIdsParametroUnico(model.id, ids,
+                                                                                             'postgresql'))]
+            else:
+                consultas = [sa.select(model).where(model.id.in_(bloco)) for bloco in DataBaseFeatures.chunks(ids)]
+
+            for consulta in consultas:
+                for registro in (await session.scalars(consulta)).unique():
+                    registros[registro.id] = registro
+        return registros
+
+    @staticmethod
+    async def deleteById(model, id: int) -> int:
+        """Deleta um registro do model com um único DELETE ... WHERE id=:id RETURNING id, sem carregar a entidade.
+        :param model: classe do model
+        :param id: int: id do registro
+        :return: int: id do registro deletado
+        :raises ValueError: Se o registro não for encontrado na base
+        :raises RuntimeError: Se o registro estiver associado a um ou mais elementos em outras tabelas
+        """
+        nome = model.__name__
+        try:
+            async with sessionScope() as session:
+                dependentes = await DataBaseFeatures.contarDependentes(session, model, ids=[id])
+                if dependentes:
+                    raise RuntimeError(f'{nome} com id={id} não pode ser deletado, '
+                                       f'pois está associado a um ou mais elementos na(s) tabela(s): '
+                                       f'{list(dependentes)}')
+
+                tabela = model.__table__
+                stmt = sa.delete(tabela).where(tabela.c.id == id).returning(tabela.c.id)
+                id_deletado = (await session.execute(stmt)).scalar_one_or_none()
+                if id_deletado is None:
+                    raise ValueError(f'{nome} com id={id} não cadastrado na base!')
+            return id_deletado
+
+        except IntegrityError as intg_error:
+            # algum dependente foi inserido entre a verificação e o DELETE
+            if 'FOREIGN KEY constraint failed' in str(intg_error):
+                tabelas = [coluna.table.name for coluna in DataBaseFeatures.findColunasDependentes(model)]
+                raise RuntimeError(f'{nome} com id={id} não pode ser deletado, '
+                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
+            raise RuntimeError(f'Erro de integridade ao deletar {nome}: {intg_error}')
+
+    @staticmethod
+    async def deleteMany(model, ids: Iterable[int]) -> int:
+        """Deleta vários registros do model em uma única transação, quebrando os ids em blocos abaixo do limite de
+        variáveis do SQLite. A verificação de dependentes é feita antes, com uma consulta agregada por tabela.
+        :param model: classe do model
+        :param ids: Iterable[int]: ids dos registros
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum registro estiver associado a elementos em outras tabelas
+        """
+        nome = model.__name__
+        ids = list(dict.fromkeys(ids))
+        if not all(isinstance(id_, int) for id_ in ids):
+            raise TypeError(f'ids do {nome} devem ser inteiros!')
+        if not ids:
+            return 0
+
+        try:
+            async with sessionScope() as session:
+                dependentes = await DataBaseFeatures.contarDependentes(session, model, ids=ids)
+                if dependentes:
+                    raise RuntimeError(f'{nome}(s) não podem ser deletados, pois estão associados a elementos '
+                                       f'na(s) tabela(s): {dependentes}')
+
+                tabela = model.__table__
+                total = 0
+                for bloco in DataBaseFeatures.chunks(ids):
+                    resultado = await session.execute(sa.delete(tabela).where(tabela.c.id.in_(bloco)))
+                    total += resultado.rowcount
+            return total
+
+        except IntegrityError as intg_error:
+            raise RuntimeError(f'Erro de integridade ao deletar {nome}(s): {intg_error}')
+
+    @staticmethod
+    async def deleteWhere(model, *filtros) -> int:
+        """Deleta, com um único DELETE, os registros do model que atendem aos filtros informados.
+        :param model: classe do model
+        :param filtros: expressões booleanas do SQLAlchemy, ex.: Lote.picole_fk == 1
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado, evitando apagar a tabela inteira por engano
+        :raises RuntimeError: Se algum registro estiver associado a elementos em outras tabelas
+        """
+        nome = model.__name__
+        if not filtros:
+            raise ValueError(f'Informe ao menos um filtro para deletar registros de {nome}!')
+
+        filtro = sa.and_(*filtros)
+        try:
+            async with sessionScope() as session:
+                dependentes = await DataBaseFeatures.contarDependentes(session, model, filtro=filtro)
+                if dependentes:
+                    raise RuntimeError(f'{nome}(s) não podem ser deletados, pois estão associados a elementos '
+                                       f'na(s) tabela(s): {dependentes}')
+
+                resultado = await session.execute(sa.delete(model.__table__).where(filtro))
+            return resultado.rowcount
+
+        except IntegrityError as intg_error:
+            raise RuntimeError(f'Erro de integridade ao deletar {nome}(s): {intg_error}')
@@ -0,0 +1,409 @@
+import time
+from datetime import datetime
+from datetime import timedelta
+from itertools import accumulate, islice
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, Union
+
+import sqlalchemy as sa
+from tqdm import tqdm  # pip install tqdm
+
+from conf.helpers import gerar_strings, gerar_ints, gerar_floats, gerar_cor, definir_semente, obter_gerador
+from conf.db_session import createEngine, createTables, registrarModels
+from models.model_base import ModelBase
+
+# Este módulo é responsável pela geração de dados sintéticos do banco de picolés, usada por populate_main.py.
+# As tabelas são populadas na ordem das dependências de FK (ModelBase.metadata.sorted_tables) e cada FK é sorteada
+# somente entre os ids que já existem na tabela pai. Os valores únicos (nomes, cnpj, numero_serie, combinações de
+# picolé e pares das tabelas de associação) são garantidos com sets, carregados também com os valores já gravados.
+# As linhas são geradas sob demanda e gravadas com inserts em lote (executemany), em blocos de 'bloco' linhas, com
+# uma transação por tabela.
+#
+# No sqlite, os triggers do catálogo e dos rollups são removidos durante a carga e recriados ao final, junto com o
+# recálculo das tabelas, pois atualizar essas tabelas linha a linha dominaria o tempo da carga. Os triggers são
+# recriados também quando a carga falha ou é interrompida, e os demais triggers do banco não são tocados.
+#
+# Perfis de dados (PERFIS): cada perfil fixa a quantidade de linhas por tabela, a distribuição das FKs (uniforme ou
+# Zipf) e a semente. A carga de um perfil parte de um arquivo novo, todas as datas partem de uma data de referência
+# fixa e o arquivo é compactado com VACUUM ao final, de modo que duas cargas do mesmo perfil produzem bancos
+# idênticos byte a byte (com a mesma versão do sqlite).
+
+# quantidade de linhas por tabela com --scale 1
+LINHAS_BASE = {
+    'aditivo_nutritivo': 100,
+    'sabor': 100,
+    'tipo_embalagem': 20,
+    'tipo_picole': 20,
+    'ingrediente': 100,
+    'conservante': 100,
+    'revendedor': 100,
+    'picole': 200,
+    'nota_fiscal': 1000,
+    'lote': 2000,
+    'ingrediente_picole': 1000,
+    'conservante_picole': 400,
+    'aditivo_nutritivo_picole': 400,
+    'lote_nota_fiscal': 1000,
+}
+
+# período das datas de criação das notas fiscais e dos lotes, para os relatórios por período
+DIAS_HISTORICO = 365
+
+# quantidade de valores gerados por chamada aos helpers em lote
+LOTE_GERACAO = 10_000
+
+# data de referência dos perfis: as datas geradas ficam nos DIAS_HISTORICO anteriores a ela
+DATA_REFERENCIA = datetime(2024, 1, 1)
+
+
+def linhasEscaladas(scale: float) -> dict[str, int]:
+    """Multiplica a quantidade base de linhas de cada tabela pelo fator informado
+    :param scale: float: fator de escala
+    :return: dict[str, int]: quantidade de linhas por tabela
+    """
+    return {tabela: max(1, round(linhas * scale)) for tabela, linhas in LINHAS_BASE.items()}
+
+
+class PerfilDados(NamedTuple):
+    nome: str
+    # quantidade de linhas por tabela
+    linhas: dict[str, int]
+    seed: int
+    # expoente da distribuição Zipf por FK ('tabela.coluna'): o i-ésimo id da tabela pai é sorteado com peso 1 / i**s.
+    # As FKs ausentes são sorteadas de modo uniforme.
+    zipf: dict[str, float] = {}
+    data_referencia: datetime = DATA_REFERENCIA
+
+
+PERFIS = {
+    'tiny': PerfilDados('tiny', linhasEscaladas(0.1), seed=101),
+    'medium': PerfilDados('medium', linhasEscaladas(10), seed=202),
+    'large': PerfilDados('large', linhasEscaladas(150), seed=303),
+    # poucos revendedores concentram as notas fiscais e poucos picolés concentram os lotes
+    'skewed': PerfilDados('skewed', linhasEscaladas(10), seed=404,
+                          zipf={'nota_fiscal.revendedor_fk': 1.2, 'lote.picole_fk': 1.1,
+                                'lote_nota_fiscal.nota_fiscal_fk': 1.0}),
+}
+
+
+class GeradorDados:
+
+    def __init__(self, conexao, linhas: dict[str, int], zipf: dict[str, float] = None, agora: datetime = None):
+        """Cria o gerador
+        :param conexao: AsyncConnection: conexão usada para ler os ids e os valores já existentes
+        :param linhas: dict[str, int]: quantidade de linhas por tabela
+        :param zipf: dict[str, float]: expoente da distribuição Zipf por FK ('tabela.coluna')
+        :param agora: datetime: data de referência das datas geradas; padrão, a data atual
+        """
+        self.conexao = conexao
+        self.linhas = linhas
+        self.zipf = zipf or {}
+        self.ids: dict[str, list[int]] = {}
+        self.agora = agora or datetime.now()
+        self.rng = obter_gerador()
+        # mesmo tratamento dos models: sem espaços nas pontas e em maiúsculas
+        self._nomes = self.fluxo(lambda k: [texto.strip().upper() or 'X' for texto in gerar_strings(k)])
+        self._frases = self.fluxo(lambda k: [texto.strip().upper() or 'X' for texto in gerar_strings(k, frase=True)])
+
+    def quantidade(self, tabela: str) -> int:
+        return self.linhas.get(tabela, 0)
+
+    async def idsExistentes(self, tabela: str) -> list[int]:
+        """Lê os ids da tabela pai, uma única vez por tabela, depois que ela foi populada"""
+        if tabela not in self.ids:
+            self.ids[tabela] = (await self.conexao.exec_driver_sql(f'SELECT id FROM {tabela} ORDER BY id')).scalars().all()
+            if not self.ids[tabela]:
+                raise RuntimeError(f'Tabela {tabela} vazia: não há ids para as FKs')
+        return self.ids[tabela]
+
+    async def valoresExistentes(self, tabela: str, coluna: str) -> set:
+        """Lê os valores já gravados de uma coluna única, para que o set de unicidade os inclua"""
+        return set((await self.conexao.exec_driver_sql(f'SELECT {coluna} FROM {tabela}')).scalars().all())
+
+    def data(self) -> datetime:
+        return self.agora - timedelta(seconds=self.rng.uniform(0, DIAS_HISTORICO * 86400))
+
+    @staticmethod
+    def unicos(gerar: Callable[[], object], quantidade: int, existentes: set) -> Iterator:
+        """Gera 'quantidade' valores que ainda não estão no set, sorteando novamente os repetidos
+        :param gerar: função sem parâmetros que sorteia um valor
+        :param quantidade: int: quantidade de valores novos
+        :param existentes: set: valores já usados, atualizado com os novos
+        """
+        gerados = 0
+        while gerados < quantidade:
+            valor = gerar()
+            if valor in existentes:
+                continue
+            existentes.add(valor)
+            gerados += 1
+            yield valor
+
+    @staticmethod
+    def fluxo(gerar_lote: Callable[[int], list], tamanho: int = LOTE_GERACAO) -> Iterator:
+        """Fornece um valor por vez a partir de lotes de valores gerados de uma só vez pelos helpers
+        :param gerar_lote: função que recebe a quantidade e retorna uma lista de valores
+        :param tamanho: int: quantidade de valores por lote
+        """
+        while True:
+            yield from gerar_lote(tamanho)
+
+    def nome(self, frase: bool = False) -> str:
+        return next(self._frases if frase else self._nomes)
+
+    def sorteio(self, ids: list[int], fk: str = None) -> Iterator[int]:
+        """Sorteia ids com reposição, em lotes, de modo uniforme ou pela distribuição Zipf configurada para a FK
+        :param ids: list[int]: ids da tabela pai
+        :param fk: str: FK sorteada, 'tabela.coluna'
+        """
+        expoente = self.zipf.get(fk)
+        if not expoente:
+            return self.fluxo(lambda k: self.rng.choices(ids, k=k))
+        pesos = list(accumulate(1 / posicao ** expoente for posicao in range(1, len(ids) + 1)))
+        return self.fluxo(lambda k: self.rng.choices(ids, cum_weights=pesos, k=k))
+
+    # 1) Aditivos Nutritivos
+    async def aditivo_nutritivo(self) -> Iterator[dict]:
+        n = self.quantidade('aditivo_nutritivo')
+        nomes = self.unicos(self.nome, n, await self.valoresExistentes('aditivo_nutritivo', 'nome'))
+        formulas = self.unicos(lambda: self.nome(frase=True), n,
+                               await self.valoresExistentes('aditivo_nutritivo', 'formula_quimica'))
+        return ({'nome': nome, 'formula_quimica': formula} for nome, formula in zip(nomes, formulas))
+
+    # 2) Sabores, 3) Tipos Embalagem, 4) Tipos Picolé e 5) Ingredientes
+    async def _somenteNome(self, tabela: str) -> Iterator[dict]:
+        nomes = self.unicos(self.nome, self.quantidade(tabela), await self.valoresExistentes(tabela, 'nome'))
+        return ({'nome': nome} for nome in nomes)
+
+    async def sabor(self) -> Iterator[dict]:
+        return await self._somenteNome('sabor')
+
+    async def tipo_embalagem(self) -> Iterator[dict]:
+        return await self._somenteNome('tipo_embalagem')
+
+    async def tipo_picole(self) -> Iterator[dict]:
+        return await self._somenteNome('tipo_picole')
+
+    async def ingrediente(self) -> Iterator[dict]:
+        return await self._somenteNome('ingrediente')
+
+    # 6) Conservantes
+    async def conservante(self) -> Iterator[dict]:
+        nomes = self.unicos(self.nome, self.quantidade('conservante'),
+                            await self.valoresExistentes('conservante', 'nome'))
+        return ({'nome': nome, 'descricao': self.nome(frase=True)} for nome in nomes)
+
+    # 7) Revendedores
+    async def revendedor(self) -> Iterator[dict]:
+        cnpjs = self.unicos(lambda: str(self.rng.randrange(10 ** 13, 10 ** 14)), self.quantidade('revendedor'),
+                            await self.valoresExistentes('revendedor', 'cnpj'))
+        return ({'nome': self.nome(), 'cnpj': cnpj, 'razao_social': self.nome(), 'contato': self.nome()}
+                for cnpj in cnpjs)
+
+    # 8) Notas Fiscais
+    async def nota_fiscal(self) -> Iterator[dict]:
+        revendedores = await self.idsExistentes('revendedor')
+        numeros = self.unicos(lambda: self.nome() + str(self.rng.randrange(10 ** 6)), self.quantidade('nota_fiscal'),
+                              await self.valoresExistentes('nota_fiscal', 'numero_serie'))
+
+        valores = self.fluxo(lambda k: gerar_floats(k, digitos=3))
+        revendedores = self.sorteio(revendedores, 'nota_fiscal.revendedor_fk')
+
+        def _linhas():
+            for numero_serie, valor, revendedor_fk in zip(numeros, valores, revendedores):
+                data = self.data()
+                yield {'valor': valor, 'numero_serie': numero_serie, 'descricao': self.nome(frase=True),
+                       'revendedor_fk': revendedor_fk, 'data_criacao': data, 'data_atualizacao': data}
+        return _linhas()
+
+    # 9) Picolés
+    async def picole(self) -> Iterator[dict]:
+        sabores = await self.idsExistentes('sabor')
+        tipos_picole = await self.idsExistentes('tipo_picole')
+        tipos_embalagem = await self.idsExistentes('tipo_embalagem')
+        # a combinação sabor/tipo de picolé/tipo de embalagem é única
+        existentes = {tuple(map(int, chave.split('_')))
+                      for chave in await self.valoresExistentes('picole', '"sabor_tipoPicole_tipoEmbalagem"')}
+        n = min(self.quantidade('picole'), len(sabores) * len(tipos_picole) * len(tipos_embalagem) - len(existentes))
+        combinacoes = self.unicos(
+            lambda: (self.rng.choice(sabores), self.rng.choice(tipos_picole), self.rng.choice(tipos_embalagem)), n,
+            existentes)
+        return ({'preco': preco, 'sabor_fk': sabor, 'tipo_picole_fk': tipo_picole,
+                 'tipo_embalagem_fk': tipo_embalagem,
+                 'sabor_tipoPicole_tipoEmbalagem': f'{sabor}_{tipo_picole}_{tipo_embalagem}'}
+                for (sabor, tipo_picole, tipo_embalagem), preco in zip(combinacoes, self.fluxo(gerar_floats)))
+
+    # 10) Lotes
+    async def lote(self) -> Iterator[dict]:
+        picoles = self.sorteio(await self.idsExistentes('picole'), 'lote.picole_fk')
+        quantidades = self.fluxo(gerar_ints)
+
+        def _linhas():
+            for _, picole_fk, quantidade in zip(range(self.quantidade('lote')), picoles, quantidades):
+                data = self.data()
+                yield {'picole_fk': picole_fk, 'quantidade': quantidade, 'data_criacao': data,
+                       'data_atualizacao': data}
+        return _linhas()
+
+    async def _pares(self, tabela: str, tabela_item: str, coluna_item: str, coluna_chave: str,
+                     chave: Callable[[int, int], str]) -> Iterator[dict]:
+        """Gera pares únicos (picolé, item) de uma tabela de associação"""
+        picoles = await self.idsExistentes('picole')
+        itens = await self.idsExistentes(tabela_item)
+        existentes = {tuple(linha) for linha in (await self.conexao.exec_driver_sql(
+            f'SELECT picole_fk, {coluna_item} FROM {tabela}')).all()}
+        n = min(self.quantidade(tabela), len(picoles) * len(itens) - len(existentes))
+        sorteio_picoles = self.sorteio(picoles, f'{tabela}.picole_fk')
+        sorteio_itens = self.sorteio(itens, f'{tabela}.{coluna_item}')
+        pares = self.unicos(lambda: (next(sorteio_picoles), next(sorteio_itens)), n, existentes)
+        return ({'picole_fk': picole, coluna_item: item, coluna_chave: chave(picole, item)} for picole, item in pares)
+
+    # 11) Ingredientes Picolé
+    async def ingrediente_picole(self) -> Iterator[dict]:
+        return await self._pares('ingrediente_picole', 'ingrediente', 'ingrediente_fk', 'ingrediente_picole',
+                                 lambda picole, item: f'{item}-{picole}')
+
+    # 12) Conservantes Picolé
+    async def conservante_picole(self) -> Iterator[dict]:
+        return await self._pares('conservante_picole', 'conservante', 'conservante_fk', 'conservante_picole',
+                                 lambda picole, item: f'{item}-{picole}')
+
+    # 13) Aditivos Nutritivos Picolé
+    async def aditivo_nutritivo_picole(self) -> Iterator[dict]:
+        return await self._pares('aditivo_nutritivo_picole', 'aditivo_nutritivo', 'aditivo_nutritivo_fk',
+                                 'picole_aditivo_nutritivo', lambda picole, item: f'{picole}-{item}')
+
+    # 14) Lote Nota Fiscal
+    async def lote_nota_fiscal(self) -> Iterator[dict]:
+        notas_fiscais = await self.idsExistentes('nota_fiscal')
+        # um lote só pode estar vinculado a uma nota fiscal: sorteia sem reposição entre os lotes ainda livres
+        vinculados = set((await self.conexao.exec_driver_sql('SELECT lote_fk FROM lote_nota_fiscal')).scalars().all())
+        livres = [lote for lote in await self.idsExistentes('lote') if lote not in vinculados]
+        lotes = self.rng.sample(livres, min(self.quantidade('lote_nota_fiscal'), len(livres)))
+        return ({'nota_fiscal_fk': nota_fiscal, 'lote_fk': lote, 'lote_nota_fiscal': f'{lote}-{nota_fiscal}'}
+                for lote, nota_fiscal in zip(lotes, self.sorteio(notas_fiscais, 'lote_nota_fiscal.nota_fiscal_fk')))
+
+
+async def popular(scale: float = 1.0, bloco: int = 10_000, seed: int = None, recriar: bool = False,
+                  perfil: Union[str, PerfilDados] = None, sobrescrever: bool = False) -> dict[str, int]:
+    """Popula todas as tabelas com dados sintéticos
+    :param scale: float: fator multiplicado pela quantidade base de linhas de cada tabela
+    :param bloco: int: quantidade de linhas por insert em lote
+    :param seed: int: semente do gerador aleatório, para repetir a mesma carga
+    :param recriar: bool: se True, apaga e recria as tabelas antes da carga
+    :param perfil: str or PerfilDados: perfil de dados, ex.: 'skewed'; substitui scale e seed, e sempre recria as
+    tabelas, para que o banco gerado seja sempre o mesmo. No sqlite, o arquivo do banco configurado (por padrão
+    db/picoles.sqlite, ver conf/settings.py) e os arquivos -wal, -shm e -journal são APAGADOS antes da carga
+    :param sobrescrever: bool: com um perfil, permite apagar o arquivo do banco se ele já existir
+    :return: dict[str, int]: quantidade de linhas inseridas por tabela
+    :raises ValueError: Se o perfil não existir
+    :raises FileExistsError: Se o perfil for informado, o arquivo do banco já existir e sobrescrever for False
+    """
+    if isinstance(perfil, str):
+        if perfil not in PERFIS:
+            raise ValueError(f'perfil deve ser um de {", ".join(PERFIS)}!')
+        perfil = PERFIS[perfil]
+
+    if perfil is not None:
+        linhas, seed, zipf, agora, recriar = perfil.linhas, perfil.seed, perfil.zipf, perfil.data_referencia, True
+    else:
+        linhas, zipf, agora = linhasEscaladas(scale), None, None
+
+    registrarModels()
+    # sem semente, o gerador é reiniciado com a entropia do sistema
+    definir_semente(seed)
+    if perfil is not None:
+        await _apagarArquivoSqlite(sobrescrever)
+    if recriar:
+        await createTables()
+
+    # as tabelas derivadas, cujos triggers são removidos durante a carga
+    from models.picole_catalog import PicoleCatalog, TABELA_CATALOGO
+    from models.revendedor_daily_sales import RevendedorDailySales, TABELA_VENDAS_DIARIAS
+    from models.picole_stock import PicoleStock, TABELA_ESTOQUE
+
+    engine = createEngine()
+    sqlite = engine.dialect.name == 'sqlite'
+    inseridas = {}
+    try:
+        async with engine.connect() as conexao:
+            if sqlite:
+                # somente os triggers do catálogo e dos rollups, recriados no finally abaixo
+                prefixos = tuple(f'trg_{tabela}_'
+                                 for tabela in (TABELA_CATALOGO, TABELA_VENDAS_DIARIAS, TABELA_ESTOQUE))
+                async with conexao.begin():
+                    triggers = (await conexao.exec_driver_sql(
+                        "SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars().all()
+                    for trigger in triggers:
+                        if trigger.startswith(prefixos):
+                            await conexao.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger}')
+
+            gerador = GeradorDados(conexao, linhas=linhas, zipf=zipf, agora=agora)
+            for tabela in ModelBase.metadata.sorted_tables:
+                if tabela.name not in LINHAS_BASE:
+                    continue
+
+                inicio = time.perf_counter()
+                total = 0
+                async with conexao.begin():
+                    linhas_tabela = await getattr(gerador, tabela.name)()
+                    with tqdm(total=gerador.quantidade(tabela.name), desc=f'Cadastrando {tabela.name}',
+                              colour=gerar_cor()) as barra:
+                        while parte := list(islice(linhas_tabela, bloco)):
+                            # as datas não geradas recebem a data de referência, e não o default datetime.now da coluna
+                            datas = {coluna: gerador.agora for coluna in ('data_criacao', 'data_atualizacao')
+                                     if coluna in tabela.c and coluna not in parte[0]}
+                            await conexao.execute(sa.insert(tabela).values(**datas), parte)
+                            total += len(parte)
+                            barra.update(len(parte))
+
+                inseridas[tabela.name] = total
+                decorrido = time.perf_counter() - inicio
+                print(f'{tabela.name}: {total} linhas em {decorrido:.2f}s '
+                      f'({total / max(decorrido, 1e-9):,.0f} linhas/s)')
+
+    finally:
+        if sqlite:
+            # recria os triggers e recalcula o catálogo e os rollups a partir dos dados carregados, mesmo que a carga
+            # tenha falhado ou sido interrompida: sem os triggers, as escritas seguintes não atualizariam essas tabelas
+            await PicoleCatalog.rebuildCatalogo()
+            await RevendedorDailySales.verificarRollup()
+            await PicoleStock.verificarRollup()
+
+    if perfil is not None:
+        await _normalizarBanco(gerador.agora, sqlite)
+
+    return inseridas
+
+
+async def _apagarArquivoSqlite(sobrescrever: bool) -> None:
+    """Apaga o arquivo do banco sqlite, para que a carga de um perfil parta sempre de um arquivo novo: o cabeçalho do
+    arquivo guarda contadores que dependem do histórico de tabelas e triggers criados e apagados
+    :param sobrescrever: bool: se False, um arquivo existente não é apagado
+    :raises FileExistsError: Se o arquivo existir e sobrescrever for False
+    """
+    engine = createEngine()
+    if engine.url.get_backend_name() != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+    arquivo = Path(engine.url.database)
+    if arquivo.exists() and not sobrescrever:
+        raise FileExistsError(f'A carga de um perfil apaga o banco {arquivo}. Informe sobrescrever=True '
+                              f'(--sobrescrever em populate_main.py) ou outro banco em PICOLES_DB_PATH')
+    # as conexões do sqlite não ficam no pool, então o arquivo pode ser apagado
+    await engine.dispose()
+    for extra in ('', '-wal', '-shm', '-journal'):
+        arquivo.with_name(arquivo.name + extra).unlink(missing_ok=True)
+
+
+async def _normalizarBanco(agora: datetime, sqlite: bool) -> None:
+    """Deixa o banco de um perfil independente do momento da carga: as tabelas derivadas recebem a data de referência
+    e, no sqlite, o arquivo é compactado com VACUUM, sem as páginas livres deixadas durante a carga"""
+    async with createEngine().connect() as conexao:
+        async with conexao.begin():
+            for tabela in ModelBase.metadata.sorted_tables:
+                if tabela.name not in LINHAS_BASE and 'data_atualizacao' in tabela.c:
+                    await conexao.execute(sa.update(tabela).values(data_atualizacao=agora))
+        if sqlite:
+            # o VACUUM não pode ser executado dentro de uma transação: usa a conexão do driver diretamente
+            conexao_driver = (await conexao.get_raw_connection()).driver_connection
+            await conexao_driver.execute('VACUUM')
@@ -0,0 +1,269 @@
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+import sqlalchemy as sa
+from conf.db_session import conexaoLeitura, sessionScope
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
+from models.nota_fiscal import NotaFiscal
+from models.revendedor import Revendedor
+from models.lote import Lote
+from models.picole import Picole
+from models.sabor import Sabor
+from models.tipo_embalagem import TipoEmbalagem
+from models.tipo_picole import TipoPicole
+
+# Este módulo é responsável pelos relatórios agregados de vendas e estoque.
+# Os totais são calculados no banco, com GROUP BY, e somente as linhas agregadas chegam ao Python: o fechamento do mês
+# não carrega nenhum objeto NotaFiscal ou Lote. Cada relatório é atendido por um índice de cobertura declarado junto
+# ao model (ix_nota_fiscal_data_criacao_revendedor_fk_valor e ix_lote_picole_fk_quantidade), e retorna tuplas
+# tipadas (NamedTuple).
+# Os índices são criados por createTables nos bancos novos; nos bancos já existentes, por
+#     await Relatorios.criarIndices()
+#
+# Exemplo:
+#     receitas = await Relatorios.receitaPorRevendedor(inicio=datetime(2024, 1, 1), fim=datetime(2024, 2, 1))
+
+log = getLogger('relatorios')
+
+# formato do período no sqlite (strftime) e no postgres (to_char)
+PERIODOS = {
+    'dia': ('%Y-%m-%d', 'YYYY-MM-DD'),
+    'mes': ('%Y-%m', 'YYYY-MM'),
+    'ano': ('%Y', 'YYYY'),
+}
+
+
+class ReceitaRevendedor(NamedTuple):
+    revendedor_id: int
+    revendedor: str
+    periodo: str
+    notas: int
+    receita: float
+
+
+class NotasDia(NamedTuple):
+    dia: date
+    notas: int
+    valor_total: float
+
+
+class UnidadesPicole(NamedTuple):
+    picole_id: int
+    sabor: str
+    tipo_embalagem: str
+    tipo_picole: str
+    lotes: int
+    unidades: int
+
+
+class UnidadesSabor(NamedTuple):
+    sabor_id: int
+    sabor: str
+    unidades: int
+
+
+class UnidadesTipoPicole(NamedTuple):
+    tipo_picole_id: int
+    tipo_picole: str
+    unidades: int
+
+
+class Relatorios:
+
+    @staticmethod
+    def _expressaoPeriodo(coluna, periodo: str, dialeto: str):
+        """Monta a expressão que reduz uma data ao período, como texto ordenável, ex.: '2024-01' para o mês
+        :param coluna: coluna de data
+        :param periodo: str: 'dia', 'mes' ou 'ano'
+        :param dialeto: str: nome do dialeto da conexão
+        :return: expressão do SQLAlchemy
+        :raises ValueError: Se o período não for válido
+        """
+        if periodo not in PERIODOS:
+            raise ValueError(f'periodo deve ser um de {", ".join(PERIODOS)}!')
+        formato_sqlite, formato_postgres = PERIODOS[periodo]
+        if dialeto == 'postgresql':
+            return sa.func.to_char(coluna, formato_postgres)
+        return sa.func.strftime(formato_sqlite, coluna)
+
+    @staticmethod
+    def _filtroIntervalo(coluna, inicio: Optional[datetime], fim: Optional[datetime]) -> list:
+        """Monta os filtros do intervalo [inicio, fim) sobre a coluna de data
+        :raises TypeError: Se inicio ou fim não forem datas
+        :raises ValueError: Se inicio não for anterior a fim
+        """
+        for nome, valor in (('inicio', inicio), ('fim', fim)):
+            if valor is not None and not isinstance(valor, (date, datetime)):
+                raise TypeError(f'{nome} do relatório deve ser uma data!')
+        if inicio is not None and fim is not None and inicio >= fim:
+            raise ValueError('inicio do relatório deve ser anterior ao fim!')
+
+        filtros = []
+        if inicio is not None:
+            filtros.append(coluna >= inicio)
+        if fim is not None:
+            filtros.append(coluna < fim)
+        return filtros
+
+    @staticmethod
+    @retryTransitorio
+    async def receitaPorRevendedor(periodo: str = 'mes', inicio: datetime = None,
+                                   fim: datetime = None) -> list[ReceitaRevendedor]:
+        """Soma a receita das notas fiscais por revendedor e por período, no intervalo [inicio, fim)
+        :param periodo: str: 'dia', 'mes' ou 'ano'
+        :param inicio: datetime: data inicial, inclusiva; sem limite se não informada
+        :param fim: datetime: data final, exclusiva; sem limite se não informada
+        :return: list[ReceitaRevendedor]: ordenada por período e revendedor
+        :raises TypeError: Se inicio ou fim não forem datas
+        :raises ValueError: Se o período não for válido, ou se inicio não for anterior a fim
+        """
+        try:
+            filtros = Relatorios._filtroIntervalo(NotaFiscal.data_criacao, inicio, fim)
+            async with conexaoLeitura() as conexao:
+                expressao_periodo = Relatorios._expressaoPeriodo(NotaFiscal.data_criacao, periodo,
+                                                                 conexao.dialect.name)
+                # agrega primeiro, somente pelo índice, e junta o nome do revendedor às linhas já agregadas
+                agregado = (sa.select(NotaFiscal.revendedor_fk,
+                                      expressao_periodo.label('periodo'),
+                                      sa.func.count().label('notas'),
+                                      sa.func.sum(NotaFiscal.valor).label('receita'))
+                            .where(*filtros)
+                            .group_by(NotaFiscal.revendedor_fk, expressao_periodo)
+                            .subquery())
+                consulta = (sa.select(agregado.c.revendedor_fk, Revendedor.nome, agregado.c.periodo,
+                                      agregado.c.notas, agregado.c.receita)
+                            .join(Revendedor, Revendedor.id == agregado.c.revendedor_fk)
+                            .order_by(agregado.c.periodo, agregado.c.revendedor_fk))
+                linhas = (await conexao.execute(consulta)).all()
+
+            return [ReceitaRevendedor(revendedor_id, nome, periodo_, notas, round(float(receita), 2))
+                    for revendedor_id, nome, periodo_, notas, receita in linhas]
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except ValueError as ve:
+            raise ValueError(ve)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao calcular receita por revendedor: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def notasPorDia(inicio: datetime = None, fim: datetime = None) -> list[NotasDia]:
+        """Conta as notas fiscais e soma o valor por dia, no intervalo [inicio, fim)
+        :param inicio: datetime: data inicial, inclusiva; sem limite se não informada
+        :param fim: datetime: data final, exclusiva; sem limite se não informada
+        :return: list[NotasDia]: ordenada por dia
+        :raises TypeError: Se inicio ou fim não forem datas
+        :raises ValueError: Se inicio não for anterior a fim
+        """
+        try:
+            filtros = Relatorios._filtroIntervalo(NotaFiscal.data_criacao, inicio, fim)
+            async with conexaoLeitura() as conexao:
+                dia = Relatorios._expressaoPeriodo(NotaFiscal.data_criacao, 'dia', conexao.dialect.name)
+                consulta = (sa.select(dia, sa.func.count(), sa.func.sum(NotaFiscal.valor))
+                            .where(*filtros)
+                            .group_by(dia)
+                            .order_by(dia))
+                linhas = (await conexao.execute(consulta)).all()
+
+            return [NotasDia(date.fromisoformat(dia_), notas, round(float(valor_total), 2))
+                    for dia_, notas, valor_total in linhas]
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except ValueError as ve:
+            raise ValueError(ve)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao calcular notas por dia: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def unidadesPorPicole() -> list[UnidadesPicole]:
+        """Soma as unidades dos lotes por picolé
+        :return: list[UnidadesPicole]: ordenada pelo id do picolé, somente picolés com lotes
+        """
+        try:
+            async with conexaoLeitura() as conexao:
+                agregado = (sa.select(Lote.picole_fk,
+                                      sa.func.count().label('lotes'),
+                                      sa.func.sum(Lote.quantidade).label('unidades'))
+                            .group_by(Lote.picole_fk)
+                            .subquery())
+                consulta = (sa.select(agregado.c.picole_fk, Sabor.nome, TipoEmbalagem.nome, TipoPicole.nome,
+                                      agregado.c.lotes, agregado.c.unidades)
+                            .join(Picole, Picole.id == agregado.c.picole_fk)
+                            .join(Sabor, Sabor.id == Picole.sabor_fk)
+                            .join(TipoEmbalagem, TipoEmbalagem.id == Picole.tipo_embalagem_fk)
+                            .join(TipoPicole, TipoPicole.id == Picole.tipo_picole_fk)
+                            .order_by(agregado.c.picole_fk))
+                linhas = (await conexao.execute(consulta)).all()
+
+            return [UnidadesPicole(*linha) for linha in linhas]
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao calcular unidades por picolé: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def unidadesPorSabor() -> list[UnidadesSabor]:
+        """Soma as unidades dos lotes por sabor
+        :return: list[UnidadesSabor]: ordenada pelo nome do sabor, somente sabores com lotes
+        """
+        try:
+            async with conexaoLeitura() as conexao:
+                consulta = Relatorios._unidadesPor(Sabor, Picole.sabor_fk)
+                linhas = (await conexao.execute(consulta)).all()
+            return [UnidadesSabor(*linha) for linha in linhas]
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao calcular unidades por sabor: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def unidadesPorTipoPicole() -> list[UnidadesTipoPicole]:
+        """Soma as unidades dos lotes por tipo de picolé
+        :return: list[UnidadesTipoPicole]: ordenada pelo nome do tipo, somente tipos com lotes
+        """
+        try:
+            async with conexaoLeitura() as conexao:
+                consulta = Relatorios._unidadesPor(TipoPicole, Picole.tipo_picole_fk)
+                linhas = (await conexao.execute(consulta)).all()
+            return [UnidadesTipoPicole(*linha) for linha in linhas]
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao calcular unidades por tipo de picolé: {exc}')
+
+    @staticmethod
+    def _unidadesPor(model, fk_picole):
+        """Monta a consulta das unidades dos lotes agrupadas pela tabela do model (referenciada pela FK do picolé).
+        As unidades são somadas por picolé, pelo índice do lote, antes da junção com o picolé.
+        """
+        por_picole = (sa.select(Lote.picole_fk, sa.func.sum(Lote.quantidade).label('unidades'))
+                      .group_by(Lote.picole_fk)
+                      .subquery())
+        return (sa.select(model.id, model.nome, sa.func.sum(por_picole.c.unidades))
+                .select_from(por_picole)
+                .join(Picole, Picole.id == por_picole.c.picole_fk)
+                .join(model, model.id == fk_picole)
+                .group_by(model.id, model.nome)
+                .order_by(model.nome))
+
+    @staticmethod
+    async def criarIndices() -> list[str]:
+        """Cria os índices dos relatórios que ainda não existem no banco, para bancos criados antes deles
+        :return: list[str]: nomes dos índices verificados
+        """
+        indices = [indice for model in (NotaFiscal, Lote) for indice in model.__table__.indexes
+                   if indice.name in ('ix_nota_fiscal_data_criacao_revendedor_fk_valor',
+                                      'ix_lote_picole_fk_quantidade')]
+        async with sessionScope() as session:
+            conexao = await session.connection()
+            for indice in indices:
+                await conexao.run_sync(lambda conn, indice=indice: indice.create(conn, checkfirst=True))
+        log.info('Índices dos relatórios verificados: %s', ', '.join(indice.name for indice in indices))
+        return [indice.name for indice in indices]
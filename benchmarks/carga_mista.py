@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import math
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from conf.db_session import configurarBancoSqlite, conexaoLeitura, createEngine, ehBancoMemoria
+from conf.helpers import definir_semente, obter_gerador
+from conf.retry import estatisticasRetry, zerarEstatisticasRetry
+from conf.sqlite_writer import ativarSqliteWriter, desativarSqliteWriter
+from conf.unit_of_work import UnitOfWork
+from ScriptsAuxiliares.GeradorDados import LINHAS_BASE, popular
+from models.lote import Lote
+from models.lote_nota_fiscal import LoteNotaFiscal
+from models.nota_fiscal import NotaFiscal
+from models.picole import Picole
+from models.picole_catalog import PicoleCatalog
+from models.revendedor import Revendedor
+
+# Gerador de carga mista e concorrente sobre os models: N clientes virtuais (tarefas asyncio) executam, durante
+# --duracao segundos, operações sorteadas conforme o mix configurado:
+#     catalogo   navegação no catálogo, PicoleCatalog.selectCatalogoPorSabor
+#     nota       criação de uma venda: NotaFiscal + Lote + LoteNotaFiscal em um único UnitOfWork
+#     preco      atualização do preço de um picolé, Picole.updatePicole
+#     busca      busca de nota fiscal por numero_serie ou de revendedor por cnpj
+# Com --taxa, os clientes dividem a taxa alvo (operações/s no total) e cada um agenda as operações em intervalos fixos;
+# a latência é medida a partir do horário agendado, e não do início efetivo, para que um banco lento não esconda a
+# fila formada nos clientes. Sem --taxa, cada cliente executa as operações uma atrás da outra.
+#
+# O relatório traz a vazão alcançada, as latências p50/p95/p99 por operação, os erros por tipo, os retries de
+# conf/retry.py e, a cada --intervalo segundos, a saturação do pool: conexões em uso (atual e máximo no intervalo),
+# o limite do pool, quando houver, e a profundidade da fila do SqliteWriter (--escritor).
+#
+# Uso:
+#     python -m benchmarks.carga_mista --clientes 32 --duracao 30 --taxa 500
+#     python -m benchmarks.carga_mista --clientes 64 --mix catalogo=40,nota=30,preco=10,busca=20 --escritor
+#     python -m benchmarks.carga_mista --banco db/picoles.sqlite --sem-popular --saida carga.json
+#     python -m benchmarks.carga_mista --banco 'file::memory:?cache=shared'   # sem E/S de disco
+
+MIX_PADRAO = 'catalogo=50,nota=20,preco=10,busca=20'
+
+
+def percentil(tempos: list[float], p: float) -> float:
+    """Percentil pelo método do posto mais próximo, de tempos já ordenados"""
+    return tempos[max(0, math.ceil(p / 100 * len(tempos)) - 1)] if tempos else 0.0
+
+
+class MonitorPool:
+
+    def __init__(self, engine, intervalo: float):
+        """Acompanha as conexões retiradas do pool da engine pelos eventos checkout/checkin
+        :param engine: AsyncEngine: engine monitorada
+        :param intervalo: float: segundos entre as amostras
+        """
+        self.engine = engine
+        self.intervalo = intervalo
+        self.em_uso = 0
+        self.maximo = 0
+        self.amostras: list[dict] = []
+        self._tarefa = None
+
+        @event.listens_for(engine.sync_engine, 'checkout')
+        def _checkout(dbapi_connection, connection_record, connection_proxy):
+            self.em_uso += 1
+            self.maximo = max(self.maximo, self.em_uso)
+
+        @event.listens_for(engine.sync_engine, 'checkin')
+        def _checkin(dbapi_connection, connection_record):
+            self.em_uso -= 1
+
+    def limite(self) -> int or None:
+        """Quantidade máxima de conexões do pool, ou None para pools sem limite (NullPool do sqlite)"""
+        pool = self.engine.pool
+        if hasattr(pool, 'size') and hasattr(pool, '_max_overflow'):
+            return pool.size() + max(pool._max_overflow, 0)
+        return None
+
+    async def _amostrar(self, inicio: float, escritor) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            limite = self.limite()
+            self.amostras.append({
+                't_s': round(time.perf_counter() - inicio, 2),
+                'em_uso': self.em_uso,
+                'maximo': self.maximo,
+                'limite': limite,
+                'saturacao': round(self.maximo / limite, 2) if limite else None,
+                'fila_escritor': escritor.profundidade if escritor is not None else None,
+            })
+            # o máximo é do intervalo: recomeça a partir das conexões em uso agora
+            self.maximo = self.em_uso
+
+    def iniciar(self, inicio: float, escritor=None) -> None:
+        self._tarefa = asyncio.create_task(self._amostrar(inicio, escritor))
+
+    async def parar(self) -> None:
+        self._tarefa.cancel()
+        try:
+            await self._tarefa
+        except asyncio.CancelledError:
+            pass
+
+
+class CargaMista:
+
+    def __init__(self, mix: dict[str, int]):
+        """Cria as operações da carga a partir dos ids já gravados no banco
+        :param mix: dict[str, int]: peso de cada operação
+        :raises ValueError: Se o mix tiver uma operação desconhecida
+        """
+        operacoes = {'catalogo': self.catalogo, 'nota': self.nota, 'preco': self.preco, 'busca': self.busca}
+        desconhecidas = set(mix) - set(operacoes)
+        if desconhecidas:
+            raise ValueError(f'operações desconhecidas no mix: {", ".join(sorted(desconhecidas))}; '
+                             f'use {", ".join(operacoes)}')
+        self.nomes = [nome for nome in mix if mix[nome] > 0]
+        self.operacoes: list[Callable[[], Awaitable]] = [operacoes[nome] for nome in self.nomes]
+        self.pesos = [mix[nome] for nome in self.nomes]
+        self.rng = obter_gerador()
+        self.sabores: list[str] = []
+        self.picoles: list[int] = []
+        # sabor_fk, tipo_embalagem_fk e tipo_picole_fk de cada picolé, repetidos na atualização do preço
+        self.fks_picole: dict[int, tuple[int, int, int]] = {}
+        self.revendedores: list[int] = []
+        self.numeros_serie: list[str] = []
+        self.cnpjs: list[str] = []
+
+    async def carregarIds(self) -> None:
+        """Lê os valores sorteados pelas operações
+        :raises RuntimeError: Se o banco não estiver populado
+        """
+        async with conexaoLeitura() as conexao:
+            self.sabores = (await conexao.execute(sa.select(PicoleCatalog.sabor).distinct())).scalars().all()
+            linhas = (await conexao.execute(sa.select(Picole.id, Picole.sabor_fk, Picole.tipo_embalagem_fk,
+                                                      Picole.tipo_picole_fk))).all()
+            self.fks_picole = {id_: tuple(fks) for id_, *fks in linhas}
+            self.picoles = list(self.fks_picole)
+            self.revendedores = (await conexao.execute(sa.select(Revendedor.id))).scalars().all()
+            self.cnpjs = (await conexao.execute(sa.select(Revendedor.cnpj).limit(1000))).scalars().all()
+            self.numeros_serie = (await conexao.execute(
+                sa.select(NotaFiscal.numero_serie).order_by(sa.func.random()).limit(1000))).scalars().all()
+        if not (self.sabores and self.picoles and self.revendedores and self.numeros_serie):
+            raise RuntimeError('O banco precisa estar populado (catálogo, picolés, revendedores e notas fiscais).')
+
+    def sortear(self) -> tuple[str, Callable[[], Awaitable]]:
+        indice = self.rng.choices(range(len(self.nomes)), weights=self.pesos)[0]
+        return self.nomes[indice], self.operacoes[indice]
+
+    async def catalogo(self):
+        return await PicoleCatalog.selectCatalogoPorSabor(self.rng.choice(self.sabores))
+
+    async def nota(self):
+        revendedor_fk = self.rng.choice(self.revendedores)
+        picole_fk = self.rng.choice(self.picoles)
+        numero_serie = uuid.uuid4().hex[:20].upper()
+
+        async def _registrarVenda():
+            nota_fiscal = await NotaFiscal.insertNotaFiscal(round(self.rng.uniform(10, 999), 2), numero_serie,
+                                                            'VENDA CARGA MISTA', revendedor_fk)
+            lote = await Lote.insertLote(picole_fk, self.rng.randint(1, 100))
+            await LoteNotaFiscal.insertLoteNotaFiscal(nota_fiscal.id, lote.id)
+            return nota_fiscal
+
+        nota_fiscal = await UnitOfWork.executar(_registrarVenda)
+        self.numeros_serie.append(nota_fiscal.numero_serie)
+        return nota_fiscal
+
+    async def preco(self):
+        picole_id = self.rng.choice(self.picoles)
+        return await Picole.updatePicole(picole_id, round(self.rng.uniform(1, 9), 2), *self.fks_picole[picole_id])
+
+    async def busca(self):
+        if self.rng.random() < 0.5:
+            return await NotaFiscal.selectNotaFiscalPorNumeroSerie(self.rng.choice(self.numeros_serie))
+        return await Revendedor.selectRevendedorPorCnpj(self.rng.choice(self.cnpjs))
+
+
+async def cliente(carga: CargaMista, fim: float, intervalo: float, deslocamento: float, latencias: dict,
+                  erros: Counter, atrasos: list) -> None:
+    """Cliente virtual: executa operações sorteadas até o fim da carga
+    :param carga: CargaMista: operações e valores sorteados
+    :param fim: float: horário (perf_counter) de término
+    :param intervalo: float: segundos entre as operações do cliente; 0 para executar uma atrás da outra
+    :param deslocamento: float: atraso inicial, para que os clientes não comecem todos juntos
+    :param latencias: dict: tempos em microssegundos por operação, preenchido pelo cliente
+    :param erros: Counter: erros por 'operacao: TipoDoErro', preenchido pelo cliente
+    :param atrasos: list: atraso, em microssegundos, do início efetivo em relação ao agendado
+    """
+    agendado = time.perf_counter() + deslocamento
+    while agendado < fim:
+        if intervalo:
+            espera = agendado - time.perf_counter()
+            if espera > 0:
+                await asyncio.sleep(espera)
+        else:
+            agendado = time.perf_counter()
+
+        nome, operacao = carga.sortear()
+        inicio = time.perf_counter()
+        atrasos.append((inicio - agendado) * 1e6)
+        try:
+            await operacao()
+            latencias[nome].append((time.perf_counter() - agendado) * 1e6)
+        except Exception as exc:
+            erros[f'{nome}: {type(exc).__name__}'] += 1
+        agendado += intervalo
+
+
+async def executar(clientes: int, duracao: float, taxa: float, mix: dict[str, int], intervalo: float,
+                   escritor: bool) -> dict:
+    """Executa a carga mista no banco da engine padrão
+    :param clientes: int: quantidade de clientes virtuais
+    :param duracao: float: duração da carga em segundos
+    :param taxa: float: operações por segundo alvo, somando todos os clientes; 0 para sem limite
+    :param mix: dict[str, int]: peso de cada operação
+    :param intervalo: float: segundos entre as amostras do pool
+    :param escritor: bool: se True, as escritas passam pelo SqliteWriter
+    :return: dict: relatório da carga
+    """
+    carga = CargaMista(mix)
+    await carga.carregarIds()
+
+    monitor = MonitorPool(createEngine(), intervalo)
+    sqlite_writer = await ativarSqliteWriter() if escritor else None
+    zerarEstatisticasRetry()
+
+    latencias = defaultdict(list)
+    erros = Counter()
+    atrasos = []
+    intervalo_cliente = clientes / taxa if taxa else 0.0
+    inicio = time.perf_counter()
+    fim = inicio + duracao
+    monitor.iniciar(inicio, sqlite_writer)
+    try:
+        await asyncio.gather(*(cliente(carga, fim, intervalo_cliente, intervalo_cliente * i / clientes, latencias,
+                                       erros, atrasos)
+                               for i in range(clientes)))
+    finally:
+        decorrido = time.perf_counter() - inicio
+        await monitor.parar()
+        if escritor:
+            await desativarSqliteWriter()
+
+    retries = estatisticasRetry()
+    concluidas = sum(len(tempos) for tempos in latencias.values())
+    por_operacao = {}
+    for nome, tempos in sorted(latencias.items()):
+        tempos.sort()
+        por_operacao[nome] = {'concluidas': len(tempos), 'ops_s': len(tempos) / decorrido,
+                              'p50_us': percentil(tempos, 50), 'p95_us': percentil(tempos, 95),
+                              'p99_us': percentil(tempos, 99)}
+    atrasos.sort()
+    return {
+        'clientes': clientes,
+        'duracao_s': round(decorrido, 2),
+        'taxa_alvo': taxa,
+        'mix': mix,
+        'concluidas': concluidas,
+        'ops_s': concluidas / decorrido,
+        'atraso_p99_us': percentil(atrasos, 99),
+        'operacoes': por_operacao,
+        'erros': dict(erros),
+        'retries': sum(valor for chave, valor in retries.items() if chave.endswith('.retries')),
+        'retries_esgotados': sum(valor for chave, valor in retries.items() if chave.endswith('.esgotadas')),
+        'pool': monitor.amostras,
+    }
+
+
+def imprimir(relatorio: dict) -> None:
+    print(f'{relatorio["concluidas"]} operações em {relatorio["duracao_s"]}s: {relatorio["ops_s"]:.0f} ops/s '
+          f'(alvo: {relatorio["taxa_alvo"] or "sem limite"}), atraso p99 {relatorio["atraso_p99_us"]:.0f} µs')
+    print(f'{"operação":<10} {"concluídas":>10} {"ops/s":>8} {"p50 µs":>10} {"p95 µs":>10} {"p99 µs":>10}')
+    for nome, r in relatorio['operacoes'].items():
+        print(f'{nome:<10} {r["concluidas"]:>10} {r["ops_s"]:>8.1f} {r["p50_us"]:>10.0f} {r["p95_us"]:>10.0f} '
+              f'{r["p99_us"]:>10.0f}')
+    print(f'erros: {sum(relatorio["erros"].values())} {relatorio["erros"] or ""}')
+    print(f'retries: {relatorio["retries"]} (esgotados: {relatorio["retries_esgotados"]})')
+    print(f'{"t (s)":>7} {"em uso":>7} {"máximo":>7} {"limite":>7} {"fila escritor":>14}')
+    for amostra in relatorio['pool']:
+        print(f'{amostra["t_s"]:>7} {amostra["em_uso"]:>7} {amostra["maximo"]:>7} '
+              f'{amostra["limite"] if amostra["limite"] is not None else "-":>7} '
+              f'{amostra["fila_escritor"] if amostra["fila_escritor"] is not None else "-":>14}')
+
+
+def _interpretarMix(texto: str) -> dict[str, int]:
+    """Converte 'catalogo=50,nota=20' em {'catalogo': 50, 'nota': 20}"""
+    return {nome.strip(): int(peso) for nome, peso in (parte.split('=') for parte in texto.split(','))}
+
+
+async def main(args) -> dict:
+    definir_semente(args.seed)
+    await configurarBancoSqlite(args.banco)
+    if not args.sem_popular:
+        await popular(scale=args.linhas / sum(LINHAS_BASE.values()), seed=args.seed, recriar=True)
+    return await executar(args.clientes, args.duracao, args.taxa, _interpretarMix(args.mix), args.intervalo,
+                          args.escritor)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Carga mista e concorrente sobre os models')
+    parser.add_argument('--clientes', type=int, default=16, help='quantidade de clientes virtuais')
+    parser.add_argument('--duracao', type=float, default=10, help='duração da carga em segundos')
+    parser.add_argument('--taxa', type=float, default=0, help='operações por segundo alvo, no total; 0 sem limite')
+    parser.add_argument('--mix', default=MIX_PADRAO, help=f'peso de cada operação, padrão {MIX_PADRAO}')
+    parser.add_argument('--intervalo', type=float, default=1.0, help='segundos entre as amostras do pool')
+    parser.add_argument('--escritor', action='store_true', help='escritas pelo SqliteWriter')
+    parser.add_argument('--banco', default=str(Path(tempfile.gettempdir()) / 'picoles_carga.sqlite'),
+                        help="arquivo sqlite da carga, ou 'file::memory:?cache=shared'")
+    parser.add_argument('--linhas', type=int, default=10_000, help='linhas totais do banco populado antes da carga')
+    parser.add_argument('--sem-popular', action='store_true', help='usa o banco como está, sem popular')
+    parser.add_argument('--seed', type=int, default=42, help='semente dos dados e dos sorteios')
+    parser.add_argument('--saida', default=None, help='arquivo JSON do relatório')
+    args = parser.parse_args()
+    if args.banco == ':memory:':
+        # o banco em memória tem uma única conexão, que não pode ser compartilhada por transações concorrentes
+        parser.error('a carga concorrente precisa de um arquivo sqlite ou de file::memory:?cache=shared, '
+                     'não de :memory:')
+
+    if not args.sem_popular and not ehBancoMemoria(args.banco):
+        for extra in ('', '-wal', '-shm', '-journal'):
+            Path(args.banco + extra).unlink(missing_ok=True)
+
+    relatorio = asyncio.run(main(args))
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding='utf-8')
+    imprimir(relatorio)
+    sys.exit(1 if relatorio['erros'] else 0)
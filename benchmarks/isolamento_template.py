@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from conf.db_session import configurarBancoSqlite, createTables, descartarEngine
+from conf.template_db import criarTemplate, usarTemplate
+from models.sabor import Sabor
+from ScriptsAuxiliares.GeradorDados import popular
+
+# Benchmark do isolamento por teste: mede quanto custa entregar a cada teste um banco próprio, pronto para uso, por
+# cada um dos métodos:
+#     recriar     banco novo com createTables (e a carga de dados, com --scale), como sem o template
+#     copia       cópia do arquivo do template (conf/template_db.py)
+#     backup      cópia pela API de backup do sqlite
+#     memoria     carga do template em um banco em memória compartilhado, sem E/S de disco
+# Cada isolamento abre o banco, executa uma consulta e descarta a engine. Com --processos, os isolamentos são
+# divididos entre processos, como os workers do pytest-xdist, e é medido o tempo total.
+#
+# Uso:
+#     python -m benchmarks.isolamento_template --testes 50
+#     python -m benchmarks.isolamento_template --testes 200 --scale 0.1 --processos 4 --metodos copia,memoria
+
+METODOS = ('recriar', 'copia', 'backup', 'memoria')
+
+
+async def isolar(metodo: str, template: Path, indice: int, scale: float, seed: int) -> None:
+    """Entrega um banco isolado pelo método informado, executa uma consulta e descarta a engine"""
+    arquivo = Path(tempfile.gettempdir()) / f'picoles_isolamento_{os.getpid()}_{indice}.sqlite'
+    if metodo == 'memoria':
+        await usarTemplate(template, f'file:isolamento_{indice}?mode=memory&cache=shared')
+        arquivo = None
+    elif metodo == 'recriar':
+        await configurarBancoSqlite(str(arquivo))
+        if scale is not None:
+            await popular(scale=scale, seed=seed, recriar=True)
+        else:
+            await createTables()
+    else:
+        await usarTemplate(template, arquivo, backup=metodo == 'backup')
+
+    await Sabor.selectAllSabores()
+    await descartarEngine()
+    if arquivo is not None:
+        for extra in ('', '-wal', '-shm', '-journal'):
+            arquivo.with_name(arquivo.name + extra).unlink(missing_ok=True)
+
+
+def _executarLote(metodo: str, template: Path, indices: list[int], scale: float, seed: int) -> list[float]:
+    """Executa os isolamentos de um processo e retorna o tempo de cada um, em milissegundos"""
+
+    async def _lote():
+        tempos = []
+        for indice in indices:
+            inicio = time.perf_counter()
+            await isolar(metodo, template, indice, scale, seed)
+            tempos.append((time.perf_counter() - inicio) * 1e3)
+        return tempos
+
+    return asyncio.run(_lote())
+
+
+def main(testes: int, metodos: list[str], scale: float, seed: int, processos: int) -> None:
+    inicio = time.perf_counter()
+    template = asyncio.run(criarTemplate(scale=scale, seed=seed))
+    print(f'template {template} ({template.stat().st_size / 1024:.0f} KiB) em '
+          f'{(time.perf_counter() - inicio) * 1e3:.0f} ms (reaproveitado se já existia)')
+    print(f'{"método":<10} {"testes":>7} {"total s":>9} {"média ms":>9} {"p95 ms":>8}')
+
+    for metodo in metodos:
+        indices = list(range(testes))
+        inicio = time.perf_counter()
+        if processos > 1:
+            with ProcessPoolExecutor(processos) as executor:
+                partes = [indices[i::processos] for i in range(processos)]
+                tempos = [tempo for parte in executor.map(_executarLote, [metodo] * processos, [template] * processos,
+                                                          partes, [scale] * processos, [seed] * processos)
+                          for tempo in parte]
+        else:
+            tempos = _executarLote(metodo, template, indices, scale, seed)
+        total = time.perf_counter() - inicio
+        tempos.sort()
+        print(f'{metodo:<10} {testes:>7} {total:>9.2f} {statistics.fmean(tempos):>9.2f} '
+              f'{tempos[int(len(tempos) * 0.95) - 1 if len(tempos) > 1 else 0]:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Custo do isolamento por teste: recriar o schema x clonar o template')
+    parser.add_argument('--testes', type=int, default=50, help='isolamentos por método')
+    parser.add_argument('--metodos', default=','.join(METODOS), help=f'métodos medidos, entre {", ".join(METODOS)}')
+    parser.add_argument('--scale', type=float, default=None, help='escala dos dados do template; padrão, só o schema')
+    parser.add_argument('--seed', type=int, default=42, help='semente dos dados do template')
+    parser.add_argument('--processos', type=int, default=1, help='processos que dividem os isolamentos')
+    args = parser.parse_args()
+    main(args.testes, [metodo.strip() for metodo in args.metodos.split(',')], args.scale, args.seed, args.processos)
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import sqlalchemy as sa
+
+from conf.db_session import escopoSessao, conexaoLeitura
+from models.lote import Lote
+from models.nota_fiscal import NotaFiscal
+from models.picole import Picole
+
+# Microbenchmark das leituras frequentes: compara as consultas ORM dos models com o caminho rápido Core, que executa
+# o select() direto na conexão. As duas variantes rodam dentro de escopoSessao, na mesma conexão, para medir somente o
+# custo de cada caminho, sem a abertura de conexões.
+# Somente lê o banco configurado, que precisa ter ao menos um Lote e uma NotaFiscal.
+#
+# Uso:
+#     python -m benchmarks.leitura_core_vs_orm --iteracoes 5000
+
+
+async def medir(funcao, iteracoes: int, aquecimento: int = 50) -> dict:
+    """Executa a função várias vezes e mede o tempo de cada chamada
+    :param funcao: função sem parâmetros que retorna a coroutine medida
+    :param iteracoes: int: quantidade de chamadas medidas
+    :param aquecimento: int: quantidade de chamadas descartadas antes da medição
+    :return: dict: operações por segundo, média, p50 e p95 em microssegundos
+    """
+    for _ in range(aquecimento):
+        await funcao()
+
+    tempos = []
+    inicio_total = time.perf_counter()
+    for _ in range(iteracoes):
+        inicio = time.perf_counter()
+        await funcao()
+        tempos.append((time.perf_counter() - inicio) * 1e6)
+    total = time.perf_counter() - inicio_total
+
+    tempos.sort()
+    return {
+        'ops_s': iteracoes / total,
+        'media_us': statistics.fmean(tempos),
+        'p50_us': tempos[len(tempos) // 2],
+        'p95_us': tempos[int(len(tempos) * 0.95) - 1],
+    }
+
+
+async def main(iteracoes: int) -> None:
+    async with escopoSessao():
+        async with conexaoLeitura() as conexao:
+            picole_id = (await conexao.execute(sa.select(Lote.picole_fk).limit(1))).scalar()
+            numero_serie = (await conexao.execute(sa.select(NotaFiscal.numero_serie).limit(1))).scalar()
+        if picole_id is None or numero_serie is None:
+            raise SystemExit('O banco precisa ter ao menos um Lote e uma NotaFiscal, popule-o antes do benchmark.')
+
+        casos = [
+            ('preço do picolé por id',
+             lambda: Picole.selectPicolePorId(picole_id),
+             lambda: Picole.selectPrecoPicolePorId(picole_id)),
+            ('nota fiscal por numero_serie',
+             lambda: NotaFiscal.selectNotaFiscalPorNumeroSerie(numero_serie),
+             lambda: NotaFiscal.selectCabecalhoNotaFiscalPorNumeroSerie(numero_serie)),
+            ('lotes por picolé',
+             lambda: Lote.selectLotesPorPicoleFk(picole_id),
+             lambda: Lote.selectLinhasLotePorPicoleFk(picole_id)),
+        ]
+
+        print(f'{"consulta":<30} {"caminho":<5} {"ops/s":>10} {"média µs":>10} {"p50 µs":>10} {"p95 µs":>10}')
+        for nome, orm, core in casos:
+            resultados = {'orm': await medir(orm, iteracoes), 'core': await medir(core, iteracoes)}
+            for caminho, r in resultados.items():
+                print(f'{nome:<30} {caminho:<5} {r["ops_s"]:>10.0f} {r["media_us"]:>10.1f} '
+                      f'{r["p50_us"]:>10.1f} {r["p95_us"]:>10.1f}')
+            print(f'{"":<30} ganho do Core: {resultados["orm"]["media_us"] / resultados["core"]["media_us"]:.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compara as leituras ORM e Core dos models')
+    parser.add_argument('--iteracoes', type=int, default=2000, help='chamadas medidas por consulta')
+    args = parser.parse_args()
+    asyncio.run(main(args.iteracoes))
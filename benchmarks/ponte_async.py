@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from conf.db_session import configurarBancoSqlite, createEngine, createSyncEngine, createTablesSync, descartarEngine
+from models.revendedor import Revendedor
+
+# Benchmark do custo da ponte async em trabalhos em lote, em um único processo: as mesmas cargas são executadas no
+# mesmo banco sqlite pela engine padrão (aiosqlite: cada comando vai para a thread do driver e volta pela ponte de
+# greenlets do SQLAlchemy) e pela engine síncrona gêmea (createSyncEngine: sqlite3 direto na thread atual).
+#     insert_lote     --linhas linhas em inserts em lote (executemany) de --bloco linhas, uma transação por bloco
+#     insert_linha    --linhas inserts de uma linha, em uma única transação
+#     select_lote     a tabela inteira lida de uma vez, --leituras vezes
+#     select_id       --linhas selects pelo id, em uma única conexão
+# Para cada carga vale a execução mais rápida entre --repeticoes; o custo da ponte por comando é a diferença entre os
+# tempos dividida pela quantidade de comandos.
+#
+# Uso:
+#     python -m benchmarks.ponte_async
+#     python -m benchmarks.ponte_async --linhas 50000 --bloco 1000 --repeticoes 5
+
+TABELA = Revendedor.__table__
+
+
+def _linhas(quantidade: int) -> list[dict]:
+    return [{'nome': f'Revendedor {i}', 'cnpj': f'{i:014d}', 'razao_social': f'Revendedor {i} LTDA',
+             'contato': f'contato{i}@picoles.com'} for i in range(quantidade)]
+
+
+def _blocos(linhas: list[dict], bloco: int) -> list[list[dict]]:
+    return [linhas[inicio:inicio + bloco] for inicio in range(0, len(linhas), bloco)]
+
+
+async def _async(carga: str, linhas: list[dict], bloco: int, leituras: int) -> int:
+    """Executa a carga pela engine async e retorna a quantidade de comandos"""
+    engine = createEngine()
+    async with engine.connect() as conexao:
+        if carga == 'insert_lote':
+            for parte in _blocos(linhas, bloco):
+                async with conexao.begin():
+                    await conexao.execute(sa.insert(TABELA), parte)
+            return len(_blocos(linhas, bloco))
+        if carga == 'insert_linha':
+            async with conexao.begin():
+                for linha in linhas:
+                    await conexao.execute(sa.insert(TABELA), linha)
+            return len(linhas)
+        if carga == 'select_lote':
+            async with conexao.begin():
+                for _ in range(leituras):
+                    (await conexao.execute(sa.select(TABELA))).all()
+            return leituras
+        async with conexao.begin():
+            ids = (await conexao.execute(sa.select(TABELA.c.id))).scalars().all()
+            consulta = sa.select(TABELA).where(TABELA.c.id == sa.bindparam('id'))
+            for id_ in ids:
+                (await conexao.execute(consulta, {'id': id_})).one()
+        return len(ids)
+
+
+def _sync(carga: str, linhas: list[dict], bloco: int, leituras: int) -> int:
+    """Executa a carga pela engine síncrona e retorna a quantidade de comandos"""
+    engine = createSyncEngine()
+    with engine.connect() as conexao:
+        if carga == 'insert_lote':
+            for parte in _blocos(linhas, bloco):
+                with conexao.begin():
+                    conexao.execute(sa.insert(TABELA), parte)
+            return len(_blocos(linhas, bloco))
+        if carga == 'insert_linha':
+            with conexao.begin():
+                for linha in linhas:
+                    conexao.execute(sa.insert(TABELA), linha)
+            return len(linhas)
+        if carga == 'select_lote':
+            with conexao.begin():
+                for _ in range(leituras):
+                    conexao.execute(sa.select(TABELA)).all()
+            return leituras
+        with conexao.begin():
+            ids = conexao.execute(sa.select(TABELA.c.id)).scalars().all()
+            consulta = sa.select(TABELA).where(TABELA.c.id == sa.bindparam('id'))
+            for id_ in ids:
+                conexao.execute(consulta, {'id': id_}).one()
+        return len(ids)
+
+
+def _limpar() -> None:
+    with createSyncEngine().begin() as conexao:
+        conexao.execute(sa.delete(TABELA))
+
+
+async def main(banco: str, linhas: int, bloco: int, leituras: int, repeticoes: int) -> None:
+    for extra in ('', '-wal', '-shm', '-journal'):
+        Path(banco + extra).unlink(missing_ok=True)
+    await configurarBancoSqlite(banco)
+    createTablesSync()
+    dados = _linhas(linhas)
+
+    print(f'{"carga":<14} {"comandos":>9} {"async s":>9} {"sync s":>9} {"async/sync":>11} {"ponte µs/cmd":>13}')
+    for carga in ('insert_lote', 'insert_linha', 'select_lote', 'select_id'):
+        tempos = {'async': [], 'sync': []}
+        comandos = 0
+        for _ in range(repeticoes):
+            # as duas engines se alternam, e as cargas de insert partem sempre da tabela vazia
+            for variante in ('async', 'sync'):
+                if carga.startswith('insert'):
+                    _limpar()
+                inicio = time.perf_counter()
+                if variante == 'async':
+                    comandos = await _async(carga, dados, bloco, leituras)
+                else:
+                    comandos = _sync(carga, dados, bloco, leituras)
+                tempos[variante].append(time.perf_counter() - inicio)
+        melhor_async, melhor_sync = min(tempos['async']), min(tempos['sync'])
+        print(f'{carga:<14} {comandos:>9} {melhor_async:>9.3f} {melhor_sync:>9.3f} '
+              f'{melhor_async / melhor_sync:>10.2f}x {(melhor_async - melhor_sync) / comandos * 1e6:>13.1f}')
+
+    await descartarEngine()
+    for extra in ('', '-wal', '-shm', '-journal'):
+        Path(banco + extra).unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Custo da ponte async em trabalhos em lote: engine async x síncrona')
+    parser.add_argument('--banco', default=str(Path(tempfile.gettempdir()) / 'picoles_ponte.sqlite'),
+                        help='arquivo sqlite do benchmark, recriado a cada execução')
+    parser.add_argument('--linhas', type=int, default=10_000, help='linhas inseridas e lidas')
+    parser.add_argument('--bloco', type=int, default=500, help='linhas por insert em lote')
+    parser.add_argument('--leituras', type=int, default=20, help='leituras da tabela inteira em select_lote')
+    parser.add_argument('--repeticoes', type=int, default=3, help='execuções de cada carga; vale a mais rápida')
+    args = parser.parse_args()
+    asyncio.run(main(args.banco, args.linhas, args.bloco, args.leituras, args.repeticoes))
@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import inspect
+import json
+import math
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+import sqlalchemy as sa
+
+from conf.db_session import (configurarBancoSqlite, createEngine, ehBancoMemoria, escopoSessao, sessaoEscrita,
+                             sessionScope)
+from conf.helpers import obter_gerador
+from ScriptsAuxiliares.GeradorDados import GeradorDados, LINHAS_BASE, popular
+from models.aditivo_nutritivo import AditivoNutritivo
+from models.aditivo_nutritivo_picole import AditivoNutritivoPicole
+from models.conservante import Conservante
+from models.conservante_picole import ConservantePicole
+from models.ingrediente import Ingrediente
+from models.ingrediente_picole import IngredientePicole
+from models.lote import Lote
+from models.lote_nota_fiscal import LoteNotaFiscal
+from models.nota_fiscal import NotaFiscal
+from models.picole import Picole
+from models.picole_catalog import PicoleCatalog
+from models.picole_stock import PicoleStock
+from models.revendedor import Revendedor
+from models.revendedor_daily_sales import RevendedorDailySales
+from models.sabor import Sabor
+from models.tipo_embalagem import TipoEmbalagem
+from models.tipo_picole import TipoPicole
+
+# Suíte de benchmarks das operações dos models, em várias escalas de dados. Para cada escala, um banco sqlite próprio
+# (um arquivo temporário ou ':memory:', nunca db/picoles.sqlite) é populado com ScriptsAuxiliares/GeradorDados.py e,
+# para cada model, são medidos a vazão e as latências p50/p95/p99 de:
+#     insert          insert de uma linha pelo método insert do model
+#     insert_lote     insert em lote (executemany) de --tamanho-lote linhas por chamada; vazão em linhas/s
+#     select_id       select pelo id, pelo método do model
+#     select_fk       select pela FK principal do model, pelo método do model
+#     listar          primeira página (--tamanho-pagina linhas) ordenada pela chave primária
+#     paginar         página em um offset sorteado
+#     update          update pelo método do model, em ids sorteados do conjunto de dados
+#     delete          delete pelo id, das linhas inseridas pelo próprio benchmark
+# Os models derivados (catálogo e rollups) são somente de leitura e medem apenas as consultas.
+# As escalas são a quantidade total de linhas do banco, distribuída entre as tabelas na proporção de LINHAS_BASE.
+#
+# O resultado é gravado em JSON. Com --comparar, os resultados são comparados com um baseline gravado antes e o
+# processo termina com código 1 se alguma métrica acompanhada piorar além de --limite:
+#     python -m benchmarks.suite_models --linhas 10k,100k,1M --saida baseline.json
+#     python -m benchmarks.suite_models --linhas 10k --banco :memory: --comparar baseline.json --limite 0.15
+#     python -m benchmarks.suite_models --entrada atual.json --comparar baseline.json
+
+OPERACOES = ('insert', 'insert_lote', 'select_id', 'select_fk', 'listar', 'paginar', 'update', 'delete')
+
+# métricas em que um valor maior é uma piora; nas demais (vazão), um valor menor é uma piora
+METRICAS_LATENCIA = {'media_us', 'p50_us', 'p95_us', 'p99_us'}
+
+
+class CasoModel(NamedTuple):
+    model: type
+    # nomes dos métodos do model; None quando o model não tem a operação
+    insert: Optional[str]
+    select_id: Optional[str]
+    select_fk: Optional[str]
+    # coluna usada como argumento de select_fk
+    fk: Optional[str]
+    # update(id, linha): atualiza o id com os valores de uma linha nova do GeradorDados
+    update: Optional[Callable[[int, dict], Awaitable]]
+    delete: Optional[str]
+
+
+CASOS = [
+    CasoModel(AditivoNutritivo, 'insertAditivoNutritivo', 'selectAditivoNutritivoPorId', None, None,
+              lambda id_, linha: AditivoNutritivo.updateAditivoNutritivo(id_, linha['nome'], linha['formula_quimica']),
+              'deleteAditivoNutritivoById'),
+    CasoModel(Sabor, 'insertSabor', 'selectSaborPorId', None, None,
+              lambda id_, linha: Sabor.updateSabor(id_, linha['nome']), 'deleteSaborById'),
+    CasoModel(TipoEmbalagem, 'insertTipoEmbalagem', 'selectTipoEmbalagemPorId', None, None,
+              lambda id_, linha: TipoEmbalagem.updateTipoEmbalagem(id_, linha['nome']), 'deleteTipoEmbalagemById'),
+    CasoModel(TipoPicole, 'insertTipoPicole', 'selectTipoPicolePorId', None, None,
+              lambda id_, linha: TipoPicole.updateTipoPicole(id_, linha['nome']), 'deleteTipoPicoleById'),
+    CasoModel(Ingrediente, 'insertIngrediente', 'selectIngredientePorId', None, None,
+              lambda id_, linha: Ingrediente.updateIngrediente(id_, linha['nome']), 'deleteIngredienteById'),
+    CasoModel(Conservante, 'insertConservante', 'selectConservantePorID', None, None,
+              lambda id_, linha: Conservante.updateConservante(id_, linha['nome'], linha['descricao']),
+              'deleteConservanteById'),
+    CasoModel(Revendedor, 'insertRevendedor', 'selectRevendedorPorId', None, None,
+              lambda id_, linha: Revendedor.updateRevendedor(id_, linha['nome'], linha['cnpj'], linha['razao_social'],
+                                                             linha['contato']),
+              'deleteRevendedorById'),
+    CasoModel(NotaFiscal, 'insertNotaFiscal', 'selectNotaFiscalPorId', 'selectNotasFiscaisPorRevendedorFk',
+              'revendedor_fk',
+              lambda id_, linha: NotaFiscal.updateNotaFiscal(id_, linha['valor'], linha['revendedor_fk']),
+              'deleteNotaFiscalById'),
+    CasoModel(Picole, 'insertPicole', 'selectPicolePorId', 'selectPicolePorSabor', 'sabor_fk',
+              lambda id_, linha: Picole.updatePicole(id_, linha['preco'], linha['sabor_fk'],
+                                                     linha['tipo_embalagem_fk'], linha['tipo_picole_fk']),
+              'deletePicoleById'),
+    CasoModel(Lote, 'insertLote', 'selectLotePorId', 'selectLotesPorPicoleFk', 'picole_fk',
+              lambda id_, linha: Lote.updateLote(id_, linha['picole_fk'], linha['quantidade']), 'deleteLoteById'),
+    CasoModel(IngredientePicole, 'insertIngredientePicole', 'selectIngredientePicolePorId',
+              'selectAllIngPicPorPicoleFK', 'picole_fk',
+              lambda id_, linha: IngredientePicole.updateIngredientePicole(id_, linha['picole_fk'],
+                                                                           linha['ingrediente_fk']),
+              'deleteIngredientePicoleById'),
+    CasoModel(ConservantePicole, 'insertConservantePicole', 'selectConservantePicolePorId',
+              'selectAllConservantePicolePorPicole', 'picole_fk',
+              lambda id_, linha: ConservantePicole.updateConservantePicole(id_, linha['picole_fk'],
+                                                                           linha['conservante_fk']),
+              'deleteConservantePicoleById'),
+    CasoModel(AditivoNutritivoPicole, 'insertAditivoNutritivoPicole', 'selectAditivoNutritivoPorId',
+              'selectAllAdiNutPicPorPicoleFK', 'picole_fk',
+              lambda id_, linha: AditivoNutritivoPicole.updateAditivoNutritivoPicole(id_, linha['picole_fk'],
+                                                                                     linha['aditivo_nutritivo_fk']),
+              'deleteAditivoNutritivoPicoleById'),
+    CasoModel(LoteNotaFiscal, 'insertLoteNotaFiscal', 'selectLoteNotaFiscalPorId',
+              'selectAllLoteNotaFiscalPorNotaFiscal', 'nota_fiscal_fk',
+              lambda id_, linha: LoteNotaFiscal.updateLoteNotaFiscal(id_, linha['lote_fk'], linha['nota_fiscal_fk']),
+              'deleteLoteNotaFiscalById'),
+    # models derivados, somente de leitura
+    CasoModel(PicoleCatalog, None, None, 'selectCatalogoPorSabor', 'sabor', None, None),
+    CasoModel(RevendedorDailySales, None, None, 'selectVendasRevendedor', 'revendedor_fk', None, None),
+    CasoModel(PicoleStock, None, 'selectEstoquePicole', None, None, None, None),
+]
+
+
+def percentil(tempos: list[float], p: float) -> float:
+    """Percentil pelo método do posto mais próximo
+    :param tempos: list[float]: tempos já ordenados
+    :param p: float: percentil, entre 0 e 100
+    :return: float
+    """
+    return tempos[max(0, math.ceil(p / 100 * len(tempos)) - 1)]
+
+
+async def medir(chamadas: list[Callable[[], Awaitable]], linhas_por_chamada: int = 1, aquecimento: int = 0) -> dict:
+    """Executa as chamadas em sequência e mede o tempo de cada uma
+    :param chamadas: list: funções sem parâmetros que retornam a coroutine medida, uma por iteração
+    :param linhas_por_chamada: int: linhas processadas por chamada, para a vazão em linhas/s
+    :param aquecimento: int: quantidade de chamadas iniciais executadas novamente e descartadas antes da medição;
+    somente para operações que podem ser repetidas (leituras)
+    :return: dict: iterações, operações e linhas por segundo, média, p50, p95 e p99 em microssegundos
+    """
+    for chamada in chamadas[:aquecimento]:
+        await chamada()
+
+    tempos = []
+    inicio_total = time.perf_counter()
+    for chamada in chamadas:
+        inicio = time.perf_counter()
+        await chamada()
+        tempos.append((time.perf_counter() - inicio) * 1e6)
+    total = time.perf_counter() - inicio_total
+
+    tempos.sort()
+    return {
+        'iteracoes': len(tempos),
+        'ops_s': len(tempos) / total,
+        'linhas_s': len(tempos) * linhas_por_chamada / total,
+        'media_us': statistics.fmean(tempos),
+        'p50_us': percentil(tempos, 50),
+        'p95_us': percentil(tempos, 95),
+        'p99_us': percentil(tempos, 99),
+    }
+
+
+def _argumentosInsert(metodo: Callable, linha: dict) -> dict:
+    """Seleciona da linha gerada somente os parâmetros do método insert do model"""
+    parametros = inspect.signature(metodo).parameters
+    return {nome: valor for nome, valor in linha.items() if nome in parametros}
+
+
+async def _amostra(tabela: sa.Table, coluna: str, quantidade: int) -> list:
+    """Sorteia, com reposição, valores existentes de uma coluna da tabela"""
+    async with sessionScope(savepoint=False) as session:
+        valores = (await session.execute(sa.select(tabela.c[coluna]).distinct())).scalars().all()
+    if not valores:
+        return []
+    return obter_gerador().choices(sorted(valores), k=quantidade)
+
+
+async def _linhasNovas(tabela: str, quantidade: int) -> list[dict]:
+    """Gera linhas novas da tabela com o GeradorDados, únicas entre si e em relação às já gravadas"""
+    async with createEngine().connect() as conexao:
+        gerador = GeradorDados(conexao, linhas={tabela: quantidade})
+        return list(await getattr(gerador, tabela)())
+
+
+async def medirModel(caso: CasoModel, iteracoes: int, tamanho_lote: int, lotes: int,
+                     tamanho_pagina: int) -> dict[str, dict]:
+    """Mede as operações de um model no banco já populado
+    :param caso: CasoModel: model e os métodos medidos
+    :param iteracoes: int: chamadas medidas por operação
+    :param tamanho_lote: int: linhas por chamada de insert_lote
+    :param lotes: int: chamadas medidas de insert_lote
+    :param tamanho_pagina: int: linhas por página de listar e paginar
+    :return: dict[str, dict]: métricas por operação
+    """
+    model = caso.model
+    tabela = model.__table__
+    chave = tabela.primary_key.columns.values()[0]
+    rng = obter_gerador()
+    resultados = {}
+
+    # linhas novas: inserts de uma linha, inserts em lote e valores dos updates, nessa ordem
+    inseridos, valores_update = [], []
+    if caso.insert is not None:
+        linhas = await _linhasNovas(tabela.name, iteracoes + tamanho_lote * lotes + iteracoes)
+        simples, linhas = linhas[:iteracoes], linhas[iteracoes:]
+        em_lote, valores_update = linhas[:tamanho_lote * lotes], linhas[tamanho_lote * lotes:]
+
+        metodo = getattr(model, caso.insert)
+
+        async def _insert(linha: dict):
+            inseridos.append((await metodo(**_argumentosInsert(metodo, linha))).id)
+        resultados['insert'] = await medir([lambda linha=linha: _insert(linha) for linha in simples])
+
+        async def _insertLote(parte: list[dict]):
+            async with sessaoEscrita() as session:
+                await session.execute(sa.insert(tabela), parte)
+        partes = [em_lote[inicio:inicio + tamanho_lote] for inicio in range(0, len(em_lote), tamanho_lote)]
+        if partes:
+            resultados['insert_lote'] = await medir([lambda parte=parte: _insertLote(parte) for parte in partes],
+                                                    linhas_por_chamada=tamanho_lote)
+
+    if caso.select_id is not None:
+        metodo = getattr(model, caso.select_id)
+        ids = await _amostra(tabela, chave.name, iteracoes)
+        resultados['select_id'] = await medir([lambda id_=id_: metodo(id_) for id_ in ids], aquecimento=20)
+
+    if caso.select_fk is not None:
+        metodo = getattr(model, caso.select_fk)
+        fks = await _amostra(tabela, caso.fk, iteracoes)
+        resultados['select_fk'] = await medir([lambda fk=fk: metodo(fk) for fk in fks], aquecimento=20)
+
+    async def _pagina(offset: int):
+        async with sessionScope(savepoint=False) as session:
+            return (await session.scalars(sa.select(model).order_by(chave).limit(tamanho_pagina)
+                                          .offset(offset))).all()
+    async with sessionScope(savepoint=False) as session:
+        total = (await session.execute(sa.select(sa.func.count()).select_from(tabela))).scalar_one()
+    resultados['listar'] = await medir([lambda: _pagina(0)] * iteracoes, aquecimento=20)
+    offsets = [rng.randrange(max(1, total - tamanho_pagina)) for _ in range(iteracoes)]
+    resultados['paginar'] = await medir([lambda offset=offset: _pagina(offset) for offset in offsets],
+                                        aquecimento=20)
+
+    if caso.update is not None and valores_update:
+        # ids do conjunto de dados, sem os inseridos pelo benchmark; sem repetição, para que os valores únicos das
+        # linhas novas não colidam com o de outro id atualizado antes
+        async with sessionScope(savepoint=False) as session:
+            existentes = sorted(set((await session.execute(sa.select(chave))).scalars().all()) - set(inseridos))
+        ids = rng.sample(existentes, min(len(valores_update), len(existentes)))
+        resultados['update'] = await medir([lambda id_=id_, linha=linha: caso.update(id_, linha)
+                                            for id_, linha in zip(ids, valores_update)])
+
+    if caso.delete is not None and inseridos:
+        metodo = getattr(model, caso.delete)
+        resultados['delete'] = await medir([lambda id_=id_: metodo(id_) for id_ in inseridos])
+
+    return resultados
+
+
+def _interpretarLinhas(texto: str) -> int:
+    """Converte '10k', '1M' ou '5000' em quantidade de linhas"""
+    multiplicadores = {'k': 1_000, 'm': 1_000_000}
+    texto = texto.strip().lower()
+    if texto[-1:] in multiplicadores:
+        return int(float(texto[:-1]) * multiplicadores[texto[-1]])
+    return int(texto)
+
+
+async def executar(escalas: list[int], banco: str, iteracoes: int, tamanho_lote: int, lotes: int,
+                   tamanho_pagina: int, seed: int, escopo: bool, modelos: Optional[set[str]] = None) -> dict:
+    """Popula um banco novo para cada escala e mede as operações de todos os models
+    :param escalas: list[int]: quantidade total de linhas do banco em cada escala
+    :param banco: str: caminho do arquivo sqlite usado pelo benchmark, ou um banco em memória
+    :param iteracoes: int: chamadas medidas por operação
+    :param tamanho_lote: int: linhas por chamada de insert_lote
+    :param lotes: int: chamadas medidas de insert_lote
+    :param tamanho_pagina: int: linhas por página de listar e paginar
+    :param seed: int: semente do gerador, para que todas as execuções usem os mesmos dados
+    :param escopo: bool: se True, as operações de cada model rodam dentro de escopoSessao, em uma única conexão
+    :param modelos: set[str]: nomes dos models medidos; todos, se não informado
+    :return: dict: metadados da execução e métricas por escala, model e operação
+    """
+    resultado = {
+        'meta': {
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sa.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'banco': 'memoria' if ehBancoMemoria(banco) else 'arquivo',
+            'iteracoes': iteracoes,
+            'tamanho_lote': tamanho_lote,
+            'tamanho_pagina': tamanho_pagina,
+            'seed': seed,
+            'escopo_sessao': escopo,
+        },
+        'resultados': {},
+    }
+    linhas_base = sum(LINHAS_BASE.values())
+
+    for linhas in escalas:
+        if not ehBancoMemoria(banco):
+            for extra in ('', '-wal', '-shm', '-journal'):
+                Path(banco + extra).unlink(missing_ok=True)
+        engine = await configurarBancoSqlite(banco)
+
+        inicio = time.perf_counter()
+        inseridas = await popular(scale=linhas / linhas_base, seed=seed, recriar=True)
+        print(f'[{linhas}] banco populado com {sum(inseridas.values())} linhas em '
+              f'{time.perf_counter() - inicio:.1f}s', file=sys.stderr)
+
+        por_model = {}
+        for caso in CASOS:
+            if modelos and caso.model.__name__ not in modelos:
+                continue
+            async with escopoSessao() if escopo else nullcontext():
+                por_model[caso.model.__name__] = await medirModel(caso, iteracoes, tamanho_lote, lotes,
+                                                                  tamanho_pagina)
+            print(f'[{linhas}] {caso.model.__name__} medido', file=sys.stderr)
+        resultado['resultados'][str(linhas)] = por_model
+        await engine.dispose()
+
+    if not ehBancoMemoria(banco):
+        Path(banco).unlink(missing_ok=True)
+    return resultado
+
+
+def comparar(atual: dict, baseline: dict, limite: float, metricas: list[str]) -> list[str]:
+    """Compara as métricas acompanhadas com o baseline, para cada escala, model e operação presentes nos dois
+    :param atual: dict: resultado da execução atual
+    :param baseline: dict: resultado gravado antes
+    :param limite: float: piora relativa tolerada, ex.: 0.1 para 10%
+    :param metricas: list[str]: métricas acompanhadas, ex.: ['ops_s', 'p95_us']
+    :return: list[str]: descrição das regressões; vazia se nenhuma métrica piorou além do limite
+    """
+    regressoes = []
+    for escala, por_model in atual['resultados'].items():
+        for model, por_operacao in por_model.items():
+            for operacao, valores in por_operacao.items():
+                base = baseline['resultados'].get(escala, {}).get(model, {}).get(operacao)
+                if base is None:
+                    continue
+                for metrica in metricas:
+                    if not base.get(metrica) or metrica not in valores:
+                        continue
+                    variacao = valores[metrica] / base[metrica] - 1
+                    # nas latências a piora é um aumento, na vazão, uma queda
+                    piora = variacao if metrica in METRICAS_LATENCIA else -variacao
+                    if piora > limite:
+                        regressoes.append(f'{escala} {model}.{operacao} {metrica}: {base[metrica]:.1f} -> '
+                                          f'{valores[metrica]:.1f} ({variacao:+.1%})')
+    return regressoes
+
+
+def imprimir(resultado: dict) -> None:
+    print(f'{"linhas":>8} {"model":<24} {"operação":<12} {"ops/s":>10} {"p50 µs":>10} {"p95 µs":>10} '
+          f'{"p99 µs":>10}')
+    for escala, por_model in resultado['resultados'].items():
+        for model, por_operacao in por_model.items():
+            for operacao in OPERACOES:
+                if operacao in por_operacao:
+                    r = por_operacao[operacao]
+                    print(f'{escala:>8} {model:<24} {operacao:<12} {r["ops_s"]:>10.0f} {r["p50_us"]:>10.1f} '
+                          f'{r["p95_us"]:>10.1f} {r["p99_us"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks das operações dos models em várias escalas')
+    parser.add_argument('--linhas', default='10k,100k,1M',
+                        help='escalas, em linhas totais do banco, separadas por vírgula (ex.: 10k,100k,1M)')
+    parser.add_argument('--banco', default=str(Path(tempfile.gettempdir()) / 'picoles_benchmark.sqlite'),
+                        help="arquivo sqlite usado pelo benchmark, recriado a cada escala, ':memory:' ou "
+                             "'file::memory:?cache=shared'")
+    parser.add_argument('--iteracoes', type=int, default=300, help='chamadas medidas por operação')
+    parser.add_argument('--tamanho-lote', type=int, default=100, help='linhas por chamada de insert_lote')
+    parser.add_argument('--lotes', type=int, default=5, help='chamadas medidas de insert_lote')
+    parser.add_argument('--tamanho-pagina', type=int, default=50, help='linhas por página de listar e paginar')
+    parser.add_argument('--seed', type=int, default=42, help='semente do gerador de dados')
+    parser.add_argument('--modelos', default=None, help='models medidos, separados por vírgula; padrão, todos')
+    parser.add_argument('--escopo-sessao', action='store_true',
+                        help='executa as operações de cada model em escopoSessao, em uma única conexão')
+    parser.add_argument('--saida', default=None, help='arquivo JSON do resultado; padrão, somente a saída padrão')
+    parser.add_argument('--entrada', default=None,
+                        help='resultado JSON já gravado, comparado com --comparar sem executar o benchmark')
+    parser.add_argument('--comparar', default=None, help='baseline JSON para a comparação')
+    parser.add_argument('--limite', type=float, default=0.10, help='piora relativa tolerada na comparação')
+    parser.add_argument('--metricas', default='ops_s,p95_us,p99_us', help='métricas acompanhadas na comparação')
+    args = parser.parse_args()
+
+    if args.entrada:
+        resultado = json.loads(Path(args.entrada).read_text(encoding='utf-8'))
+    else:
+        resultado = asyncio.run(executar(
+            escalas=[_interpretarLinhas(texto) for texto in args.linhas.split(',')], banco=args.banco,
+            iteracoes=args.iteracoes, tamanho_lote=args.tamanho_lote, lotes=args.lotes,
+            tamanho_pagina=args.tamanho_pagina, seed=args.seed, escopo=args.escopo_sessao,
+            modelos=set(args.modelos.split(',')) if args.modelos else None))
+        imprimir(resultado)
+        if args.saida:
+            Path(args.saida).write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding='utf-8')
+        else:
+            print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+    if args.comparar:
+        baseline = json.loads(Path(args.comparar).read_text(encoding='utf-8'))
+        regressoes = comparar(resultado, baseline, args.limite, args.metricas.split(','))
+        for regressao in regressoes:
+            print(f'REGRESSÃO {regressao}')
+        if regressoes:
+            sys.exit(1)
+        print(f'Sem regressões acima de {args.limite:.0%} em {args.metricas}')
@@ -0,0 +1,118 @@
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# Verificação do custo de importação dos módulos usados pelos scripts curtos (CLI), com python -X importtime.
+# Cada módulo é importado em um interpretador novo, --repeticoes vezes, e comparado com a importação de referência
+# (REFERENCIA: o ORM e a extensão async do SQLAlchemy, que todo model carrega):
+#   - módulos: quantidade de módulos carregados além da referência. É determinística e é o orçamento verificado: uma
+#     importação cara, como um dialeto inteiro ou todos os models carregados por um único model, aparece aqui;
+#   - ms: menor tempo acumulado da importação entre as repetições, e o tempo além da referência. O tempo varia muito
+#     de uma máquina para outra, por isso só é verificado com --tempo-maximo-ms.
+# O processo termina com código 1 se algum módulo passar do orçamento.
+#
+# Uso:
+#     python -m benchmarks.tempo_importacao
+#     python -m benchmarks.tempo_importacao --repeticoes 10 --detalhar
+#     python -m benchmarks.tempo_importacao --tempo-maximo-ms 600
+
+DIRETORIO_PROJETO = Path(__file__).resolve().parent.parent
+
+REFERENCIA = 'sqlalchemy.orm, sqlalchemy.ext.asyncio'
+
+# orçamento de cada módulo: quantidade máxima de módulos carregados além da referência
+ORCAMENTOS_MODULOS = {
+    'conf.db_session': 10,
+    'models.sabor': 18,
+    'models.picole': 24,
+    'models.__all_models': 36,
+    'populate_main': 30,
+    'rebuild_catalog_main': 30,
+    'repair_rollups_main': 32,
+}
+
+# pacotes do projeto, listados com --detalhar
+PACOTES_PROJETO = ('conf', 'models', 'ScriptsAuxiliares', 'benchmarks')
+
+
+def importar(modulos: str) -> dict[str, tuple[int, int]]:
+    """Importa os módulos em um interpretador novo com -X importtime
+    :param modulos: str: módulos separados por vírgula, como no comando import
+    :return: dict[str, tuple[int, int]]: tempo próprio e acumulado, em microssegundos, de cada módulo importado
+    :raises RuntimeError: Se a importação falhar
+    """
+    ambiente = dict(os.environ, PYTHONPATH=str(DIRETORIO_PROJETO))
+    processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulos}'],
+                              cwd=DIRETORIO_PROJETO, env=ambiente, capture_output=True, text=True)
+    if processo.returncode != 0:
+        raise RuntimeError(f'Falha ao importar {modulos}: {processo.stderr.strip().splitlines()[-1]}')
+
+    tempos = {}
+    for linha in processo.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        proprio, acumulado, nome = linha[len('import time:'):].split('|')
+        tempos[nome.strip()] = (int(proprio), int(acumulado))
+    return tempos
+
+
+def medir(modulos: str, repeticoes: int) -> tuple[float, dict[str, tuple[int, int]]]:
+    """Mede o menor tempo de importação entre as repetições
+    :param modulos: str: módulos separados por vírgula
+    :param repeticoes: int: quantidade de importações
+    :return: tuple: tempo em milissegundos (soma dos tempos acumulados dos módulos pedidos) e os tempos por módulo da
+        repetição mais rápida
+    """
+    nomes = [nome.strip() for nome in modulos.split(',')]
+    melhor, detalhes = None, {}
+    for _ in range(repeticoes):
+        tempos = importar(modulos)
+        # um módulo já carregado por outro da lista não aparece de novo na saída
+        acumulado = sum(tempos[nome][1] for nome in nomes if nome in tempos) / 1e3
+        if melhor is None or acumulado < melhor:
+            melhor, detalhes = acumulado, tempos
+    return melhor, detalhes
+
+
+def main(repeticoes: int, tempo_maximo_ms: float, detalhar: bool) -> int:
+    tempo_referencia, referencia = medir(REFERENCIA, repeticoes)
+    print(f'referência ({REFERENCIA}): {len(referencia)} módulos, {tempo_referencia:.1f} ms')
+    print(f'{"módulo":<24} {"módulos":>8} {"orçamento":>10} {"ms":>8} {"+ms":>8}')
+
+    acima = []
+    for modulo, orcamento in ORCAMENTOS_MODULOS.items():
+        tempo, detalhes = medir(modulo, repeticoes)
+        extras = sorted(set(detalhes) - set(referencia))
+        situacao = 'ok'
+        if len(extras) > orcamento or (tempo_maximo_ms and tempo > tempo_maximo_ms):
+            situacao = 'ACIMA'
+            acima.append(modulo)
+        print(f'{modulo:<24} {len(extras):>8} {orcamento:>10} {tempo:>8.1f} {tempo - tempo_referencia:>+8.1f} '
+              f'{situacao}')
+        if detalhar:
+            for nome in extras:
+                if nome.split('.')[0] not in PACOTES_PROJETO and nome != modulo:
+                    print(f'    fora do projeto: {nome}')
+            do_projeto = sorted(((detalhes[nome][0], nome) for nome in extras
+                                 if nome.split('.')[0] in PACOTES_PROJETO or nome == modulo), reverse=True)
+            for proprio, nome in do_projeto[:8]:
+                print(f'    {nome:<40} {proprio / 1e3:>8.1f} ms próprios')
+
+    if acima:
+        print(f'Acima do orçamento: {", ".join(acima)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verifica o custo de importação dos módulos contra o orçamento')
+    parser.add_argument('--repeticoes', type=int, default=5, help='importações por módulo; vale a mais rápida')
+    parser.add_argument('--tempo-maximo-ms', type=float, default=None,
+                        help='também falha se o tempo de importação de algum módulo passar deste valor')
+    parser.add_argument('--detalhar', action='store_true',
+                        help='lista os módulos carregados de fora do projeto e os módulos do projeto mais caros')
+    args = parser.parse_args()
+    sys.exit(main(args.repeticoes, args.tempo_maximo_ms, args.detalhar))
@@ -0,0 +1,135 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, Iterable, Optional
+
+from conf.logger import getLogger
+
+# Este módulo é responsável pelo DataLoader, que agrupa as buscas por id feitas ao mesmo tempo.
+# Quando várias coroutines resolvem registros relacionados de uma vez (o Revendedor de cada NotaFiscal, o Picole de
+# cada Lote), cada busca seria uma consulta. Com o DataLoader, todos os load(id) feitos na mesma volta do event loop
+# são reunidos em uma única chamada a selectManyById (um IN por bloco de ids) e cada chamador recebe o seu registro.
+# Os resultados ficam memorizados no DataLoader: um mesmo id é buscado uma única vez durante a vida dele, por isso
+# deve ser criado um DataLoader (ou um Loaders) por requisição, e não compartilhado entre requisições.
+#
+# Exemplo:
+#     loaders = Loaders()
+#     notas_fiscais = await NotaFiscal.selectAllNotasFiscais()
+#     revendedores = await asyncio.gather(*(loaders[Revendedor].load(nf.revendedor_fk) for nf in notas_fiscais))
+
+log = getLogger('data_loader')
+
+
+class DataLoader:
+
+    def __init__(self, carregar: Callable[[list], Awaitable[dict]]):
+        """Cria o DataLoader
+        :param carregar: função async que recebe uma lista de chaves sem repetição e retorna um dict com os registros
+        encontrados por chave, ex.: Picole.selectManyById
+        """
+        self._carregar = carregar
+        self._memo: dict[Hashable, asyncio.Future] = {}
+        self._pendentes: dict[Hashable, asyncio.Future] = {}
+        self._agendado = False
+        # o event loop guarda somente referências fracas das tarefas: sem esta referência, uma busca em andamento
+        # poderia ser coletada pelo garbage collector, deixando os chamadores esperando para sempre
+        self._tarefas: set[asyncio.Task] = set()
+        self.consultas = 0
+
+    @classmethod
+    def doModel(cls, model) -> 'DataLoader':
+        """Cria um DataLoader que busca os registros de um model por id, através de selectManyById
+        :param model: classe do model
+        :return: DataLoader
+        """
+        return cls(model.selectManyById)
+
+    def load(self, chave: Hashable) -> asyncio.Future:
+        """Agenda a busca de um registro e retorna um awaitable com o resultado. A busca só é feita ao final da volta
+        atual do event loop, junto com as demais chaves pedidas até lá
+        :param chave: chave do registro, normalmente o id
+        :return: Future: resolve para o registro, ou None se não for encontrado. Cada chamador recebe o futuro
+        memorizado protegido por asyncio.shield: cancelar a espera de um chamador (cancelamento, asyncio.wait_for ou
+        um gather cancelado) não cancela a busca para os demais
+        """
+        futuro = self._memo.get(chave)
+        if futuro is not None:
+            return asyncio.shield(futuro)
+
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._memo[chave] = futuro
+        self._pendentes[chave] = futuro
+        if not self._agendado:
+            self._agendado = True
+            loop.call_soon(self._despachar)
+        return asyncio.shield(futuro)
+
+    async def loadMany(self, chaves: Iterable[Hashable]) -> list:
+        """Busca vários registros, na ordem das chaves informadas
+        :param chaves: Iterable: chaves dos registros
+        :return: list: registros, com None para as chaves não encontradas
+        """
+        return list(await asyncio.gather(*(self.load(chave) for chave in chaves)))
+
+    def prime(self, chave: Hashable, registro) -> None:
+        """Guarda um registro já carregado na memória do DataLoader, evitando uma busca futura
+        :param chave: chave do registro
+        :param registro: registro já carregado
+        """
+        if chave not in self._memo:
+            futuro = asyncio.get_running_loop().create_future()
+            futuro.set_result(registro)
+            self._memo[chave] = futuro
+
+    def limpar(self, chave: Optional[Hashable] = None) -> None:
+        """Remove uma chave da memória do DataLoader, ou todas se nenhuma for informada, ex.: após uma atualização
+        :param chave: chave do registro
+        """
+        if chave is None:
+            self._memo = {chave: futuro for chave, futuro in self._memo.items() if not futuro.done()}
+        else:
+            futuro = self._memo.get(chave)
+            if futuro is not None and futuro.done():
+                del self._memo[chave]
+
+    def _despachar(self) -> None:
+        pendentes, self._pendentes = self._pendentes, {}
+        self._agendado = False
+        if pendentes:
+            tarefa = asyncio.create_task(self._executar(pendentes), name='DataLoader')
+            self._tarefas.add(tarefa)
+            tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _executar(self, pendentes: dict[Hashable, asyncio.Future]) -> None:
+        self.consultas += 1
+        log.debug('DataLoader: %s chave(s) em uma busca', len(pendentes))
+        try:
+            registros = await self._carregar(list(pendentes))
+        except asyncio.CancelledError:
+            # busca cancelada, ex.: no encerramento do event loop; nada fica memorizado e os chamadores são cancelados
+            for chave, futuro in pendentes.items():
+                self._memo.pop(chave, None)
+                futuro.cancel()
+            raise
+        except Exception as exc:
+            for chave, futuro in pendentes.items():
+                # um erro não fica memorizado: a próxima chamada de load tenta novamente
+                self._memo.pop(chave, None)
+                if not futuro.done():
+                    futuro.set_exception(exc)
+            return
+
+        for chave, futuro in pendentes.items():
+            if futuro.cancelled():
+                # um futuro cancelado não fica memorizado: a próxima chamada de load busca a chave novamente
+                if self._memo.get(chave) is futuro:
+                    del self._memo[chave]
+            elif not futuro.done():
+                futuro.set_result(registros.get(chave))
+
+
+class Loaders(dict):
+    """Conjunto de DataLoaders de uma requisição, um por model, criados sob demanda: loaders[Revendedor].load(1)"""
+
+    def __missing__(self, model) -> DataLoader:
+        loader = self[model] = DataLoader.doModel(model)
+        return loader
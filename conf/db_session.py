@@ -1,15 +1,21 @@
+import asyncio
+import os
+from collections import Counter
+from contextlib import asynccontextmanager, closing, contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional, Tuple, Union
 
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine
-from sqlalchemy import text
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import Mapper, Session, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, AsyncConnection, create_async_engine
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.engine.default import CacheStats
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 
+from conf import settings
 from models.model_base import ModelBase
 
-from ScriptsAuxiliares.Auxiliar import Auxiliar
-
 # Descrive all this module does
 # This module is responsible for creating the connection to the database
 # and creating the tables in the database.
@@ -31,10 +37,236 @@ from ScriptsAuxiliares.Auxiliar import Auxiliar
 
 __async_engine: Optional[AsyncEngine] = None
 
+# engine síncrona, gêmea da engine padrão, para os scripts em lote (ver createSyncEngine)
+__sync_engine: Optional[Engine] = None
+
+# driver síncrono correspondente a cada driver async, usado pela engine síncrona
+_DRIVERS_SINCRONOS = {'aiosqlite': 'pysqlite', 'asyncpg': 'psycopg2', 'psycopg_async': 'psycopg'}
+
+# sessão do UnitOfWork ativo no contexto atual (ver conf/unit_of_work.py). Quando definida, as operações dos models
+# reaproveitam essa sessão e a transação dela, em vez de abrir e confirmar uma transação própria.
+_sessao_uow: ContextVar[Optional[AsyncSession]] = ContextVar('sessao_uow', default=None)
+
+# sessão ambiente do contexto atual, junto com a tarefa dona dela. É publicada por sessionScope enquanto uma operação
+# dos models está em andamento, e por escopoSessao durante uma requisição inteira, para que as chamadas aninhadas
+# reaproveitem a mesma sessão e a mesma conexão em vez de retirar outra do pool. Somente a tarefa dona reaproveita a
+# sessão: tarefas criadas dentro do escopo (asyncio.gather, create_task) herdam a ContextVar, mas abrem sessão própria,
+# pois uma AsyncSession não pode ser usada por duas tarefas ao mesmo tempo.
+_sessao_ambiente: ContextVar[Optional[Tuple[AsyncSession, asyncio.Task]]] = ContextVar('sessao_ambiente',
+                                                                                        default=None)
+
+# indica se as transações abertas no contexto atual são de escrita (ver _configurarConexaoSqlite). É definida por
+# sessaoEscrita, e portanto pelas escritas dos models, pelo UnitOfWork e pelo WriteBatcher, e desligada pelas leituras.
+_transacao_escrita: ContextVar[bool] = ContextVar('transacao_escrita', default=False)
+
+# quantidade de comandos compilados guardados no cache de cada engine (o padrão do SQLAlchemy é 500). Cada consulta
+# distinta dos models ocupa uma entrada, inclusive as variações de IN com quantidades diferentes de parâmetros.
+TAMANHO_CACHE_SQL = int(os.environ.get('PICOLES_SQL_CACHE_SIZE', 1200))
+
+# acertos e falhas do cache de comandos compilados, ver estatisticasCacheSql
+_estatisticas_cache: Counter = Counter()
+
+# escritor único do sqlite, quando ativo (ver conf/sqlite_writer.py). Todas as transações de escrita passam por ele.
+_escritor = None
+
+
+def _engineBase(engine: Union[AsyncEngine, Engine]) -> Engine:
+    # os eventos são registrados na engine síncrona, que a AsyncEngine envolve
+    return engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+
+
+def _registrarEstatisticasCache(engine: Union[AsyncEngine, Engine]) -> None:
+    """Conta, a cada comando executado pela engine, se o SQL compilado veio do cache ou precisou ser compilado.
+    :param engine: AsyncEngine ou Engine: engine monitorada
+    """
+
+    @event.listens_for(_engineBase(engine), 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and context.compiled is not None:
+            _estatisticas_cache[context.cache_hit.name] += 1
+
+
+def estatisticasCacheSql() -> dict[str, int]:
+    """Retorna as estatísticas do cache de comandos compilados das engines: 'CACHE_HIT' (SQL reaproveitado),
+    'CACHE_MISS' (SQL compilado e guardado) e os demais estados de CacheStats (comandos que não podem ser guardados),
+    além de 'tamanho' (entradas no cache da engine padrão) e 'capacidade'.
+    :return: dict[str, int]
+    """
+    estatisticas = {estado.name: _estatisticas_cache[estado.name] for estado in CacheStats}
+    cache = getattr(__async_engine.sync_engine, '_compiled_cache', None) if __async_engine is not None else None
+    estatisticas['tamanho'] = len(cache) if cache is not None else 0
+    estatisticas['capacidade'] = TAMANHO_CACHE_SQL
+    return estatisticas
+
+
+def zerarEstatisticasCacheSql() -> None:
+    """Zera os contadores do cache de comandos compilados"""
+    _estatisticas_cache.clear()
+
+
+def _configurarConexaoSqlite(engine: Union[AsyncEngine, Engine], somente_escrita: bool = False) -> None:
+    """Configura as conexões do sqlite: ativa as chaves estrangeiras e passa o controle das transações para o
+    SQLAlchemy, emitindo o BEGIN explicitamente. Sem isso o driver atrasa o BEGIN e os SAVEPOINTs não funcionam.
+    As transações de escrita começam com BEGIN IMMEDIATE, que reserva o lock de escrita logo no início, aguardando o
+    busy timeout se outra conexão o tiver. Com o BEGIN deferred, uma operação que lê e depois escreve (ex.: os updates
+    dos models) precisa promover o lock de leitura para escrita no meio da transação, e duas transações nessa situação
+    se bloqueiam: o sqlite falha imediatamente com "database is locked", sem esperar o timeout. As leituras continuam
+    com o BEGIN deferred, que não disputa o lock de escrita.
+    :param engine: AsyncEngine ou Engine: engine do sqlite
+    :param somente_escrita: bool: se True, todas as transações da engine são de escrita (ex.: a do SqliteWriter)
+    """
+
+    @event.listens_for(_engineBase(engine), 'connect')
+    def _connect(dbapi_connection, connection_record):
+        # o sqlite vem com as chaves estrangeiras desativadas, caso contrário ele não irá verificar se as chaves
+        # estrangeiras inseridas já existem. O PRAGMA é por conexão e não tem efeito dentro de uma transação.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON;')
+        cursor.close()
+
+    @event.listens_for(_engineBase(engine), 'begin')
+    def _begin(conn):
+        # o SQLAlchemy executa o evento na mesma tarefa (e no mesmo contexto) da operação que abriu a transação
+        conn.exec_driver_sql('BEGIN IMMEDIATE' if somente_escrita or _transacao_escrita.get() else 'BEGIN')
+
+
+def ehBancoMemoria(caminho: str) -> bool:
+    """Verifica se o caminho do sqlite é um banco em memória: ':memory:' ou uma URI como 'file::memory:?cache=shared'
+    e 'file:testes?mode=memory&cache=shared'
+    :param caminho: str: caminho do arquivo do banco, ':memory:' ou URI 'file:'
+    :return: bool
+    """
+    return caminho == ':memory:' or caminho.startswith('file::memory:') or (
+            caminho.startswith('file:') and 'mode=memory' in caminho)
+
+
+def _caminhoSqlite(url: URL) -> str:
+    """Converte uma URL do sqlite do SQLAlchemy no caminho aceito por _criarEngineSqlite. As URIs do sqlite são
+    indicadas com ?uri=true, ex.: 'sqlite+aiosqlite:///file::memory:?cache=shared&uri=true'
+    :param url: URL: URL do sqlite
+    :return: str: caminho do arquivo do banco, ':memory:' ou URI 'file:'
+    """
+    if not url.database:
+        return ':memory:'
+    parametros = {chave: valor for chave, valor in url.query.items() if chave != 'uri'}
+    if url.query.get('uri', 'false').lower() not in ('true', '1') or not parametros:
+        return url.database
+    return url.database + '?' + '&'.join(f'{chave}={valor}' for chave, valor in parametros.items())
+
+
+def _ancorarBancoMemoria(engine: Union[AsyncEngine, Engine], caminho: str) -> None:
+    """Mantém uma conexão aberta com o banco em memória compartilhado enquanto a engine existir. O sqlite descarta o
+    banco quando a última conexão com ele é fechada, e as conexões do pool podem ser fechadas e reabertas a qualquer
+    momento. O banco é descartado junto com a engine, no dispose().
+    :param engine: AsyncEngine ou Engine: engine do banco em memória
+    :param caminho: str: URI do banco, ex.: 'file::memory:?cache=shared'
+    """
+    # importado somente aqui, como em salvarBancoEmDisco: a importação dos models não precisa do driver
+    import sqlite3
+
+    ancora = sqlite3.connect(caminho, uri=True, check_same_thread=False)
+
+    @event.listens_for(_engineBase(engine), 'engine_disposed')
+    def _engine_disposed(engine):
+        ancora.close()
+
+
+def _criarEngineSqlite(caminho: str, echo: bool = False, timeout: int = 30,
+                       sincrona: bool = False) -> Union[AsyncEngine, Engine]:
+    """Cria a engine Async do sqlite para o arquivo informado, para um banco em memória com ':memory:', ou para uma URI
+    do sqlite ('file:...'), como o banco em memória compartilhado 'file::memory:?cache=shared'
+    :param caminho: str: caminho do arquivo do banco, ':memory:' ou URI 'file:'
+    :param echo: bool: se True, mostra as queries executadas, se False, não mostra
+    :param timeout: int: tempo limite para conexão, padrão 30 segundos
+    :param sincrona: bool: se True, cria a engine síncrona (sqlite3), com as mesmas configurações
+    :return: AsyncEngine, ou Engine se sincrona for True
+    """
+    url = f'sqlite+{"pysqlite" if sincrona else "aiosqlite"}:///{caminho}'
+    opcoes = {}
+    if caminho == ':memory:':
+        # cada conexão do sqlite em memória tem o próprio banco: o StaticPool mantém uma única conexão, compartilhada
+        # por todas as sessões
+        opcoes['poolclass'] = StaticPool
+    elif caminho.startswith('file:'):
+        # URI do sqlite: o SQLAlchemy repassa o caminho e os parâmetros ao driver com uri=True
+        url += ('&' if '?' in caminho else '?') + 'uri=true'
+        if ehBancoMemoria(caminho):
+            # com cache=shared todas as conexões do processo abertas com a mesma URI usam o mesmo banco, então as
+            # transações concorrentes têm conexões próprias, como em um arquivo (o padrão do aiosqlite para URIs é o
+            # NullPool, que fecharia a conexão a cada uso). O cache compartilhado bloqueia por tabela, e esse bloqueio
+            # não espera pelo timeout: sob escrita concorrente as operações falham com SQLITE_LOCKED e são repetidas
+            # pelo retryTransitorio; cargas com muitas escritas concorrentes devem usar o SqliteWriter
+            opcoes['poolclass'] = QueuePool if sincrona else AsyncAdaptedQueuePool
+    else:
+        Path(caminho).parent.mkdir(parents=True, exist_ok=True)
+
+    engine = (create_engine if sincrona else create_async_engine)(
+        url=url,  # caminho do banco de dados
+        echo=echo,  # se True, mostra as queries executadas
+        query_cache_size=TAMANHO_CACHE_SQL,  # cache de comandos compilados
+        connect_args={
+            "check_same_thread": False,  # para permitir multi-thread
+            "timeout": timeout,  # tempo limite para conexão
+        },
+        **opcoes
+    )
+    if caminho.startswith('file:') and ehBancoMemoria(caminho):
+        _ancorarBancoMemoria(engine, caminho)
+    _configurarConexaoSqlite(engine)
+    _registrarEstatisticasCache(engine)
+    return engine
+
+
+async def salvarBancoEmDisco(destino: str, engine: AsyncEngine = None, paginas: int = -1) -> Path:
+    """Grava uma cópia do banco sqlite no arquivo informado com a API de backup do sqlite, sem parar as demais
+    conexões. Usado para persistir um banco em memória (':memory:' ou 'file::memory:?cache=shared'), mas aceita
+    também um banco em arquivo. O destino é sobrescrito.
+    Com ':memory:' a engine tem uma única conexão, então a cópia deve ser feita sem transações em andamento.
+    :param destino: str: caminho do arquivo da cópia
+    :param engine: AsyncEngine: engine do banco copiado; padrão, a engine padrão
+    :param paginas: int: páginas copiadas por passo; padrão, o banco inteiro em um único passo
+    :return: Path: caminho do arquivo da cópia
+    :raises ValueError: Se a engine não for do sqlite
+    """
+    import sqlite3
+
+    engine = engine or createEngine()
+    if engine.dialect.name != 'sqlite':
+        raise ValueError(f'A cópia para o disco usa a API de backup do sqlite; a engine é do {engine.dialect.name}')
+
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    async with engine.connect() as conexao:
+        # o backup é executado pela conexão do driver, na thread do aiosqlite
+        conexao_driver = (await conexao.get_raw_connection()).driver_connection
+        with closing(sqlite3.connect(destino, check_same_thread=False)) as copia:
+            await conexao_driver.backup(copia, pages=paginas)
+    return destino
+
+
+def _bancoDaUrl(url: URL) -> Tuple[Optional[str], Optional[URL]]:
+    # (caminho do sqlite, None) para o sqlite, ou (None, URL) para os demais bancos
+    if url.get_backend_name() == 'sqlite':
+        return _caminhoSqlite(url), None
+    return None, url
+
+
+def _bancoPadrao(sqlite: bool) -> Tuple[Optional[str], Optional[URL]]:
+    """Resolve o banco padrão a partir de conf/settings.py (variáveis de ambiente PICOLES_DB_URL e PICOLES_DB_PATH)
+    :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres; ignorado se PICOLES_DB_URL estiver definida
+    :return: tuple: (caminho do sqlite, None) ou (None, URL do banco)
+    """
+    if settings.URL_BANCO:
+        return _bancoDaUrl(make_url(settings.URL_BANCO))
+    if sqlite:
+        return str(settings.CAMINHO_BANCO), None
+    return None, make_url(settings.URL_POSTGRES)
+
 
 def createEngine(sqlite: bool = True, echo: bool = False, timeout: int = 30) -> AsyncEngine:
     """Cria/Configura a engine Async para conexão com o banco de dados
-    :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres
+    :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres; ignorado se PICOLES_DB_URL estiver definida
     :param echo: bool: se True, mostra as queries executadas, se False, não mostra
     :param timeout: int: tempo limite para conexão, padrão 30 segundos
     :return: Engine
@@ -44,39 +276,49 @@ def createEngine(sqlite: bool = True, echo: bool = False, timeout: int = 30) ->
     if __async_engine:
         return __async_engine
 
-    if sqlite:
-        root_path = Auxiliar.getProjectRootDir()
-        db_path = Path(f'{root_path}//db/picoles.sqlite')
-        folder = Path(db_path).parent
-        folder.mkdir(parents=True, exist_ok=True)
-        conn_str = f'sqlite+aiosqlite:///{db_path}'
+    caminho, url = _bancoPadrao(sqlite)
+    if caminho is not None:
+        __async_engine = _criarEngineSqlite(caminho, echo=echo, timeout=timeout)
+    else:
+        # postgres
         __async_engine = create_async_engine(
-            url=conn_str,  # caminho do banco de dados
+            url=url,  # caminho do banco de dados
             echo=echo,  # se True, mostra as queries executadas
-            # fk on
-
-            connect_args={
-                "check_same_thread": False,  # para permitir multi-thread
-                "timeout": timeout,  # tempo limite para conexão
-            }
+            query_cache_size=TAMANHO_CACHE_SQL  # cache de comandos compilados
         )
-    else:
-        # postgres
+        _registrarEstatisticasCache(__async_engine)
+    return __async_engine
 
-        # opção para usar o postgres
-        db_user_name = 'postgres'
-        db_password = 'postgres'
-        local = 'localhost'
-        port = '5432'
-        db_name = 'picoles'
-        conn_str = f'postgresql:+asyncpg//{db_user_name}:{db_password}@{local}:{port}/{db_name}'
-        __engine = create_async_engine(
-            url=conn_str,  # caminho do banco de dados
-            echo=echo  # se True, mostra as queries executadas
-        )
+
+async def configurarBancoSqlite(caminho: str, echo: bool = False, timeout: int = 30) -> AsyncEngine:
+    """Troca a engine padrão por uma engine do sqlite no caminho informado, descartando as conexões da anterior.
+    Usado pelos benchmarks, que rodam em um arquivo próprio ou em memória, sem tocar em db/picoles.sqlite.
+    O banco em memória é descartado quando a engine for trocada de novo; ver salvarBancoEmDisco.
+    :param caminho: str: caminho do arquivo do banco, ':memory:' ou URI 'file:' (ex.: 'file::memory:?cache=shared')
+    :param echo: bool: se True, mostra as queries executadas, se False, não mostra
+    :param timeout: int: tempo limite para conexão, padrão 30 segundos
+    :return: AsyncEngine: a nova engine padrão
+    """
+    global __async_engine
+
+    if __async_engine is not None:
+        await __async_engine.dispose()
+    _descartarEngineSync()
+    __async_engine = _criarEngineSqlite(caminho, echo=echo, timeout=timeout)
     return __async_engine
 
 
+async def descartarEngine() -> None:
+    """Descarta a engine padrão e a engine síncrona, e as conexões delas. A próxima chamada a createEngine cria uma
+    nova engine, com as configurações de conf/settings.py"""
+    global __async_engine
+
+    if __async_engine is not None:
+        await __async_engine.dispose()
+    __async_engine = None
+    _descartarEngineSync()
+
+
 async def createSession(sqlite: bool = True, echo: bool = False, timeout: int = 30) -> AsyncSession:
     """Cria uma sessão Async com o banco de dados para realizar operações de CRUD
     :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres
@@ -96,18 +338,205 @@ async def createSession(sqlite: bool = True, echo: bool = False, timeout: int =
     )
 
     session: AsyncSession = async_session()
+    # as chaves estrangeiras do sqlite são ativadas em cada nova conexão, ver _configurarConexaoSqlite
+    return session
+
+
+def _sessaoAmbiente() -> Optional[AsyncSession]:
+    """Retorna a sessão ambiente do contexto, se ela pertencer à tarefa atual
+    :return: AsyncSession or None
+    """
+    ambiente = _sessao_ambiente.get()
+    if ambiente is not None and ambiente[1] is asyncio.current_task():
+        return ambiente[0]
+    return None
+
+
+def emTransacaoCompartilhada() -> bool:
+    """Verifica se a operação atual roda dentro da transação de outra: um UnitOfWork ou uma operação dos models em
+    andamento na mesma tarefa. Nesses casos um erro compromete a transação externa, que é quem deve tratá-lo.
+    :return: bool
+    """
+    if _sessao_uow.get() is not None:
+        return True
+    session = _sessaoAmbiente()
+    return session is not None and session.in_transaction()
+
+
+@asynccontextmanager
+async def _publicarSessao(session: AsyncSession) -> AsyncIterator[AsyncSession]:
+    token = _sessao_ambiente.set((session, asyncio.current_task()))
+    try:
+        yield session
+    finally:
+        _sessao_ambiente.reset(token)
 
-    if sqlite:
-        # ativa as chaves estrangeiras no sqlite, pois por padrão vem desativado,
-        # caso contrário o sqlite não irá verificar se as chaves estrangeiras inseridas já existem e irá inserir
-        # o registro mesmo que a chave estrangeira não exista
-        # await session.execute(text('PRAGMA foreign_keys=ON;'))
-        # close the session
-        # await session.close()
 
+@asynccontextmanager
+async def _tipoTransacao(escrita: bool) -> AsyncIterator[None]:
+    # define o tipo das transações abertas no bloco, ver _configurarConexaoSqlite
+    token = _transacao_escrita.set(escrita)
+    try:
+        yield
+    finally:
+        _transacao_escrita.reset(token)
+
+
+@asynccontextmanager
+async def _transacaoNoEscopo(session: AsyncSession) -> AsyncIterator[AsyncSession]:
+    try:
         async with session.begin():
-            await session.execute(text('PRAGMA foreign_keys=ON;'))
-    return session
+            yield session
+    finally:
+        # os objetos saem da sessão ao final de cada operação, como acontece fora do escopo. Assim o rollback de uma
+        # operação não expira os objetos já devolvidos pelas anteriores.
+        session.expunge_all()
+
+
+@asynccontextmanager
+async def escopoSessao() -> AsyncIterator[AsyncSession]:
+    """Abre o escopo de sessão de uma requisição: uma única conexão, retirada do pool uma vez, e uma sessão ambiente
+    ligada a ela, reaproveitada por todas as operações dos models executadas no bloco pela mesma tarefa. Cada operação
+    continua com a transação própria, confirmada ao final dela. Dentro de outro escopo, reaproveita o externo.
+    Exemplo:
+        async with escopoSessao():
+            picole = await Picole.selectPicolePorId(1)
+            lotes = await Lote.selectLotesPorPicoleFk(picole.id)
+    :return: AsyncIterator[AsyncSession]
+    """
+    session = _sessaoAmbiente()
+    if session is not None:
+        yield session
+        return
+
+    async with createEngine().connect() as conn:
+        session = AsyncSession(bind=conn, expire_on_commit=False)
+        try:
+            async with _publicarSessao(session):
+                yield session
+            # alguma transação iniciada fora das operações dos models (ex.: carga de um relacionamento)
+            if session.in_transaction():
+                await session.commit()
+        finally:
+            await session.close()
+
+
+@asynccontextmanager
+async def sessionScope(savepoint: bool = True) -> AsyncIterator[AsyncSession]:
+    """Fornece a sessão usada pelas operações dos models.
+    Dentro de um UnitOfWork, reaproveita a sessão e a transação dele, sem commit; com savepoint=True a operação é
+    isolada em um SAVEPOINT, de modo que uma falha desfaz somente ela. O mesmo vale para uma operação chamada dentro
+    de outra na mesma tarefa, que reaproveita a sessão ambiente da operação externa.
+    Nos demais casos, abre uma transação própria, confirmada ao final do bloco: as escritas (savepoint=True) usam
+    sessaoEscrita, e as leituras (savepoint=False) usam a sessão de escopoSessao, se houver, ou o pool da engine padrão.
+    :param savepoint: bool: se True, isola a operação em um SAVEPOINT quando estiver dentro de outra transação
+    :return: AsyncIterator[AsyncSession]
+    """
+    session = _sessao_uow.get()
+    if session is None:
+        session = _sessaoAmbiente()
+        if session is not None and not session.in_transaction():
+            # escopoSessao sem operação em andamento: a operação abre a própria transação na conexão do escopo
+            if not savepoint:
+                async with _tipoTransacao(escrita=False), _transacaoNoEscopo(session):
+                    yield session
+                return
+            session = None
+
+    if session is not None:
+        if savepoint:
+            async with session.begin_nested():
+                yield session
+        else:
+            yield session
+        return
+
+    if savepoint:
+        async with sessaoEscrita() as session:
+            async with _publicarSessao(session):
+                yield session
+        return
+
+    session = await createSession()
+    try:
+        async with _tipoTransacao(escrita=False), session.begin():
+            async with _publicarSessao(session):
+                yield session
+    finally:
+        await session.close()
+
+
+@asynccontextmanager
+async def conexaoLeitura() -> AsyncIterator[AsyncConnection]:
+    """Fornece uma AsyncConnection para as leituras Core dos models, que executam select() direto na conexão e
+    devolvem tuplas ou mappings, sem Session, identity map ou carga de relacionamentos.
+    Dentro de um UnitOfWork, de escopoSessao ou de outra operação, usa a conexão da sessão já em uso.
+    :return: AsyncIterator[AsyncConnection]
+    """
+    session = _sessao_uow.get() or _sessaoAmbiente()
+    if session is None:
+        async with _tipoTransacao(escrita=False), createEngine().connect() as conexao:
+            yield conexao
+        return
+
+    if session.in_transaction():
+        yield await session.connection()
+        return
+
+    async with _tipoTransacao(escrita=False), _transacaoNoEscopo(session):
+        yield await session.connection()
+
+
+def registrarEscritor(escritor) -> None:
+    """Define o escritor único usado pelas transações de escrita, ou None para voltar a usar a engine padrão.
+    Chamado por ativarSqliteWriter/desativarSqliteWriter.
+    :param escritor: SqliteWriter or None
+    """
+    global _escritor
+    _escritor = escritor
+
+
+@asynccontextmanager
+async def sessaoEscrita() -> AsyncIterator[AsyncSession]:
+    """Abre uma sessão com transação de escrita própria, confirmada ao final do bloco, sem considerar o UnitOfWork
+    do contexto. Com o SqliteWriter ativo, a transação aguarda a vez na conexão de escrita dedicada; dentro de
+    escopoSessao, usa a conexão do escopo. No sqlite a transação começa com BEGIN IMMEDIATE.
+    :return: AsyncIterator[AsyncSession]
+    """
+    if _escritor is not None:
+        async with _escritor.transacao() as session:
+            yield session
+        return
+
+    session = _sessaoAmbiente()
+    if session is not None and not session.in_transaction():
+        # dentro de escopoSessao: usa a conexão do escopo
+        async with _tipoTransacao(escrita=True), _transacaoNoEscopo(session):
+            yield session
+        return
+
+    session = await createSession()
+    try:
+        async with _tipoTransacao(escrita=True), session.begin():
+            yield session
+    finally:
+        await session.close()
+
+
+def registrarModels() -> None:
+    """Registra todas as tabelas no metadata do ModelBase, importando models/__all_models.py.
+    A importação de um model carrega somente ele e as dependências dele; as operações que precisam do schema inteiro
+    (createTables, DataBaseFeatures.findColunasDependentes, a carga de dados) chamam esta função antes de usá-lo.
+    """
+    import models.__all_models
+
+
+@event.listens_for(Mapper, 'before_configured')
+def _registrarModelsAntesDosMappers() -> None:
+    # os relacionamentos citam as tabelas de associação pelo nome (ex.: secondary='ingrediente_picole'), e os módulos
+    # delas importam o Picole; por isso todos os models são registrados na primeira configuração dos mappers, que
+    # acontece no primeiro uso de um model, e não na importação
+    registrarModels()
 
 
 async def createTables(sqlite: bool = True) -> None:
@@ -119,10 +548,92 @@ async def createTables(sqlite: bool = True) -> None:
     if __async_engine is None:
         __async_engine = createEngine(sqlite=sqlite)
 
-    import models.__all_models
+    registrarModels()
 
     # abre uma conexão com o banco de dados, cria as tabelas e fecha a conexão
     async with __async_engine.begin() as conn:
         await conn.run_sync(ModelBase.metadata.drop_all)
         await conn.run_sync(ModelBase.metadata.create_all)
 
+
+# Engine síncrona, gêmea da engine padrão, para os scripts em lote executados offline, em um único processo (ex.:
+# create_main.py). Com a engine async cada comando passa pela thread do aiosqlite e pela ponte de greenlets do
+# SQLAlchemy; com a síncrona ele é executado direto na thread atual. O banco, as configurações das conexões e o
+# ModelBase.metadata são os mesmos, mas os métodos dos models continuam async: os scripts usam a Session ou a
+# Connection diretamente. As escritas síncronas não passam pelo SqliteWriter, então não devem concorrer com uma carga
+# async no mesmo banco. Ver benchmarks/ponte_async.py.
+
+
+def _descartarEngineSync() -> None:
+    global __sync_engine
+
+    if __sync_engine is not None:
+        __sync_engine.dispose()
+    __sync_engine = None
+
+
+def createSyncEngine(sqlite: bool = True, echo: bool = False, timeout: int = 30) -> Engine:
+    """Cria/Configura a engine síncrona, gêmea da engine padrão: usa o banco da engine padrão, se já houver uma
+    (inclusive a instalada por configurarBancoSqlite), ou o de conf/settings.py, com o driver síncrono correspondente
+    (sqlite3 no lugar do aiosqlite, psycopg2 no lugar do asyncpg).
+    Com ':memory:' a engine síncrona tem um banco próprio; para compartilhar o banco em memória com a engine padrão, use
+    'file::memory:?cache=shared'.
+    :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres; ignorado se PICOLES_DB_URL estiver definida
+    :param echo: bool: se True, mostra as queries executadas, se False, não mostra
+    :param timeout: int: tempo limite para conexão, padrão 30 segundos
+    :return: Engine
+    """
+    global __sync_engine
+
+    if __sync_engine is not None:
+        return __sync_engine
+
+    caminho, url = _bancoDaUrl(__async_engine.url) if __async_engine is not None else _bancoPadrao(sqlite)
+    if caminho is not None:
+        __sync_engine = _criarEngineSqlite(caminho, echo=echo, timeout=timeout, sincrona=True)
+    else:
+        driver = _DRIVERS_SINCRONOS.get(url.get_driver_name(), url.get_driver_name())
+        __sync_engine = create_engine(
+            url=url.set(drivername=f'{url.get_backend_name()}+{driver}'),  # caminho do banco de dados
+            echo=echo,  # se True, mostra as queries executadas
+            query_cache_size=TAMANHO_CACHE_SQL  # cache de comandos compilados
+        )
+        _registrarEstatisticasCache(__sync_engine)
+    return __sync_engine
+
+
+def createSyncSession(sqlite: bool = True, echo: bool = False, timeout: int = 30) -> Session:
+    """Cria uma sessão síncrona com o banco de dados, ligada à engine síncrona
+    :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres
+    :param echo: bool: se True, mostra as queries executadas, se False, não mostra
+    :param timeout: int: tempo limite para conexão, padrão 30 segundos
+    :return: Session
+    """
+    return Session(bind=createSyncEngine(sqlite=sqlite, echo=echo, timeout=timeout), expire_on_commit=False)
+
+
+@contextmanager
+def sessionScopeSync() -> Iterator[Session]:
+    """Abre uma sessão síncrona com uma transação, confirmada no final do bloco ou desfeita se houver erro. É o gêmeo
+    síncrono do sessionScope, sem o UnitOfWork, a sessão ambiente e o SqliteWriter.
+    Exemplo:
+        with sessionScopeSync() as session:
+            session.execute(sa.insert(Sabor), [{'nome': 'Morango'}, {'nome': 'Uva'}])
+    """
+    session = createSyncSession()
+    try:
+        with session.begin():
+            yield session
+    finally:
+        session.close()
+
+
+def createTablesSync(sqlite: bool = True) -> None:
+    """Cria as tabelas no banco de dados pela engine síncrona, apagando as existentes, como createTables
+    :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres
+    """
+    registrarModels()
+
+    with createSyncEngine(sqlite=sqlite).begin() as conn:
+        ModelBase.metadata.drop_all(conn)
+        ModelBase.metadata.create_all(conn)
@@ -2,45 +2,120 @@ import string
 import random
 
 from datetime import datetime
+from typing import Optional
 
+# Gerador aleatório usado por todos os helpers. Com definir_semente(semente) os valores gerados passam a ser
+# reproduzíveis; as variantes em lote (gerar_strings, gerar_ints, gerar_floats, gerar_cores) geram n valores com
+# poucas chamadas ao gerador, em vez de uma chamada Python por valor.
+_gerador = random.Random()
 
-def gerar_string(frase: bool = False) -> str:
+_ALFABETO = string.ascii_lowercase + string.digits
+# os dígitos viram espaços, como em gerar_string
+_DIGITOS_PARA_ESPACO = str.maketrans(string.digits, ' ' * len(string.digits))
+_HEXADECIMAL = '0123456789ABCDEF'
+
+
+def definir_semente(semente: Optional[int] = None) -> random.Random:
+    """Reinicia o gerador dos helpers com a semente informada; None usa a entropia do sistema
+    :param semente: int: semente do gerador
+    :return: random.Random: o gerador dos helpers, para sorteios adicionais com a mesma semente
+    """
+    _gerador.seed(semente)
+    return _gerador
+
+
+def obter_gerador() -> random.Random:
+    """Retorna o gerador dos helpers"""
+    return _gerador
+
+
+def _tamanho_texto(frase: bool) -> int:
     # Para nomes, o tamanho é 10, para descrição ou algo do tipo, 30
-    tamanho: int = 10
-    if frase:
-        tamanho = 30
-    texto: str = ''.join(random.choices(string.ascii_lowercase + string.digits, k = tamanho))
+    return 30 if frase else 10
 
-    texto = ''.join([c if c.isalpha() else ' ' for c in texto])
+
+def gerar_string(frase: bool = False) -> str:
+    tamanho: int = _tamanho_texto(frase)
+    texto: str = ''.join(_gerador.choices(_ALFABETO, k=tamanho))
+
+    texto = texto.translate(_DIGITOS_PARA_ESPACO)
 
     return texto
 
 
+def gerar_strings(n: int, frase: bool = False) -> list[str]:
+    """Gera n textos como gerar_string, sorteando todos os caracteres em uma única chamada
+    :param n: int: quantidade de textos
+    :param frase: bool: se True, textos de descrição (30 caracteres), se False, nomes (10 caracteres)
+    :return: list[str]
+    """
+    tamanho: int = _tamanho_texto(frase)
+    texto: str = ''.join(_gerador.choices(_ALFABETO, k=n * tamanho)).translate(_DIGITOS_PARA_ESPACO)
+
+    return [texto[inicio:inicio + tamanho] for inicio in range(0, n * tamanho, tamanho)]
+
+
 def gerar_int() -> int:
-    valor = random.randint(1, 100)
+    valor = _gerador.randint(1, 100)
 
     return valor
 
 
-def gerar_float(digitos: int = 1) -> float:
-    valor: float = 0
+def gerar_ints(n: int, inicio: int = 1, fim: int = 100) -> list[int]:
+    """Gera n inteiros entre inicio e fim, inclusive
+    :param n: int: quantidade de valores
+    :param inicio: int: menor valor
+    :param fim: int: maior valor
+    :return: list[int]
+    """
+    return _gerador.choices(range(inicio, fim + 1), k=n)
+
+
+def _intervalo_float(digitos: int) -> tuple[float, float]:
     if digitos == 1:
-        valor = random.uniform(1, 9)
+        return 1, 9
     elif digitos == 2:
-        valor = random.uniform(10, 99)
+        return 10, 99
     elif digitos == 3:
-        valor = random.uniform(100, 999)
-    else:
-        valor = random.uniform(1000, 99999)
-    
+        return 100, 999
+    return 1000, 99999
+
+
+def gerar_float(digitos: int = 1) -> float:
+    minimo, maximo = _intervalo_float(digitos)
+    valor: float = _gerador.uniform(minimo, maximo)
+
     return round(valor, 2)
 
 
+def gerar_floats(n: int, digitos: int = 1) -> list[float]:
+    """Gera n valores como gerar_float, com duas casas decimais
+    :param n: int: quantidade de valores
+    :param digitos: int: quantidade de dígitos da parte inteira (1, 2, 3 ou mais)
+    :return: list[float]
+    """
+    minimo, maximo = _intervalo_float(digitos)
+    # sorteio único sobre a grade de centavos do intervalo: os valores já saem com duas casas, sem round por valor
+    centavos = _gerador.choices(range(minimo * 100, maximo * 100 + 1), k=n)
+
+    return [centavo / 100 for centavo in centavos]
+
+
 def gerar_cor() -> str:
-    cor = "#"+''.join([random.choice('0123456789ABCDEF') for j in range(6)])
+    cor = "#"+''.join(_gerador.choices(_HEXADECIMAL, k=6))
 
     return cor
 
 
+def gerar_cores(n: int) -> list[str]:
+    """Gera n cores hexadecimais como gerar_cor
+    :param n: int: quantidade de cores
+    :return: list[str]
+    """
+    texto: str = ''.join(_gerador.choices(_HEXADECIMAL, k=n * 6))
+
+    return ['#' + texto[inicio:inicio + 6] for inicio in range(0, n * 6, 6)]
+
+
 def formata_data(data: datetime) -> str:
     return data.strftime("%d/%m/%Y às %H:%M:%S")
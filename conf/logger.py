@@ -0,0 +1,54 @@
+import logging
+import os
+import warnings
+
+# Este módulo é responsável pelo logging da camada de models.
+# Todos os loggers dos models ficam abaixo do logger 'models', que por padrão não emite nada por registro:
+# as mensagens por linha inserida usam o nível DEBUG e o nível padrão é WARNING.
+# O nível pode ser alterado pela variável de ambiente PICOLES_LOG_LEVEL (ex.: DEBUG, INFO) ou pela
+# função configurarLogging. Um nível desconhecido em PICOLES_LOG_LEVEL é ignorado, com um aviso, e vale o WARNING.
+# As mensagens devem ser formatadas de forma preguiçosa (log.debug('id=%s', id)) e usar somente colunas
+# já carregadas, para que o log nunca dispare consultas extras aos relacionamentos.
+
+LOGGER_MODELS = 'models'
+
+_logger_models = logging.getLogger(LOGGER_MODELS)
+_logger_models.addHandler(logging.NullHandler())
+
+
+def _nivelAmbiente() -> str:
+    """Lê o nível de PICOLES_LOG_LEVEL. Um nível desconhecido não pode impedir a importação dos models, por isso
+    vale o WARNING, com um aviso
+    :return: str: nome do nível
+    """
+    nivel = os.environ.get('PICOLES_LOG_LEVEL', 'WARNING').strip().upper()
+    if nivel not in logging.getLevelNamesMapping():
+        warnings.warn(f'PICOLES_LOG_LEVEL={nivel!r} não é um nível de log conhecido, usando WARNING', RuntimeWarning)
+        return 'WARNING'
+    return nivel
+
+
+_logger_models.setLevel(_nivelAmbiente())
+
+
+def getLogger(nome: str) -> logging.Logger:
+    """Retorna o logger de um model, abaixo do logger 'models'
+    :param nome: str: nome do módulo do model, ex.: 'picole'
+    :return: logging.Logger
+    """
+    return logging.getLogger(f'{LOGGER_MODELS}.{nome}')
+
+
+def configurarLogging(nivel: str = 'DEBUG', formato: str = '%(asctime)s %(name)s %(levelname)s %(message)s') \
+        -> logging.Logger:
+    """Habilita a saída dos logs dos models no stderr, útil em scripts e para depuração
+    :param nivel: str: nível mínimo das mensagens, padrão DEBUG
+    :param formato: str: formato das mensagens
+    :return: logging.Logger: logger 'models'
+    """
+    _logger_models.setLevel(nivel.upper())
+    if not any(isinstance(handler, logging.StreamHandler) for handler in _logger_models.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(formato))
+        _logger_models.addHandler(handler)
+    return _logger_models
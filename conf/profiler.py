@@ -0,0 +1,240 @@
+import atexit
+import functools
+import os
+import random
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, Optional, TypeVar
+
+from conf.logger import getLogger
+
+# Este módulo é responsável pelo modo de profiling das operações dos models, ativado pela variável de ambiente
+# PICOLES_PROFILE com o diretório dos resultados:
+#     PICOLES_PROFILE=perfis python -m benchmarks.carga_mista --clientes 1
+# Sem a variável, nada é envolvido e o custo é zero.
+#
+# Cada operação decorada com retryTransitorio (ver conf/retry.py) é executada sob um cProfile próprio, e os perfis
+# são acumulados por operação. Os pontos de entrada (populate_main.py, rebuild_catalog_main.py,
+# repair_rollups_main.py) usam perfilarEntrada, com um perfil único para a execução inteira. Ao final do processo, ou
+# com salvarPerfis(), o diretório recebe:
+#   - <operacao>.prof: grafo de chamadas no formato do pstats (snakeviz, gprof2dot, python -m pstats);
+#   - perfis.collapsed: pilhas colapsadas de todas as operações, uma por linha com o tempo em microssegundos, prontas
+#     para o flamegraph.pl ou o speedscope. O cProfile guarda somente as arestas chamador -> chamado, então as pilhas
+#     são reconstruídas distribuindo o tempo de cada função entre os chamadores, na proporção de cada aresta;
+#   - resumo.txt: chamadas e tempo por operação, e o tempo próprio por categoria: compilação do SQL, hidratação do
+#     ORM, greenlet, espera no loop (o aiosqlite executa o SQL na própria thread, fora do perfil, e essa espera
+#     aparece no select do loop) e asyncio.
+#
+# O cProfile mede a thread inteira, e não uma tarefa: enquanto a operação perfilada aguarda, as tarefas que rodam no
+# loop também entram no perfil dela. Por isso somente uma operação é perfilada por vez (as que começam enquanto outra
+# está sendo perfilada são contadas como ignoradas) e, para perfis limpos, a carga deve rodar com um único cliente.
+# PICOLES_PROFILE_AMOSTRA (0 a 1, padrão 1) perfila somente uma fração das operações.
+
+log = getLogger('profiler')
+
+T = TypeVar('T')
+
+DIRETORIO_PERFIS = os.environ.get('PICOLES_PROFILE', '')
+AMOSTRA_PERFIS = float(os.environ.get('PICOLES_PROFILE_AMOSTRA', 1.0))
+
+# profundidade máxima e tempo mínimo (em segundos) das pilhas colapsadas
+PROFUNDIDADE_PILHAS = 96
+TEMPO_MINIMO_PILHA = 1e-6
+
+# categorias do resumo: trechos procurados no arquivo e no nome de cada função, na ordem
+CATEGORIAS = [
+    ('compilação do SQL', ('sqlalchemy/sql/compiler.py', 'sqlalchemy/sql/cache_key.py', 'sqlalchemy/sql/traversals.py')),
+    ('hidratação do ORM', ('sqlalchemy/orm/loading.py', 'sqlalchemy/orm/strategies.py', 'sqlalchemy/orm/state.py',
+                           'sqlalchemy/orm/identity.py', 'sqlalchemy/engine/result.py')),
+    ('greenlet', ('greenlet', 'sqlalchemy/util/_concurrency_py3k.py')),
+    ('espera no loop (aiosqlite)', ('select.epoll', 'select.kqueue', 'selectors.py', 'aiosqlite/')),
+    ('asyncio', ('asyncio/',)),
+]
+
+_perfis: dict[str, 'pstats.Stats'] = {}
+_chamadas: Counter = Counter()
+_ignoradas: Counter = Counter()
+_perfil_atual: Optional['cProfile.Profile'] = None
+
+
+def perfilAtivo() -> bool:
+    """Verifica se o modo de profiling está ativo (PICOLES_PROFILE definida)"""
+    return bool(DIRETORIO_PERFIS)
+
+
+@contextmanager
+def _perfilar(nome: str):
+    """Executa o bloco sob um cProfile e acumula o resultado no perfil da operação, se nenhuma outra estiver sendo
+    perfilada"""
+    # cProfile e pstats são importados somente com o modo de profiling ativo
+    import cProfile
+    import pstats
+
+    global _perfil_atual
+    if _perfil_atual is not None or random.random() >= AMOSTRA_PERFIS:
+        _ignoradas[nome] += 1
+        yield
+        return
+
+    perfil = cProfile.Profile()
+    _perfil_atual = perfil
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        _perfil_atual = None
+        _chamadas[nome] += 1
+        if nome in _perfis:
+            _perfis[nome].add(perfil)
+        else:
+            _perfis[nome] = pstats.Stats(perfil)
+
+
+def perfilarOperacao(funcao, nome: str = None):
+    """Envolve uma operação async com o profiler, quando o modo de profiling estiver ativo; caso contrário, retorna a
+    própria função
+    :param funcao: função async
+    :param nome: str: nome da operação nos resultados; padrão, o __qualname__ da função
+    :return: a função envolvida, ou a própria função
+    """
+    if not perfilAtivo():
+        return funcao
+    nome = nome or funcao.__qualname__
+
+    @functools.wraps(funcao)
+    async def _executar(*args, **kwargs):
+        with _perfilar(nome):
+            return await funcao(*args, **kwargs)
+
+    return _executar
+
+
+async def perfilarEntrada(nome: str, coroutine: Awaitable[T]) -> T:
+    """Aguarda a coroutine de um ponto de entrada sob um único perfil, 'entrada.<nome>', quando o modo de profiling
+    estiver ativo. As operações chamadas por ela ficam dentro desse perfil.
+    Exemplo:
+        asyncio.run(perfilarEntrada('populate', popular(scale=10)))
+    :param nome: str: nome do ponto de entrada
+    :param coroutine: coroutine executada
+    :return: o resultado da coroutine
+    """
+    if not perfilAtivo():
+        return await coroutine
+    with _perfilar(f'entrada.{nome}'):
+        return await coroutine
+
+
+def _rotulo(funcao: tuple) -> str:
+    arquivo, linha, nome = funcao
+    if arquivo == '~':
+        rotulo = nome
+    else:
+        rotulo = f'{nome} ({Path(arquivo).name}:{linha})'
+    # o ';' separa os quadros na pilha colapsada
+    return rotulo.replace(';', ',')
+
+
+def pilhasColapsadas(nome: str, estatisticas: 'pstats.Stats') -> Counter:
+    """Reconstrói as pilhas de chamadas de um perfil, com o tempo próprio de cada pilha em microssegundos
+    :param nome: str: nome da operação, quadro raiz das pilhas
+    :param estatisticas: pstats.Stats: perfil da operação
+    :return: Counter: 'operacao;quadro;...;quadro' -> microssegundos
+    """
+    dados = estatisticas.stats
+    filhos = defaultdict(list)
+    for funcao, (_, _, _, _, chamadores) in dados.items():
+        for chamador, (_, _, _, tempo_aresta) in chamadores.items():
+            filhos[chamador].append((funcao, tempo_aresta))
+    pilhas = Counter()
+    alcancadas = set()
+
+    def _visitar(funcao: tuple, fracao: float, caminho: tuple, no_caminho: frozenset):
+        alcancadas.add(funcao)
+        _, _, tempo_proprio, _, _ = dados[funcao]
+        caminho = caminho + (_rotulo(funcao),)
+        if tempo_proprio * fracao >= TEMPO_MINIMO_PILHA:
+            pilhas[';'.join(caminho)] += round(tempo_proprio * fracao * 1e6)
+        if len(caminho) >= PROFUNDIDADE_PILHAS:
+            return
+        no_caminho = no_caminho | {funcao}
+        for filho, tempo_aresta in filhos.get(funcao, ()):
+            tempo_filho = dados[filho][3]
+            # chamadas recursivas já estão no tempo do quadro acima
+            if filho in no_caminho or tempo_filho <= 0 or tempo_aresta * fracao < TEMPO_MINIMO_PILHA:
+                continue
+            _visitar(filho, fracao * tempo_aresta / tempo_filho, caminho, no_caminho)
+
+    # o perfil começa dentro de uma coroutine e o loop retoma as tarefas a partir dela, então o grafo tem ciclos e
+    # nem sempre há uma função sem chamadores: a raiz é a função de maior tempo acumulado, e as funções que não forem
+    # alcançadas a partir dela viram raízes, na mesma ordem
+    for raiz in sorted(dados, key=lambda funcao: dados[funcao][3], reverse=True):
+        if raiz not in alcancadas:
+            _visitar(raiz, 1.0, (nome,), frozenset())
+    return pilhas
+
+
+def _categoria(funcao: tuple) -> str:
+    arquivo, _, nome = funcao
+    texto = f'{arquivo.replace(os.sep, "/")}:{nome}'
+    for categoria, trechos in CATEGORIAS:
+        if any(trecho in texto for trecho in trechos):
+            return categoria
+    return 'outros'
+
+
+def _resumo() -> list[str]:
+    linhas = []
+    for nome, estatisticas in sorted(_perfis.items()):
+        total = estatisticas.total_tt
+        linhas.append(f'{nome}: {_chamadas[nome]} chamada(s) perfilada(s), {_ignoradas[nome]} ignorada(s), '
+                      f'{total * 1e3:.1f} ms, {total / _chamadas[nome] * 1e6:.0f} µs por chamada')
+        por_categoria = Counter()
+        for funcao, (_, _, tempo_proprio, _, _) in estatisticas.stats.items():
+            por_categoria[_categoria(funcao)] += tempo_proprio
+        for categoria, tempo in por_categoria.most_common():
+            linhas.append(f'    {categoria:<28} {tempo * 1e3:>10.2f} ms {tempo / total if total else 0:>7.1%}')
+    return linhas
+
+
+def salvarPerfis(diretorio: str = None) -> list[Path]:
+    """Grava os perfis acumulados: um .prof por operação, as pilhas colapsadas de todas as operações e o resumo
+    :param diretorio: str: diretório dos resultados; padrão, PICOLES_PROFILE
+    :return: list[Path]: arquivos gravados
+    """
+    diretorio = Path(diretorio or DIRETORIO_PERFIS)
+    if not _perfis or not str(diretorio):
+        return []
+    diretorio.mkdir(parents=True, exist_ok=True)
+
+    arquivos = []
+    pilhas = Counter()
+    for nome, estatisticas in _perfis.items():
+        arquivo = diretorio / f'{nome}.prof'
+        estatisticas.dump_stats(arquivo)
+        arquivos.append(arquivo)
+        pilhas.update(pilhasColapsadas(nome, estatisticas))
+
+    arquivo = diretorio / 'perfis.collapsed'
+    arquivo.write_text(''.join(f'{pilha} {tempo}\n' for pilha, tempo in sorted(pilhas.items()) if tempo > 0),
+                       encoding='utf-8')
+    arquivos.append(arquivo)
+
+    arquivo = diretorio / 'resumo.txt'
+    arquivo.write_text('\n'.join(_resumo()) + '\n', encoding='utf-8')
+    arquivos.append(arquivo)
+
+    log.warning('Perfis gravados em %s: %s operação(ões)', diretorio, len(_perfis))
+    return arquivos
+
+
+def zerarPerfis() -> None:
+    """Descarta os perfis acumulados"""
+    _perfis.clear()
+    _chamadas.clear()
+    _ignoradas.clear()
+
+
+if perfilAtivo():
+    atexit.register(salvarPerfis)
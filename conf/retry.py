@@ -0,0 +1,134 @@
+import asyncio
+import functools
+import random
+from collections import Counter
+from typing import Awaitable, Callable, TypeVar
+
+from conf.db_session import emTransacaoCompartilhada
+from conf.logger import getLogger
+from conf.profiler import perfilarOperacao
+
+# Este módulo é responsável por repetir as operações que falham por erros transitórios do banco:
+#   - sqlite: SQLITE_BUSY / SQLITE_LOCKED ("database is locked");
+#   - postgres: serialization_failure (40001) e deadlock_detected (40P01).
+# A operação é repetida com espera exponencial limitada e jitter completo: antes da tentativa n (a partir de 1) espera
+# um valor aleatório entre 0 e min(teto, base * 2 ** n), para que os chamadores que falharam juntos não voltem juntos.
+#
+# O decorator retryTransitorio é aplicado às operações dos models. Dentro de um UnitOfWork, ou de outra operação
+# na mesma tarefa, ele não repete nada: a transação externa foi comprometida, então quem repete é a operação externa
+# ou o escopo do UnitOfWork, com UnitOfWork.executar.
+# Os demais erros, inclusive os de backpressure do SqliteWriter, são propagados na primeira ocorrência.
+#
+# Os contadores por operação ficam disponíveis em estatisticasRetry().
+# O decorator também é o ponto em que as operações são perfiladas, quando PICOLES_PROFILE estiver definida.
+
+log = getLogger('retry')
+
+T = TypeVar('T')
+
+TENTATIVAS = 5
+ESPERA_BASE = 0.05
+ESPERA_TETO = 2.0
+
+# códigos primários do sqlite (sqlite3.Error.sqlite_errorcode & 0xFF)
+_SQLITE_BUSY = 5
+_SQLITE_LOCKED = 6
+# SQLSTATE do postgres
+_PG_TRANSITORIOS = {'40001', '40P01'}
+
+_contadores: Counter = Counter()
+
+
+def ehErroTransitorio(exc: BaseException) -> bool:
+    """Verifica se um erro, ou algum erro da cadeia que o originou, é um erro transitório do banco.
+    Os models embrulham os erros em novas exceções, por isso a cadeia __cause__/__context__ é percorrida.
+    :param exc: BaseException: erro capturado
+    :return: bool: True se a operação pode ser repetida
+    """
+    vistos = set()
+    while exc is not None and id(exc) not in vistos:
+        vistos.add(id(exc))
+        # erros do SQLAlchemy guardam o erro do driver em 'orig'
+        for erro in (exc, getattr(exc, 'orig', None)):
+            if erro is None:
+                continue
+            codigo_sqlite = getattr(erro, 'sqlite_errorcode', None)
+            if codigo_sqlite is not None and codigo_sqlite & 0xFF in (_SQLITE_BUSY, _SQLITE_LOCKED):
+                return True
+            if getattr(erro, 'sqlstate', None) in _PG_TRANSITORIOS or getattr(erro, 'pgcode', None) in _PG_TRANSITORIOS:
+                return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def calcularEspera(tentativa: int, base: float = ESPERA_BASE, teto: float = ESPERA_TETO) -> float:
+    """Calcula a espera antes de uma nova tentativa, exponencial limitada com jitter completo
+    :param tentativa: int: número da nova tentativa, a partir de 1
+    :param base: float: espera base, em segundos
+    :param teto: float: espera máxima, em segundos
+    :return: float: espera em segundos
+    """
+    return random.uniform(0, min(teto, base * 2 ** tentativa))
+
+
+async def executarComRetry(operacao: Callable[[], Awaitable[T]], nome: str, tentativas: int = TENTATIVAS,
+                           base: float = ESPERA_BASE, teto: float = ESPERA_TETO) -> T:
+    """Executa a operação, repetindo-a enquanto falhar com um erro transitório e houver tentativas
+    :param operacao: Callable[[], Awaitable]: função sem parâmetros que cria a coroutine da operação
+    :param nome: str: nome da operação, usado nos contadores e no log
+    :param tentativas: int: quantidade máxima de execuções
+    :param base: float: espera base, em segundos
+    :param teto: float: espera máxima, em segundos
+    :return: o resultado da operação
+    :raises Exception: O erro da última tentativa, ou o primeiro erro não transitório
+    """
+    tentativa = 0
+    while True:
+        try:
+            resultado = await operacao()
+        except Exception as exc:
+            tentativa += 1
+            if not ehErroTransitorio(exc):
+                raise
+            if tentativa >= tentativas:
+                _contadores[f'{nome}.esgotadas'] += 1
+                log.warning('%s: erro transitório após %s tentativa(s), desistindo: %s', nome, tentativa, exc)
+                raise
+            _contadores[f'{nome}.retries'] += 1
+            espera = calcularEspera(tentativa, base, teto)
+            log.info('%s: erro transitório, nova tentativa %s em %.3fs: %s', nome, tentativa + 1, espera, exc)
+            await asyncio.sleep(espera)
+        else:
+            if tentativa:
+                _contadores[f'{nome}.recuperadas'] += 1
+            return resultado
+
+
+def retryTransitorio(funcao):
+    """Decorator para as operações async dos models: repete a operação em caso de erro transitório do banco,
+    exceto dentro de uma transação compartilhada, onde o erro é propagado para que o escopo externo seja repetido.
+    Deve ficar abaixo do @staticmethod. Com o modo de profiling ativo (PICOLES_PROFILE), a operação também é perfilada,
+    ver conf/profiler.py.
+    """
+    nome = funcao.__qualname__
+
+    @functools.wraps(funcao)
+    async def _executar(*args, **kwargs):
+        if emTransacaoCompartilhada():
+            return await funcao(*args, **kwargs)
+        return await executarComRetry(lambda: funcao(*args, **kwargs), nome)
+
+    return perfilarOperacao(_executar, nome)
+
+
+def estatisticasRetry() -> dict[str, int]:
+    """Retorna os contadores de retry por operação, nas chaves '<operacao>.retries' (novas tentativas),
+    '<operacao>.recuperadas' (sucesso após retry) e '<operacao>.esgotadas' (falha após a última tentativa)
+    :return: dict[str, int]
+    """
+    return dict(_contadores)
+
+
+def zerarEstatisticasRetry() -> None:
+    """Zera os contadores de retry"""
+    _contadores.clear()
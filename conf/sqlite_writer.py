@@ -0,0 +1,219 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from conf.db_session import createEngine, registrarEscritor, ehBancoMemoria, _caminhoSqlite, \
+    _configurarConexaoSqlite, _registrarEstatisticasCache, TAMANHO_CACHE_SQL
+from conf.logger import getLogger
+
+# Este módulo é responsável pelo SqliteWriter, o escritor único do sqlite.
+# O sqlite aceita somente um escritor por vez: com várias transações de escrita concorrentes, as que não conseguem o
+# lock ficam presas até o timeout da conexão (30 segundos) e então falham com "database is locked".
+# Com o SqliteWriter ativo, todas as transações de escrita dos models (sessionScope, UnitOfWork e WriteBatcher) passam
+# por uma única conexão dedicada. Uma tarefa em segundo plano concede a vez a uma transação de cada vez, na ordem de
+# chegada, a partir de uma fila com profundidade máxima. A tarefa somente concede e aguarda a vez: o bloco da
+# transação é executado na tarefa do próprio chamador, e a serialização vem da vez e da conexão única de escrita:
+#   - fila cheia: a escrita é recusada na hora com FilaEscritaCheiaError (backpressure);
+#   - vez não concedida dentro do prazo da operação: PrazoEscritaExcedidoError.
+# As leituras continuam no pool da engine padrão e, com o journal em WAL, não bloqueiam nem são bloqueadas pelo escritor.
+#
+# O uso é opcional:
+#     await ativarSqliteWriter(max_fila=256, prazo=2)
+#     ...
+#     await desativarSqliteWriter()
+# Como a conexão de escrita é aberta pelo escritor, o banco em memória precisa ser compartilhado entre conexões
+# ('file:<nome>?mode=memory&cache=shared'): com ':memory:', cada conexão teria um banco próprio e vazio.
+
+log = getLogger('sqlite_writer')
+
+
+class FilaEscritaCheiaError(RuntimeError):
+    """A fila do SqliteWriter atingiu a profundidade máxima e a escrita foi recusada"""
+
+
+class PrazoEscritaExcedidoError(TimeoutError):
+    """A escrita não obteve a vez do SqliteWriter dentro do prazo da operação"""
+
+
+class SqliteWriter:
+    """Escritor único do sqlite: uma conexão de escrita dedicada (pool de uma única conexão) e uma tarefa em segundo
+    plano que concede a vez às transações, uma de cada vez, na ordem de chegada.
+    O bloco de SqliteWriter.transacao não é executado pela tarefa do escritor, e sim na tarefa de quem o chamou, entre
+    receber a vez e liberá-la; a tarefa do escritor apenas aguarda a liberação para conceder a próxima vez. Por isso o
+    código existente baseado em sessões funciona sem alterações, e variáveis de contexto do chamador continuam valendo.
+    """
+
+    def __init__(self, max_fila: int = 256, prazo: float = 2.0):
+        """Cria o escritor único do sqlite
+        :param max_fila: int: quantidade máxima de transações aguardando a vez
+        :param prazo: float: tempo máximo padrão, em segundos, que uma transação aguarda a vez
+        """
+        if max_fila <= 0:
+            raise ValueError('max_fila do SqliteWriter deve ser maior que zero!')
+        if prazo <= 0:
+            raise ValueError('prazo do SqliteWriter deve ser maior que zero!')
+
+        self.max_fila = max_fila
+        self.prazo = prazo
+        self.transacoes = 0
+        self.recusadas = 0
+        self.expiradas = 0
+        self._engine: Optional[AsyncEngine] = None
+        self._sessionmaker: Optional[sessionmaker] = None
+        self._fila: Optional[asyncio.Queue] = None
+        self._tarefa: Optional[asyncio.Task] = None
+
+    @property
+    def profundidade(self) -> int:
+        """Quantidade de transações aguardando a vez"""
+        return self._fila.qsize() if self._fila is not None else 0
+
+    async def iniciar(self) -> None:
+        """Abre a conexão dedicada de escrita, ativa o journal em WAL e inicia a tarefa em segundo plano
+        :raises RuntimeError: Se o banco não for o sqlite, ou for um banco em memória não compartilhado, como ':memory:'
+        """
+        if self._tarefa is not None and not self._tarefa.done():
+            return
+
+        url = createEngine().url
+        if url.get_backend_name() != 'sqlite':
+            raise RuntimeError('O SqliteWriter só pode ser usado com o sqlite!')
+        caminho = _caminhoSqlite(url)
+        if ehBancoMemoria(caminho) and 'cache=shared' not in caminho:
+            # a conexão dedicada abriria um banco em memória próprio, vazio, separado do banco da engine padrão
+            raise RuntimeError(f"O SqliteWriter não pode ser usado com o banco em memória '{caminho}', visível somente "
+                               f"pela conexão que o criou. Use um banco em memória compartilhado, ex.: "
+                               f"'file:picoles?mode=memory&cache=shared'")
+
+        # uma única conexão mantida aberta: o pool nunca cria uma segunda conexão de escrita
+        self._engine = create_async_engine(
+            url=url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            query_cache_size=TAMANHO_CACHE_SQL,
+            connect_args={
+                "check_same_thread": False,
+                # somente escritores fora deste processo disputam o lock com esta conexão
+                "timeout": self.prazo,
+            }
+        )
+        # a conexão dedicada só abre transações de escrita: BEGIN IMMEDIATE
+        _configurarConexaoSqlite(self._engine, somente_escrita=True)
+        _registrarEstatisticasCache(self._engine)
+
+        @event.listens_for(self._engine.sync_engine, 'connect')
+        def _connect(dbapi_connection, connection_record):
+            # o WAL fica gravado no arquivo do banco e permite leituras concorrentes com a escrita. Precisa ser
+            # executado fora de uma transação, por isso no evento de conexão.
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL;')
+            cursor.close()
+
+        self._sessionmaker = sessionmaker(bind=self._engine, expire_on_commit=False, class_=AsyncSession)
+        self._fila = asyncio.Queue(maxsize=self.max_fila)
+        self._tarefa = asyncio.create_task(self._executar(), name='SqliteWriter')
+
+    async def parar(self) -> None:
+        """Aguarda as transações já enfileiradas, encerra a tarefa em segundo plano e fecha a conexão de escrita"""
+        if self._tarefa is None:
+            return
+        # o sentinela não passa pelo limite da fila
+        await self._fila.put(None)
+        await self._tarefa
+        await self._engine.dispose()
+        self._tarefa = None
+        self._engine = None
+
+    async def _executar(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._fila.get()
+            if item is None:
+                break
+
+            vez, liberada, limite = item
+            if vez.done():
+                # o chamador desistiu enquanto aguardava na fila
+                continue
+            if loop.time() > limite:
+                vez.set_exception(PrazoEscritaExcedidoError('Prazo da escrita excedido na fila do SqliteWriter'))
+                continue
+
+            vez.set_result(None)
+            await liberada
+
+    @asynccontextmanager
+    async def transacao(self, prazo: float = None) -> AsyncIterator[AsyncSession]:
+        """Aguarda a vez na fila e fornece uma sessão da conexão de escrita, com transação própria confirmada ao final
+        do bloco. O bloco é executado na tarefa do chamador; a vez é liberada ao sair do bloco, com ou sem exceção.
+        :param prazo: float: tempo máximo, em segundos, para obter a vez; padrão, o prazo do SqliteWriter
+        :return: AsyncIterator[AsyncSession]
+        :raises FilaEscritaCheiaError: Se a fila estiver cheia
+        :raises PrazoEscritaExcedidoError: Se a vez não for obtida dentro do prazo
+        """
+        if self._tarefa is None or self._tarefa.done():
+            raise RuntimeError('SqliteWriter não iniciado, utilize "await ativarSqliteWriter()"')
+
+        prazo = self.prazo if prazo is None else prazo
+        loop = asyncio.get_running_loop()
+        vez = loop.create_future()
+        liberada = loop.create_future()
+        try:
+            self._fila.put_nowait((vez, liberada, loop.time() + prazo))
+        except asyncio.QueueFull:
+            self.recusadas += 1
+            raise FilaEscritaCheiaError(f'Fila de escrita do SqliteWriter cheia ({self.max_fila} transações)')
+
+        try:
+            try:
+                await asyncio.wait_for(vez, prazo)
+            except asyncio.TimeoutError:
+                self.expiradas += 1
+                log.warning('SqliteWriter: escrita expirou após %.3fs na fila (profundidade=%s)',
+                            prazo, self.profundidade)
+                raise PrazoEscritaExcedidoError(f'Escrita não obteve a vez do SqliteWriter em {prazo}s')
+
+            session: AsyncSession = self._sessionmaker()
+            try:
+                async with session.begin():
+                    yield session
+            finally:
+                await session.close()
+            self.transacoes += 1
+        finally:
+            # sempre libera a vez, inclusive em cancelamento, para não travar a fila
+            if not liberada.done():
+                liberada.set_result(None)
+
+
+_sqlite_writer: Optional[SqliteWriter] = None
+
+
+async def ativarSqliteWriter(max_fila: int = 256, prazo: float = 2.0) -> SqliteWriter:
+    """Ativa o escritor único do sqlite para todas as transações de escrita dos models
+    :param max_fila: int: quantidade máxima de transações aguardando a vez
+    :param prazo: float: tempo máximo padrão, em segundos, que uma transação aguarda a vez
+    :return: SqliteWriter
+    """
+    global _sqlite_writer
+    if _sqlite_writer is None:
+        writer = SqliteWriter(max_fila=max_fila, prazo=prazo)
+        await writer.iniciar()
+        _sqlite_writer = writer
+        registrarEscritor(writer)
+    return _sqlite_writer
+
+
+async def desativarSqliteWriter() -> None:
+    """Aguarda as escritas pendentes e desativa o SqliteWriter"""
+    global _sqlite_writer
+    if _sqlite_writer is not None:
+        writer, _sqlite_writer = _sqlite_writer, None
+        registrarEscritor(None)
+        await writer.parar()
@@ -0,0 +1,117 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from conf.db_session import sessaoEscrita, _sessao_uow
+from conf.retry import executarComRetry, TENTATIVAS
+
+# Este módulo é responsável pelo UnitOfWork, que agrupa várias operações dos models em uma única transação.
+# Enquanto o bloco 'async with UnitOfWork() as uow:' estiver ativo, todas as operações dos models executadas no mesmo
+# contexto usam a sessão do UnitOfWork, através da ContextVar _sessao_uow de conf/db_session.py. Assim, criar uma
+# NotaFiscal, seus Lotes e os LoteNotaFiscal gera um único commit.
+# A sessão não pode ser usada por duas operações ao mesmo tempo: dentro do bloco, as operações devem ser aguardadas
+# uma a uma, e não disparadas em paralelo com asyncio.gather.
+#
+# Exemplo:
+#     async with UnitOfWork() as uow:
+#         nota_fiscal = await NotaFiscal.insertNotaFiscal(...)
+#         lote = await Lote.insertLote(...)
+#         async with uow.savepoint():
+#             await LoteNotaFiscal.insertLoteNotaFiscal(...)  # uma falha aqui desfaz somente este bloco
+#
+# Se o bloco terminar sem exceção, a transação é confirmada; caso contrário, é desfeita por completo.
+# Cada operação de escrita dos models já roda no próprio SAVEPOINT, então capturar o erro de uma operação
+# dentro do bloco não invalida as demais.
+# Um UnitOfWork aberto dentro de outro não cria nova transação: ele vira um SAVEPOINT da transação externa.
+#
+# Para repetir o escopo inteiro em caso de erro transitório do banco (ver conf/retry.py), use UnitOfWork.executar:
+#     await UnitOfWork.executar(registrarVenda, revendedor_fk, lotes)
+
+
+class UnitOfWork:
+
+    def __init__(self, sqlite: bool = True):
+        """Cria o escopo de uma transação compartilhada pelas operações dos models
+        :param sqlite: bool: se True, usa o sqlite, se False, usa o postgres
+        """
+        self.sqlite = sqlite
+        self._session: Optional[AsyncSession] = None
+        self._externa = None
+        self._escrita = None
+        self._token = None
+
+    @property
+    def session(self) -> AsyncSession:
+        """Sessão do UnitOfWork, disponível somente dentro do bloco 'async with'"""
+        if self._session is None:
+            raise RuntimeError('UnitOfWork não iniciado, utilize "async with UnitOfWork() as uow:"')
+        return self._session
+
+    @staticmethod
+    def atual() -> Optional[AsyncSession]:
+        """Retorna a sessão do UnitOfWork ativo no contexto atual, ou None se não houver
+        :return: AsyncSession or None
+        """
+        return _sessao_uow.get()
+
+    @staticmethod
+    async def executar(funcao, *args, tentativas: int = TENTATIVAS, **kwargs):
+        """Executa 'await funcao(*args, **kwargs)' dentro de um novo UnitOfWork, repetindo o escopo inteiro, com
+        espera exponencial e jitter, enquanto ele falhar com um erro transitório do banco (ex.: database is locked,
+        serialization failure). A função deve poder ser executada novamente do início.
+        Dentro de outro UnitOfWork não há repetição: o erro é propagado para o escopo externo.
+        :param funcao: função async com as operações do escopo
+        :param tentativas: int: quantidade máxima de execuções do escopo
+        :return: o retorno da função
+        """
+        async def _escopo():
+            async with UnitOfWork():
+                return await funcao(*args, **kwargs)
+
+        if _sessao_uow.get() is not None:
+            return await _escopo()
+        return await executarComRetry(_escopo, f'UnitOfWork.{funcao.__qualname__}', tentativas=tentativas)
+
+    async def __aenter__(self) -> 'UnitOfWork':
+        sessao_externa = _sessao_uow.get()
+        if sessao_externa is not None:
+            # UnitOfWork aninhado: vira um SAVEPOINT da transação externa
+            self._session = sessao_externa
+            self._externa = await sessao_externa.begin_nested()
+        else:
+            # a transação de escrita vem de sessaoEscrita, passando pelo SqliteWriter quando ele estiver ativo
+            self._escrita = sessaoEscrita()
+            self._session = await self._escrita.__aenter__()
+            self._token = _sessao_uow.set(self._session)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            if self._externa is not None:
+                if exc_type is None:
+                    await self._externa.commit()
+                else:
+                    await self._externa.rollback()
+                return
+
+            _sessao_uow.reset(self._token)
+            # confirma a transação se o bloco terminou sem exceção, caso contrário desfaz, e fecha a sessão
+            await self._escrita.__aexit__(exc_type, exc, tb)
+        finally:
+            self._session = None
+            self._externa = None
+            self._escrita = None
+
+    async def flush(self) -> None:
+        """Envia ao banco as alterações pendentes, sem confirmar a transação"""
+        await self.session.flush()
+
+    @asynccontextmanager
+    async def savepoint(self) -> AsyncIterator[AsyncSession]:
+        """Abre um SAVEPOINT dentro da transação do UnitOfWork. Se o bloco lançar uma exceção, somente as
+        alterações feitas nele são desfeitas e a exceção é propagada.
+        :return: AsyncIterator[AsyncSession]
+        """
+        async with self.session.begin_nested():
+            yield self.session
@@ -0,0 +1,175 @@
+import asyncio
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from conf.db_session import sessaoEscrita, sessionScope, _sessao_uow, _sessaoAmbiente
+from conf.logger import getLogger
+
+# Este módulo é responsável pelo WriteBatcher, um gravador em segundo plano que agrupa inserções concorrentes.
+# Quando centenas de coroutines chamam Sabor.insertSabor/Lote.insertLote ao mesmo tempo, cada uma abriria a própria
+# transação e disputaria o lock de escrita do sqlite. Com o WriteBatcher ativo, as inserções são enfileiradas e
+# gravadas em lotes de até 'max_linhas' registros, ou o que chegar em 'max_espera_ms', em uma única transação
+# (um único fsync). Cada chamador recebe o id do próprio registro, ou o próprio erro.
+#
+# O uso é opcional:
+#     ativarWriteBatcher(max_espera_ms=5, max_linhas=200)
+#     await asyncio.gather(*(Sabor.insertSabor(nome) for nome in nomes))
+#     await desativarWriteBatcher()
+#
+# Dentro de um UnitOfWork ou de escopoSessao as inserções não passam pelo WriteBatcher, pois usam a sessão do escopo.
+
+log = getLogger('write_batcher')
+
+
+class WriteBatcher:
+
+    def __init__(self, max_espera_ms: float = 5, max_linhas: int = 100):
+        """Cria o gravador em lote
+        :param max_espera_ms: float: tempo máximo, em milissegundos, que um registro espera pelos demais do lote
+        :param max_linhas: int: quantidade máxima de registros por transação
+        """
+        if max_linhas <= 0:
+            raise ValueError('max_linhas do WriteBatcher deve ser maior que zero!')
+        if max_espera_ms < 0:
+            raise ValueError('max_espera_ms do WriteBatcher não pode ser negativo!')
+
+        self.max_espera = max_espera_ms / 1000
+        self.max_linhas = max_linhas
+        self.transacoes = 0
+        self.registros = 0
+        self._fila: Optional[asyncio.Queue] = None
+        self._tarefa: Optional[asyncio.Task] = None
+
+    def _iniciar(self) -> None:
+        if self._tarefa is None or self._tarefa.done():
+            self._fila = asyncio.Queue()
+            self._tarefa = asyncio.create_task(self._executar(), name='WriteBatcher')
+
+    async def submit(self, registro) -> int:
+        """Enfileira um novo registro para ser gravado no próximo lote e aguarda a gravação
+        :param registro: objeto de um model ainda não persistido
+        :return: int: id do registro gravado
+        :raises IntegrityError: Se o registro violar alguma restrição do banco, somente para este chamador
+        """
+        self._iniciar()
+        futuro = asyncio.get_running_loop().create_future()
+        self._fila.put_nowait((registro, futuro))
+        return await futuro
+
+    async def parar(self) -> None:
+        """Grava os registros pendentes e encerra a tarefa em segundo plano"""
+        if self._tarefa is None:
+            return
+        self._fila.put_nowait(None)
+        await self._tarefa
+        self._tarefa = None
+
+    async def _executar(self) -> None:
+        loop = asyncio.get_running_loop()
+        parar = False
+        while not parar:
+            item = await self._fila.get()
+            if item is None:
+                break
+
+            lote = [item]
+            prazo = loop.time() + self.max_espera
+            while len(lote) < self.max_linhas:
+                if self._fila.empty():
+                    restante = prazo - loop.time()
+                    if restante <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._fila.get(), restante)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._fila.get_nowait()
+
+                if item is None:
+                    parar = True
+                    break
+                lote.append(item)
+
+            await self._gravar(lote)
+
+    async def _gravar(self, lote: list) -> None:
+        lote = [(registro, futuro) for registro, futuro in lote if not futuro.done()]
+        if not lote:
+            return
+
+        # usa uma transação própria, sem herdar a sessão do contexto de quem iniciou a tarefa
+        try:
+            try:
+                # caminho rápido: todos os registros em um único flush, agrupados pelo insertmanyvalues
+                async with sessaoEscrita() as session:
+                    session.add_all([registro for registro, _ in lote])
+                    await session.flush()
+                gravados = lote
+
+            except IntegrityError:
+                # algum registro é inválido: grava um a um, cada um em seu SAVEPOINT, para que somente o chamador
+                # do registro inválido receba o erro
+                gravados = []
+                async with sessaoEscrita() as session:
+                    for registro, futuro in lote:
+                        try:
+                            async with session.begin_nested():
+                                session.add(registro)
+                                await session.flush()
+                            gravados.append((registro, futuro))
+                        except IntegrityError as intg_error:
+                            if not futuro.done():
+                                futuro.set_exception(intg_error)
+
+            self.transacoes += 1
+            self.registros += len(gravados)
+            log.debug('WriteBatcher: %s registro(s) gravados em uma transação', len(gravados))
+            for registro, futuro in gravados:
+                if not futuro.done():
+                    futuro.set_result(registro.id)
+
+        except Exception as exc:
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(exc)
+
+
+_write_batcher: Optional[WriteBatcher] = None
+
+
+def ativarWriteBatcher(max_espera_ms: float = 5, max_linhas: int = 100) -> WriteBatcher:
+    """Ativa o WriteBatcher para as inserções dos models
+    :param max_espera_ms: float: tempo máximo, em milissegundos, que um registro espera pelos demais do lote
+    :param max_linhas: int: quantidade máxima de registros por transação
+    :return: WriteBatcher
+    """
+    global _write_batcher
+    if _write_batcher is None:
+        _write_batcher = WriteBatcher(max_espera_ms=max_espera_ms, max_linhas=max_linhas)
+    return _write_batcher
+
+
+async def desativarWriteBatcher() -> None:
+    """Grava os registros pendentes e desativa o WriteBatcher"""
+    global _write_batcher
+    if _write_batcher is not None:
+        batcher, _write_batcher = _write_batcher, None
+        await batcher.parar()
+
+
+async def persistir(registro) -> None:
+    """Grava um novo registro de um model. Usa o WriteBatcher se estiver ativo e não houver sessão em uso no
+    contexto, caso contrário grava pela sessão de sessionScope. Em ambos os casos o id do registro é preenchido.
+    :param registro: objeto de um model ainda não persistido
+    :raises IntegrityError: Se o registro violar alguma restrição do banco
+    """
+    # dentro de um UnitOfWork, de escopoSessao ou de outra operação, o registro usa a sessão que já está em uso
+    if _write_batcher is not None and _sessao_uow.get() is None and _sessaoAmbiente() is None:
+        await _write_batcher.submit(registro)
+        return
+
+    async with sessionScope() as session:
+        session.add(registro)
+        await session.flush()
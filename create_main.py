@@ -1,5 +1,6 @@
-from conf.db_session import createTables
+from conf.db_session import createTablesSync
 
 
 if __name__ == '__main__':
-    createTables()
+    # script em lote: usa a engine síncrona, sem event loop (createTables é async e precisaria do asyncio.run)
+    createTablesSync()
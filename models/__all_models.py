@@ -1,6 +1,8 @@
 # Este módulo é responsável por importar todas as classes que representam as tabelas do banco de dados.
 # Ele é utilizado no módulo con\db_session.py e no método createTables para criar as tabelas no banco de dados.
 # Logo toda classe/tabela que for criada deve ser importada aqui.
+# O registro é preguiçoso: este módulo só é importado por conf.db_session.registrarModels(), quando o schema inteiro
+# é necessário, e não na importação de um model.
 
 
 from models.aditivo_nutritivo import AditivoNutritivo
@@ -17,5 +19,7 @@ from models.lote_nota_fiscal import LoteNotaFiscal
 from models.aditivo_nutritivo_picole import AditivoNutritivoPicole
 from models.conservante_picole import ConservantePicole
 from models.ingrediente_picole import IngredientePicole
-from models.lote_nota_fiscal import LoteNotaFiscal
 
+from models.picole_catalog import PicoleCatalog
+from models.revendedor_daily_sales import RevendedorDailySales
+from models.picole_stock import PicoleStock
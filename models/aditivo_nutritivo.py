@@ -3,11 +3,18 @@ import asyncio
 import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('aditivo_nutritivo')
+
+
 class AditivoNutritivo(ModelBase):
     """Classe que representa a tabela 'aditivo_nutritivo' no banco de dados.
     Atributos:
@@ -52,6 +59,7 @@ class AditivoNutritivo(ModelBase):
         return f'<Aditivo Nutritivo(nome={self.nome}, formula_quimica={self.formula_quimica})>'
 
     @staticmethod
+    @retryTransitorio
     async def insertAditivoNutritivo(nome: str, formula_quimica: str) -> 'AditivoNutritivo' or None:
         """Insere um AditivoNutritivo na tabela aditivos_nutritivos
         :param nome: str: nome do aditivo
@@ -65,7 +73,6 @@ class AditivoNutritivo(ModelBase):
         Caso seja por outro motivo, será lançado um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(nome, str):
@@ -82,19 +89,11 @@ class AditivoNutritivo(ModelBase):
             if not formula_quimica:
                 raise ValueError('formula_quimica do AditivoNutritivo não informada!')
 
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo AditivoNutritivo: {nome}, {formula_quimica}')
-                aditivo_nutritivo = AditivoNutritivo(nome=nome, formula_quimica=formula_quimica)
-                session.add(aditivo_nutritivo)
-                await session.commit()
-                print(f'Aditivo nutritivo inserido com sucesso!')
-                print(f'ID do AditivoNutritivo inserido: {aditivo_nutritivo.id}')
-                print(f'Nome do AditivoNutritivo inserido: {aditivo_nutritivo.nome}')
-                print(f'Fórmula química do AditivoNutritivo inserido: {aditivo_nutritivo.formula_quimica}')
-                print(f'Data de criação do AditivoNutritivo inserido: {aditivo_nutritivo.data_criacao}')
-
-                return aditivo_nutritivo
+            aditivo_nutritivo = AditivoNutritivo(nome=nome, formula_quimica=formula_quimica)
+            await persistir(aditivo_nutritivo)
+            log.debug('AditivoNutritivo inserido: id=%s nome=%s formula_quimica=%s',
+                      aditivo_nutritivo.id, aditivo_nutritivo.nome, aditivo_nutritivo.formula_quimica)
+            return aditivo_nutritivo
 
         except IntegrityError as intg_error:
             if 'UNIQUE constraint failed' in str(intg_error):
@@ -115,15 +114,16 @@ class AditivoNutritivo(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir AditivoNutritivo: {exc}')
 
     @staticmethod
-    def selectAditivoNutritivoPorId(id_aditivo_nutritivo: int) -> 'AditivoNutritivo' or None:
+    @retryTransitorio
+    async def selectAditivoNutritivoPorId(id_aditivo_nutritivo: int) -> 'AditivoNutritivo' or None:
         """Seleciona um aditivo nutritivo cadastrado no banco de dados a partir do id.
         :param id_aditivo_nutritivo: int: identificador do aditivo nutritivo
         :raises TypeError: Se o id não for um inteiro
@@ -135,9 +135,9 @@ class AditivoNutritivo(ModelBase):
                 raise TypeError('id do AditivoNutritivo deve ser um inteiro!')
 
             # utilizando first: caso não encontre retorna None
-            with createSession() as session:
-                aditivo_nutritivo: AditivoNutritivo = session.query(AditivoNutritivo). \
-                    filter_by(id=id_aditivo_nutritivo).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivo).where(AditivoNutritivo.id == id_aditivo_nutritivo)
+                aditivo_nutritivo: AditivoNutritivo = (await session.scalars(consulta)).first()
 
                 return aditivo_nutritivo
 
@@ -178,7 +178,8 @@ class AditivoNutritivo(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar AditivoNutritivo: {exc}')
 
     @staticmethod
-    def selectAditivoNutritivoPorNome(nome: str) -> 'AditivoNutritivo' or None:
+    @retryTransitorio
+    async def selectAditivoNutritivoPorNome(nome: str) -> 'AditivoNutritivo' or None:
         """Seleciona um aditivo nutritivo cadastrado no banco de dados a partir do nome.
         :param nome: str: nome do aditivo nutritivo
         :raises TypeError: Se o nome não for uma string
@@ -193,9 +194,9 @@ class AditivoNutritivo(ModelBase):
             if not nome:
                 raise ValueError('nome do AditivoNutritivo não informado!')
 
-            with createSession() as session:
-                aditivo_nutritivo: AditivoNutritivo = session.query(AditivoNutritivo). \
-                    filter_by(nome=nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_ADITIVO_NUTRITIVO_POR_NOME
+                aditivo_nutritivo: AditivoNutritivo = (await session.scalars(consulta, {'nome': nome})).first()
                 return aditivo_nutritivo
 
         except TypeError as te:
@@ -208,7 +209,8 @@ class AditivoNutritivo(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar AditivoNutritivo: {exc}')
 
     @staticmethod
-    def selectAditivoNutritivoPorFormulaQuimica(formula_quimica: str) -> 'AditivoNutritivo' or None:
+    @retryTransitorio
+    async def selectAditivoNutritivoPorFormulaQuimica(formula_quimica: str) -> 'AditivoNutritivo' or None:
         """Seleciona um aditivo nutritivo cadastrado no banco de dados a partir da fórmula química.
         :param formula_quimica: str: fórmula química do aditivo nutritivo
         :raises TypeError: Se a fórmula química não for uma string
@@ -223,9 +225,9 @@ class AditivoNutritivo(ModelBase):
             if not formula_quimica:
                 raise ValueError('formula_quimica do AditivoNutritivo não informada!')
 
-            with createSession() as session:
-                aditivo_nutritivo: AditivoNutritivo = session.query(AditivoNutritivo). \
-                    filter_by(formula_quimica=formula_quimica).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivo).where(AditivoNutritivo.formula_quimica == formula_quimica)
+                aditivo_nutritivo: AditivoNutritivo = (await session.scalars(consulta)).first()
                 return aditivo_nutritivo
 
         except TypeError as te:
@@ -238,22 +240,35 @@ class AditivoNutritivo(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar AditivoNutritivo: {exc}')
 
     @staticmethod
-    def selectAllAditivosNutritivos() -> list['AditivoNutritivo'] or []:
+    @retryTransitorio
+    async def selectAllAditivosNutritivos() -> list['AditivoNutritivo'] or []:
         """Seleciona todos os aditivos nutritivos cadastrados no banco de dados.
         :raises Exception: Informando erro inesperado
         :return: list[AditivoNutritivo] or []: Retorna uma lista de objetos AditivoNutritivo se encontrados, [] caso contrário
         """
         try:
-            with createSession() as session:
-                aditivos_nutritivos: list[AditivoNutritivo] = session.query(AditivoNutritivo).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivo)
+                aditivos_nutritivos: list[AditivoNutritivo] = (await session.scalars(consulta)).all()
                 return aditivos_nutritivos
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos AditivoNutritivo: {exc}')
 
     @staticmethod
-    def updateAditivoNutritivo(id_aditivo_nutritivo: int,
-                               nome: str = '',
-                               formula_quimica: str = '') -> 'AditivoNutritivo':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'AditivoNutritivo']:
+        """Seleciona vários AditivoNutritivo por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de AditivoNutritivo, repetições são ignoradas
+        :return: dict[int, AditivoNutritivo]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(AditivoNutritivo, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateAditivoNutritivo(id_aditivo_nutritivo: int,
+                                     nome: str = '',
+                                     formula_quimica: str = '') -> 'AditivoNutritivo':
         """Atualiza um aditivo nutritivo cadastrado no banco de dados a partir do id.
         :param id_aditivo_nutritivo: int: identificador do aditivo nutritivo
         :param nome: str: caso se deseje atualizar o nome do aditivo nutritivo, informar o novo nome
@@ -284,9 +299,9 @@ class AditivoNutritivo(ModelBase):
             nome = nome.strip().upper()
             formula_quimica = formula_quimica.strip().upper()
 
-            with createSession(echo=True) as session:
-                adititvo_nutritivo = session.query(AditivoNutritivo). \
-                    filter_by(id=id_aditivo_nutritivo).first()
+            async with sessionScope() as session:
+                consulta = sa.select(AditivoNutritivo).where(AditivoNutritivo.id == id_aditivo_nutritivo)
+                adititvo_nutritivo = (await session.scalars(consulta)).first()
 
                 if not adititvo_nutritivo:
                     raise ValueError(f'AditivoNutritivo com id={id_aditivo_nutritivo} não cadastrado na base!')
@@ -298,7 +313,7 @@ class AditivoNutritivo(ModelBase):
                     if formula_quimica.strip() else adititvo_nutritivo.formula_quimica
 
                 adititvo_nutritivo.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return adititvo_nutritivo
 
         except TypeError as te:
@@ -325,48 +340,55 @@ class AditivoNutritivo(ModelBase):
 
 
     @staticmethod
-    def deleteAditivoNutritivoById(id_aditivo_nutritivo: int) -> 'AditivoNutritivo':
-        """Deleta um aditivo nutritivo cadastrado no banco de dados a partir do id.
-        :param id_aditivo_nutritivo: int: identificador do aditivo nutritivo
-        :return: AditivoNutritivo: Retorna o objeto AditivoNutritivo deletado
-        :raises TypeError: Se o id não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o aditivo nutritivo, especificado para o
-        id, caso o aditivo nutritivo esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
-        :raises ValueError: Se o aditivo nutritivo não for encontrado na base
+    @retryTransitorio
+    async def deleteAditivoNutritivoById(id_aditivo_nutritivo: int) -> int:
+        """Deleta um AditivoNutritivo cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
+        :param id_aditivo_nutritivo: int: identificador do AditivoNutritivo
+        :return: int: Retorna o id do AditivoNutritivo deletado
+        :raises TypeError: Se o id_aditivo_nutritivo não for um inteiro
+        :raises RuntimeError: Se o AditivoNutritivo estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
+        :raises ValueError: Se o AditivoNutritivo não for encontrado na base
         """
         try:
             if not isinstance(id_aditivo_nutritivo, int):
                 raise TypeError('id do AditivoNutritivo deve ser um inteiro!')
 
-            with createSession() as session:
-                aditivo_nutritivo: AditivoNutritivo = session.query(AditivoNutritivo). \
-                    filter_by(id=id_aditivo_nutritivo).first()
+            return await DataBaseFeatures.deleteById(model=AditivoNutritivo, id=id_aditivo_nutritivo)
 
-                if not aditivo_nutritivo:
-                    raise ValueError(f'AditivoNutritivo com id={id_aditivo_nutritivo} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(aditivo_nutritivo)
-                session.commit()
-                return aditivo_nutritivo
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar AditivoNutritivo: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários AditivoNutritivo em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de AditivoNutritivo
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum AditivoNutritivo estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(AditivoNutritivo, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de AditivoNutritivo que atendem aos filtros informados, ex.: AditivoNutritivo.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum AditivoNutritivo estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(AditivoNutritivo, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=AditivoNutritivo.__tablename__)
-                raise RuntimeError(f'AditivoNutritivo com id={id_aditivo_nutritivo} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar AditivoNutritivo: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar AditivoNutritivo: {exc}')
+# consulta de AditivoNutritivo.selectAditivoNutritivoPorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_ADITIVO_NUTRITIVO_POR_NOME = sa.select(AditivoNutritivo).where(AditivoNutritivo.nome == sa.bindparam('nome'))
 
 
 if __name__ == '__main__':
@@ -8,8 +8,16 @@ from datetime import datetime
 from models.model_base import ModelBase
 from models.picole import Picole
 from models.aditivo_nutritivo import AditivoNutritivo
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+
+log = getLogger('aditivo_nutritivo_picole')
 
 
 class AditivoNutritivoPicole(ModelBase):
@@ -58,6 +66,7 @@ class AditivoNutritivoPicole(ModelBase):
                 )
 
     @staticmethod
+    @retryTransitorio
     async def insertAditivoNutritivoPicole(picole_fk: int, aditivo_nutritivo_fk: int) -> 'AditivoNutritivoPicole' or None:
         """Insere um AditivoNutritivoPicole na tabela aditivo_nutritivo_picole
         :param picole_fk: int: id do picolé
@@ -68,7 +77,6 @@ class AditivoNutritivoPicole(ModelBase):
         contrário, retorna um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(picole_fk, int):
@@ -81,20 +89,9 @@ class AditivoNutritivoPicole(ModelBase):
                                                               picole_aditivo_nutritivo=f'{picole_fk}-{aditivo_nutritivo_fk}'
                                                               )
             # Verificar se já existe um registro com o nome e a fórmula informados
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo AditivoNutritivoPicole: {aditivo_nutritivo_picole}')
-                session.add(aditivo_nutritivo_picole)
-                await session.commit()
-
-                print(f'Aditivo nutritivo inserido com sucesso!')
-                print(f'ID do AditivoNutritivoPicole inserido: {aditivo_nutritivo_picole.id}')
-                print(f'picole_fk do AditivoNutritivoPicole inserido: {aditivo_nutritivo_picole.picole_fk}')
-                print(f'picole.sabor do AditivoNutritivoPicole inserido: {aditivo_nutritivo_picole.picole.sabor}')
-                print(
-                    f'aditivo_nutritivo_fk do AditivoNutritivoPicole inserido: {aditivo_nutritivo_picole.aditivo_nutritivo_fk}')
-                print(
-                    f'aditivo_nutritivo.nome do AditivoNutritivoPicole inserido: {aditivo_nutritivo_picole.aditivo_nutritivo.nome}')
+            await persistir(aditivo_nutritivo_picole)
+            log.debug('AditivoNutritivoPicole inserido: id=%s picole_fk=%s aditivo_nutritivo_fk=%s',
+                      aditivo_nutritivo_picole.id, aditivo_nutritivo_picole.picole_fk, aditivo_nutritivo_picole.aditivo_nutritivo_fk)
             return aditivo_nutritivo_picole
 
         except IntegrityError as intg_error:
@@ -113,29 +110,32 @@ class AditivoNutritivoPicole(ModelBase):
         except TypeError as te:
             raise TypeError(te)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir AditivoNutritivoPicole: {exc}')
 
     @staticmethod
-    def selectAllAditivoNutritivoPicole() -> list['AditivoNutritivoPicole'] or []:
+    @retryTransitorio
+    async def selectAllAditivoNutritivoPicole() -> list['AditivoNutritivoPicole'] or []:
         """Seleciona todos os registros da tabela aditivo_nutritivo_picole
         :raises Exception: Informando erro inesperado ao selecionar os AditivoNutritivoPicole
         :return: List[AditivoNutritivoPicole]: Retorna uma lista de objetos AditivoNutritivoPicole
         """
         try:
-            with createSession() as session:
-                aditivo_nutritivo_picoles = session.query(AditivoNutritivoPicole).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivoPicole)
+                aditivo_nutritivo_picoles = (await session.scalars(consulta)).all()
                 return aditivo_nutritivo_picoles
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos AditivoNutritivoPicole: {exc}')
 
     @staticmethod
-    def selectAditivoNutritivoPorId(id_adit_nutritivo: int) -> 'AditivoNutritivoPicole' or None:
+    @retryTransitorio
+    async def selectAditivoNutritivoPorId(id_adit_nutritivo: int) -> 'AditivoNutritivoPicole' or None:
         """Seleciona um AditivoNutritivoPicole na tabela aditivo_nutritivo_picole por ID
         :param id_adit_nutritivo: int: id do AditivoNutritivoPicole
         :raises TypeError: Se o id não for um inteiro
@@ -149,8 +149,9 @@ class AditivoNutritivoPicole(ModelBase):
             if not id_adit_nutritivo:
                 raise ValueError('O id do AditivoNutritivoPicole deve ser informado!')
 
-            with createSession() as session:
-                aditivo_nutritivo_picole = session.query(AditivoNutritivoPicole).filter_by(id=id_adit_nutritivo).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivoPicole).where(AditivoNutritivoPicole.id == id_adit_nutritivo)
+                aditivo_nutritivo_picole = (await session.scalars(consulta)).first()
                 return aditivo_nutritivo_picole
 
         except TypeError as te:
@@ -163,7 +164,8 @@ class AditivoNutritivoPicole(ModelBase):
             raise RuntimeError(f'Erro inesperado ao selecionar AditivoNutritivoPicole: {exc}')
 
     @staticmethod
-    def selectAllAdiNutPicPorPicoleFK(picole_fk: int) -> list['AditivoNutritivoPicole'] or []:
+    @retryTransitorio
+    async def selectAllAdiNutPicPorPicoleFK(picole_fk: int) -> list['AditivoNutritivoPicole'] or []:
         """Seleciona todos os AditivoNutritivoPicole na tabela aditivo_nutritivo_picole
         :param picole_fk: int: id do picolé
         :raises TypeError: Se o picole_fk não for um inteiro
@@ -173,8 +175,9 @@ class AditivoNutritivoPicole(ModelBase):
         try:
             if not isinstance(picole_fk, int):
                 raise TypeError('picole_fk do AditivoNutritivoPicole deve ser um inteiro!')
-            with createSession() as session:
-                aditivo_nutritivo_picoles = session.query(AditivoNutritivoPicole).filter_by(picole_fk=picole_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivoPicole).where(AditivoNutritivoPicole.picole_fk == picole_fk)
+                aditivo_nutritivo_picoles = (await session.scalars(consulta)).all()
                 return aditivo_nutritivo_picoles
 
         except TypeError as te:
@@ -184,7 +187,8 @@ class AditivoNutritivoPicole(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar todos AditivoNutritivoPicole: {exc}')
 
     @staticmethod
-    def selectAllAdiNutPicPorAditivoFK(aditivo_nutritivo_fk: int) -> list['AditivoNutritivoPicole'] or []:
+    @retryTransitorio
+    async def selectAllAdiNutPicPorAditivoFK(aditivo_nutritivo_fk: int) -> list['AditivoNutritivoPicole'] or []:
         """Seleciona todos os AditivoNutritivoPicole na tabela aditivo_nutritivo_picole
         :param aditivo_nutritivo_fk: int: id do aditivo nutritivo
         :raises TypeError: Se o aditivo_nutritivo_fk não for um inteiro
@@ -195,9 +199,9 @@ class AditivoNutritivoPicole(ModelBase):
             if not isinstance(aditivo_nutritivo_fk, int):
                 raise TypeError('aditivo_nutritivo_fk do AditivoNutritivoPicole deve ser um inteiro!')
 
-            with createSession() as session:
-                aditivo_nutritivo_picoles = session.query(AditivoNutritivoPicole).filter_by(
-                    aditivo_nutritivo_fk=aditivo_nutritivo_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(AditivoNutritivoPicole).where(AditivoNutritivoPicole.aditivo_nutritivo_fk == aditivo_nutritivo_fk)
+                aditivo_nutritivo_picoles = (await session.scalars(consulta)).all()
                 return aditivo_nutritivo_picoles
 
         except TypeError as te:
@@ -207,9 +211,20 @@ class AditivoNutritivoPicole(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar todos AditivoNutritivoPicole: {exc}')
 
     @staticmethod
-    def updateAditivoNutritivoPicole(id_adit_nut_picole: int,
-                                     picole_fk: Union[int, None],
-                                     aditivo_nutritivo_fk: Union[int, None]) -> 'AditivoNutritivoPicole':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'AditivoNutritivoPicole']:
+        """Seleciona vários AditivoNutritivoPicole por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de AditivoNutritivoPicole, repetições são ignoradas
+        :return: dict[int, AditivoNutritivoPicole]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(AditivoNutritivoPicole, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateAditivoNutritivoPicole(id_adit_nut_picole: int,
+                                           picole_fk: Union[int, None],
+                                           aditivo_nutritivo_fk: Union[int, None]) -> 'AditivoNutritivoPicole':
         """Atualiza um AditivoNutritivoPicole na tabela aditivo_nutritivo_picole
         :param id_adit_nut_picole: int: id do AditivoNutritivoPicole
         :param picole_fk: int: id do picolé
@@ -231,9 +246,9 @@ class AditivoNutritivoPicole(ModelBase):
             if not isinstance(aditivo_nutritivo_fk, int) and aditivo_nutritivo_fk is not None:
                 raise TypeError('aditivo_nutritivo_fk do AditivoNutritivoPicole deve ser um inteiro ou não deve ser informado!')
 
-            with createSession() as session:
-                aditivo_nutritivo_picole = session.query(AditivoNutritivoPicole). \
-                    filter_by(id=id_adit_nut_picole).first()
+            async with sessionScope() as session:
+                consulta = sa.select(AditivoNutritivoPicole).where(AditivoNutritivoPicole.id == id_adit_nut_picole)
+                aditivo_nutritivo_picole = (await session.scalars(consulta)).first()
 
                 if not aditivo_nutritivo_picole:
                     raise ValueError(f'AditivoNutritivoPicole com id={id_adit_nut_picole} não encontrado!')
@@ -251,7 +266,7 @@ class AditivoNutritivoPicole(ModelBase):
                 aditivo_nutritivo_picole.picole_aditivo_nutritivo = (f'{aditivo_nutritivo_picole.picole_fk}-'
                                                                      f'{aditivo_nutritivo_picole.aditivo_nutritivo_fk}')
                 aditivo_nutritivo_picole.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return aditivo_nutritivo_picole
 
         except TypeError as te:
@@ -278,35 +293,50 @@ class AditivoNutritivoPicole(ModelBase):
 
 
     @staticmethod
-    def deleteAditivoNutritivoPicoleById(id_adit_nut_picole: int) -> 'AditivoNutritivoPicole':
-        """Deleta um AditivoNutritivoPicole na tabela aditivo_nutritivo_picole
-        :param id_adit_nut_picole: int: id do AditivoNutritivoPicole
+    @retryTransitorio
+    async def deleteAditivoNutritivoPicoleById(id_adit_nut_picole: int) -> int:
+        """Deleta um AditivoNutritivoPicole cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
+        :param id_adit_nut_picole: int: identificador do AditivoNutritivoPicole
+        :return: int: Retorna o id do AditivoNutritivoPicole deletado
         :raises TypeError: Se o id_adit_nut_picole não for um inteiro
-        :raises ValueError: Se o AditivoNutritivoPicole não for encontrado
-        :raises RuntimeError: Se ocorrer um erro ao deletar o AditivoNutritivoPicole
+        :raises RuntimeError: Se o AditivoNutritivoPicole estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
+        :raises ValueError: Se o AditivoNutritivoPicole não for encontrado na base
         """
-
         try:
             if not isinstance(id_adit_nut_picole, int):
                 raise TypeError('id_adit_nut_picole do AditivoNutritivoPicole deve ser um inteiro!')
 
-            with createSession() as session:
-                aditivo_nutritivo_picole = session.query(AditivoNutritivoPicole).filter_by(id=id_adit_nut_picole).first()
-                if not aditivo_nutritivo_picole:
-                    raise ValueError(f'AditivoNutritivoPicole com id={id_adit_nut_picole} não encontrado!')
+            return await DataBaseFeatures.deleteById(model=AditivoNutritivoPicole, id=id_adit_nut_picole)
 
-                session.delete(aditivo_nutritivo_picole)
-                session.commit()
-                return aditivo_nutritivo_picole
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-        except TypeError as te:
-            raise TypeError(te)
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar AditivoNutritivoPicole: {exc}')
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários AditivoNutritivoPicole em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de AditivoNutritivoPicole
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum AditivoNutritivoPicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(AditivoNutritivoPicole, ids)
 
-        except Exception as exc:
-            raise RuntimeError(f'Erro inesperado ao deletar AditivoNutritivoPicole: {exc}')
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de AditivoNutritivoPicole que atendem aos filtros informados, ex.: AditivoNutritivoPicole.picole_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum AditivoNutritivoPicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(AditivoNutritivoPicole, *filtros)
 
 
 if __name__ == '__main__':
@@ -325,7 +355,7 @@ if __name__ == '__main__':
     # except Exception as e:
     #     print(f'Erro ao inserir AditivoNutritivoPicole: {e}')
 
-    adit_nut_picole = AditivoNutritivoPicole.updateAditivoNutritivoPicole(id_adit_nut_picole=2,
-                                                                          picole_fk=2,
-                                                                          aditivo_nutritivo_fk=3)
+    adit_nut_picole = asyncio.run(AditivoNutritivoPicole.updateAditivoNutritivoPicole(id_adit_nut_picole=2,
+                                                                                      picole_fk=2,
+                                                                                      aditivo_nutritivo_fk=3))
     print(adit_nut_picole)
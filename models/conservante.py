@@ -3,10 +3,16 @@ import asyncio
 import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
+log = getLogger('conservante')
+
+
 class Conservante(ModelBase):
     __tablename__ = 'conservante'
 
@@ -23,6 +29,7 @@ class Conservante(ModelBase):
         return f'<Conservante (nome={self.nome}, descrição={self.descricao})>'
 
     @staticmethod
+    @retryTransitorio
     async def insertConservante(nome: str, descricao: str) -> 'Conservante' or None:
         """Insere um Conservante na tabela conservante
         :param nome: str: nome do conservante
@@ -34,7 +41,6 @@ class Conservante(ModelBase):
         seja por outro motivo, será lançado um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(nome, str):
@@ -52,17 +58,8 @@ class Conservante(ModelBase):
                 raise ValueError('descricao do Conservante não informada!')
 
             conservante = Conservante(nome=nome, descricao=descricao)
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo Conservante: {conservante}')
-                session.add(conservante)
-                await session.commit()
-
-                print(f'Conservante inserido com sucesso!')
-                print(f'ID do Conservante inserido: {conservante.id}')
-                print(f'Nome do Conservante inserido: {conservante.nome}')
-                print(f'Descrição do Conservante inserido: {conservante.descricao}')
-                print(f'Data de criação do Conservante inserido: {conservante.data_criacao}')
+            await persistir(conservante)
+            log.debug('Conservante inserido: id=%s nome=%s', conservante.id, conservante.nome)
             return conservante
 
         except IntegrityError as intg_error:
@@ -83,26 +80,26 @@ class Conservante(ModelBase):
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos Conservante: {exc}')
 
-        finally:
-            if session:
-                await session.close()
 
     @staticmethod
-    def selectAllConservantes() -> list['Conservante'] or []:
+    @retryTransitorio
+    async def selectAllConservantes() -> list['Conservante'] or []:
         """Seleciona todos os Conservantes na tabela conservante
         :raises Exception: Informando erro inesperado ao selecionar os conservantes
         :return: list or []: Retorna uma lista de objetos Conservante se encontrado, [] caso contrário
         """
         try:
-            with createSession() as session:
-                conservantes = session.query(Conservante).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Conservante)
+                conservantes = (await session.scalars(consulta)).all()
                 return conservantes
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar Conservantes: {exc}')
 
     @staticmethod
-    def selectConservantePorID(id: int) -> 'Conservante' or None:
+    @retryTransitorio
+    async def selectConservantePorID(id: int) -> 'Conservante' or None:
         """Seleciona um Conservante na tabela conservante por ID
         :param id: int: id do Conservante
         :return: Conservante or None: Retorna o objeto Conservante se encontrado, None caso contrário
@@ -121,8 +118,9 @@ class Conservante(ModelBase):
             if not id:
                 raise ValueError('id do Conservante não informado!')
 
-            with createSession() as session:
-                conservante = session.query(Conservante).filter(Conservante.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Conservante).where(Conservante.id == id)
+                conservante = (await session.scalars(consulta)).first()
                 return conservante
 
         except TypeError as te:
@@ -132,10 +130,11 @@ class Conservante(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Conservante: {exc}')
 
     @staticmethod
-    def selectConservantePorNome(nome: str) -> 'Conservante' or None:
+    @retryTransitorio
+    async def selectConservantePorNome(nome: str) -> 'Conservante' or None:
         """Seleciona um Conservante na tabela conservante por nome
         :param nome: str: nome do Conservante
         :return: Conservante or None: Retorna o objeto Conservante se encontrado, None caso contrário
@@ -156,8 +155,9 @@ class Conservante(ModelBase):
             if not nome:
                 raise ValueError('nome do Conservante não informado!')
 
-            with createSession() as session:
-                conservante = session.query(Conservante).filter(Conservante.nome == nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_CONSERVANTE_POR_NOME
+                conservante = (await session.scalars(consulta, {'nome': nome})).first()
                 return conservante
 
         except TypeError as te:
@@ -167,11 +167,22 @@ class Conservante(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Conservante: {exc}')
+
 
+    @staticmethod
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'Conservante']:
+        """Seleciona vários Conservante por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de Conservante, repetições são ignoradas
+        :return: dict[int, Conservante]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(Conservante, ids)
 
     @staticmethod
-    def updateConservante(id_conservante: int, nome: str = '', descricao: str = '') -> 'Conservante':
+    @retryTransitorio
+    async def updateConservante(id_conservante: int, nome: str = '', descricao: str = '') -> 'Conservante':
         """Atualiza um Conservante na tabela conservante
         :param id_conservante: int: id do Conservante
         :param nome: str: nome do Conservante
@@ -204,8 +215,9 @@ class Conservante(ModelBase):
             nome = nome.strip().upper()
             descricao = descricao.strip().upper()
 
-            with createSession() as session:
-                conservante = session.query(Conservante).filter_by(id=id_conservante).first()
+            async with sessionScope() as session:
+                consulta = sa.select(Conservante).where(Conservante.id == id_conservante)
+                conservante = (await session.scalars(consulta)).first()
 
                 if not conservante:
                     raise ValueError(f'Conservante com o ID {id_conservante} não cadastrado na base!')
@@ -219,7 +231,7 @@ class Conservante(ModelBase):
                     conservante.descricao = descricao
 
                 conservante.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return conservante
 
         except IntegrityError as intg_error:
@@ -242,48 +254,55 @@ class Conservante(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Conservante: {exc}')
 
     @staticmethod
-    def deleteConservanteById(id_conservante: int) -> 'Conservante':
-        """Deleta um Conservante cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteConservanteById(id_conservante: int) -> int:
+        """Deleta um Conservante cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_conservante: int: identificador do Conservante
-        :return: Conservante: Retorna o objeto Conservante deletado
-        :raises TypeError: Se o id não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o Conservante, especificado para o
-        id, caso o Conservante esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :return: int: Retorna o id do Conservante deletado
+        :raises TypeError: Se o id_conservante não for um inteiro
+        :raises RuntimeError: Se o Conservante estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o Conservante não for encontrado na base
         """
         try:
             if not isinstance(id_conservante, int):
                 raise TypeError('id do Conservante deve ser um inteiro!')
 
-            with createSession() as session:
-                conservante: Conservante = session.query(Conservante). \
-                    filter_by(id=id_conservante).first()
+            return await DataBaseFeatures.deleteById(model=Conservante, id=id_conservante)
 
-                if not conservante:
-                    raise ValueError(f'Conservante com id={id_conservante} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(conservante)
-                session.commit()
-                return conservante
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar Conservante: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários Conservante em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de Conservante
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum Conservante estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(Conservante, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de Conservante que atendem aos filtros informados, ex.: Conservante.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum Conservante estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(Conservante, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=Conservante.__tablename__)
-                raise RuntimeError(f'Conservante com id={id_conservante} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar Conservante: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar Conservante: {exc}')
+# consulta de Conservante.selectConservantePorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_CONSERVANTE_POR_NOME = sa.select(Conservante).where(Conservante.nome == sa.bindparam('nome'))
 
 
 if __name__ == '__main__':
@@ -311,7 +330,7 @@ if __name__ == '__main__':
     # print(conservante)
 
     try:
-        conservante = Conservante.deleteConservanteById(id_conservante=43)
+        conservante = asyncio.run(Conservante.deleteConservanteById(id_conservante=43))
         print(conservante)
     except Exception as e:
         print(f'Erro ao deletar Conservante: {e}')
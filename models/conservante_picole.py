@@ -8,8 +8,16 @@ from datetime import datetime
 from models.model_base import ModelBase
 from models.picole import Picole
 from models.conservante import Conservante
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+
+log = getLogger('conservante_picole')
 
 
 class ConservantePicole(ModelBase):
@@ -48,6 +56,7 @@ class ConservantePicole(ModelBase):
                 )
 
     @staticmethod
+    @retryTransitorio
     async def insertConservantePicole(picole_fk: int, conservante_fk: int) -> 'ConservantePicole' or None:
         """Insere um ConservantePicole na tabela conservante_picole
         :param picole_fk: int: id do picolé
@@ -58,7 +67,6 @@ class ConservantePicole(ModelBase):
         contrário, retorna um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(picole_fk, int):
@@ -71,18 +79,9 @@ class ConservantePicole(ModelBase):
                                                    conservante_picole=f'{conservante_fk}-{picole_fk}'
                                                    )
             # Verificar se já existe um registro com o nome e a fórmula informados
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo ConservantePicole: {conservante_picole}')
-                session.add(conservante_picole)
-                await session.commit()
-
-                print(f'ConservantePicole inserido com sucesso!')
-                print(f'ID do ConservantePicole inserido: {conservante_picole.id}')
-                print(f'picole_fk do ConservantePicole inserido: {conservante_picole.picole_fk}')
-                print(f'picole.sabor do ConservantePicole inserido: {conservante_picole.picole.sabor}')
-                print(f'conservante_fk do ConservantePicole inserido: {conservante_picole.conservante_fk}')
-                print(f'conservante.nome do ConservantePicole inserido: {conservante_picole.conservante.nome}')
+            await persistir(conservante_picole)
+            log.debug('ConservantePicole inserido: id=%s picole_fk=%s conservante_fk=%s',
+                      conservante_picole.id, conservante_picole.picole_fk, conservante_picole.conservante_fk)
             return conservante_picole
 
         except IntegrityError as intg_error:
@@ -102,29 +101,32 @@ class ConservantePicole(ModelBase):
         except TypeError as te:
             raise TypeError(te)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir ConservantePicole: {exc}')
 
     @staticmethod
-    def selectAllConservantePicole():
+    @retryTransitorio
+    async def selectAllConservantePicole():
         """Seleciona todos os registros da tabela conservante_picole
             :raises Exception: Informando erro inesperado ao selecionar os ConservantePicole
             :return: List[ConservantePicole]: Retorna uma lista de objetos ConservantePicole
         """
         try:
-            with createSession() as session:
-                conservante_picole = session.query(ConservantePicole).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(ConservantePicole)
+                conservante_picole = (await session.scalars(consulta)).all()
                 return conservante_picole
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar ConservantePicole: {exc}')
 
     @staticmethod
-    def selectConservantePicolePorId(id: int) -> 'ConservantePicole' or None:
+    @retryTransitorio
+    async def selectConservantePicolePorId(id: int) -> 'ConservantePicole' or None:
         """Seleciona um registro da tabela conservante_picole por ID
         :param id: int: id do ConservantePicole
         :return: ConservantePicole or None: Retorna o objeto ConservantePicole se encontrado, None caso contrário
@@ -141,15 +143,17 @@ class ConservantePicole(ModelBase):
             if not id:
                 raise ValueError('O id do ConservantePicole deve ser informado!')
 
-            with createSession() as session:
-                conservante_picole = session.query(ConservantePicole).filter(ConservantePicole.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(ConservantePicole).where(ConservantePicole.id == id)
+                conservante_picole = (await session.scalars(consulta)).first()
                 return conservante_picole
 
         except Exception as exc:
             raise RuntimeError(f'Erro ao selecionar ConservantePicole por ID: {exc}')
 
     @staticmethod
-    def selectAllConservantePicolePorPicole(picole_fk: int) -> list['ConservantePicole'] or []:
+    @retryTransitorio
+    async def selectAllConservantePicolePorPicole(picole_fk: int) -> list['ConservantePicole'] or []:
         """Seleciona todos os registros da tabela conservante_picole por picole_fk
         :param picole_fk: int: id do picolé
         :raises TypeError: Se o picole_fk não for um inteiro
@@ -164,9 +168,9 @@ class ConservantePicole(ModelBase):
             if not picole_fk:
                 raise ValueError('O picole_fk do ConservantePicole deve ser informado!')
 
-            with createSession() as session:
-                conservante_picole = session.query(ConservantePicole).filter(
-                    ConservantePicole.picole_fk == picole_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(ConservantePicole).where(ConservantePicole.picole_fk == picole_fk)
+                conservante_picole = (await session.scalars(consulta)).all()
                 return conservante_picole
 
         except TypeError as te:
@@ -179,7 +183,8 @@ class ConservantePicole(ModelBase):
             raise RuntimeError(f'Erro inesperado ao selecionar todos ConservantePicole por picole_fk: {exc}')
 
     @staticmethod
-    def selectAllConservantePicolePorConservante(conservante_fk: int) -> list['ConservantePicole'] or []:
+    @retryTransitorio
+    async def selectAllConservantePicolePorConservante(conservante_fk: int) -> list['ConservantePicole'] or []:
         """Seleciona todos os registros da tabela conservante_picole por conservante_fk
         :param conservante_fk: int: id do conservante
         :raises TypeError: Se o conservante_fk não for um inteiro
@@ -194,9 +199,9 @@ class ConservantePicole(ModelBase):
             if not conservante_fk:
                 raise ValueError('O conservante_fk do ConservantePicole deve ser informado!')
 
-            with createSession() as session:
-                conservante_picole = session.query(ConservantePicole).filter(
-                    ConservantePicole.conservante_fk == conservante_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(ConservantePicole).where(ConservantePicole.conservante_fk == conservante_fk)
+                conservante_picole = (await session.scalars(consulta)).all()
                 return conservante_picole
 
         except TypeError as te:
@@ -209,9 +214,20 @@ class ConservantePicole(ModelBase):
             raise RuntimeError(f'Erro inesperado ao selecionar todos ConservantePicole por conservante_fk: {exc}')
 
     @staticmethod
-    def updateConservantePicole(id_cons_picole: int,
-                                picole_fk: Union[int, None],
-                                conservante_fk: Union[int, None]) -> 'ConservantePicole':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'ConservantePicole']:
+        """Seleciona vários ConservantePicole por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de ConservantePicole, repetições são ignoradas
+        :return: dict[int, ConservantePicole]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(ConservantePicole, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateConservantePicole(id_cons_picole: int,
+                                      picole_fk: Union[int, None],
+                                      conservante_fk: Union[int, None]) -> 'ConservantePicole':
         """Atualiza um ConservantePicole na tabela conservante_picole
         :param id_cons_picole: int: id do ConservantePicole
         :param picole_fk: int: id do picolé
@@ -231,9 +247,9 @@ class ConservantePicole(ModelBase):
             if not isinstance(conservante_fk, int) and conservante_fk is not None:
                 raise TypeError('conservante_fk do ConservantePicole deve ser um inteiro ou não deve ser informado!')
 
-            with createSession() as session:
-                conservante_picole = session.query(ConservantePicole). \
-                    filter_by(id=id_cons_picole).first()
+            async with sessionScope() as session:
+                consulta = sa.select(ConservantePicole).where(ConservantePicole.id == id_cons_picole)
+                conservante_picole = (await session.scalars(consulta)).first()
 
                 if not conservante_picole:
                     raise ValueError(f'ConservantePicole com id={id_cons_picole} não encontrado!')
@@ -252,7 +268,7 @@ class ConservantePicole(ModelBase):
                 conservante_picole.conservante_picole = (f'{conservante_picole.conservante_fk}-'
                                                          f'{conservante_picole.picole_fk}')
                 conservante_picole.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return conservante_picole
 
         except TypeError as te:
@@ -279,36 +295,50 @@ class ConservantePicole(ModelBase):
             raise RuntimeError(f'Erro inesperado ao atualizar ConservantePicole: {exc}')
 
     @staticmethod
-    def deleteConservantePicoleById(id_cons_picole: int) -> 'ConservantePicole':
-        """Deleta um ConservantePicole na tabela conservante_picole
-        :param id_cons_picole: int: id do ConservantePicole
+    @retryTransitorio
+    async def deleteConservantePicoleById(id_cons_picole: int) -> int:
+        """Deleta um ConservantePicole cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
+        :param id_cons_picole: int: identificador do ConservantePicole
+        :return: int: Retorna o id do ConservantePicole deletado
         :raises TypeError: Se o id_cons_picole não for um inteiro
-        :raises ValueError: Se o ConservantePicole não for encontrado
-        :raises RuntimeError: Se ocorrer um erro ao deletar o ConservantePicole
+        :raises RuntimeError: Se o ConservantePicole estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
+        :raises ValueError: Se o ConservantePicole não for encontrado na base
         """
-
         try:
             if not isinstance(id_cons_picole, int):
                 raise TypeError('id_cons_picole do ConservantePicole deve ser um inteiro!')
 
-            with createSession() as session:
-                conservante_picole = session.query(ConservantePicole).filter_by(
-                    id=id_cons_picole).first()
-                if not conservante_picole:
-                    raise ValueError(f'ConservantePicole com id={id_cons_picole} não encontrado!')
+            return await DataBaseFeatures.deleteById(model=ConservantePicole, id=id_cons_picole)
 
-                session.delete(conservante_picole)
-                session.commit()
-                return conservante_picole
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-        except TypeError as te:
-            raise TypeError(te)
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar ConservantePicole: {exc}')
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários ConservantePicole em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de ConservantePicole
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum ConservantePicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(ConservantePicole, ids)
 
-        except Exception as exc:
-            raise RuntimeError(f'Erro inesperado ao deletar ConservantePicole: {exc}')
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de ConservantePicole que atendem aos filtros informados, ex.: ConservantePicole.picole_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum ConservantePicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(ConservantePicole, *filtros)
 
 
 if __name__ == '__main__':
@@ -339,7 +369,7 @@ if __name__ == '__main__':
     # print(conser_picole)
 
     try:
-        conser_picole = ConservantePicole.deleteConservantePicoleById(id_cons_picole='9')
+        conser_picole = asyncio.run(ConservantePicole.deleteConservantePicoleById(id_cons_picole='9'))
         print(conser_picole)
     except Exception as e:
         print(f'Erro ao deletar ConservantePicole: {e}')
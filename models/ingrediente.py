@@ -3,10 +3,17 @@ import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
 from sqlalchemy.exc import IntegrityError
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('ingrediente')
+
+
 class Ingrediente(ModelBase):
     __tablename__ = 'ingrediente'
 
@@ -23,6 +30,7 @@ class Ingrediente(ModelBase):
 
     
     @staticmethod
+    @retryTransitorio
     async def insertIngrediente(nome: str) -> 'Ingrediente' or None:
         """Insere um Ingrediente na tabela ingrediente
         :param nome: str: nome do ingrediente
@@ -32,7 +40,6 @@ class Ingrediente(ModelBase):
         seja por outro motivo, será lançado um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(nome, str):
@@ -45,16 +52,8 @@ class Ingrediente(ModelBase):
                 raise ValueError('nome do Ingrediente não informado!')
     
             ingrediente = Ingrediente(nome=nome)
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo Ingrediente: {ingrediente}')
-                session.add(ingrediente)
-                await session.commit()
-    
-                print(f'Ingrediente inserido com sucesso!')
-                print(f'ID do Ingrediente inserido: {ingrediente.id}')
-                print(f'Nome do Ingrediente inserido: {ingrediente.nome}')
-                print(f'Data de criação do Ingrediente inserido: {ingrediente.data_criacao}')
+            await persistir(ingrediente)
+            log.debug('Ingrediente inserido: id=%s nome=%s', ingrediente.id, ingrediente.nome)
             return ingrediente
     
         except IntegrityError as intg_error:
@@ -72,29 +71,32 @@ class Ingrediente(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
     
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir Ingrediente: {exc}')
 
     @staticmethod
-    def selectAllIngredientes() -> list['Ingrediente'] or []:
+    @retryTransitorio
+    async def selectAllIngredientes() -> list['Ingrediente'] or []:
         """Seleciona todos os Ingredientes na tabela ingrediente
         :raises Exception: Informando erro inesperado
         :return: list or []: Retorna a lista de objetos Ingredientes se encontrados, [] caso contrário
         """
         try:
-            with createSession() as session:
-                ingredientes = session.query(Ingrediente).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Ingrediente)
+                ingredientes = (await session.scalars(consulta)).all()
                 return ingredientes
     
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar Ingredientes: {exc}')
 
     @staticmethod
-    def selectIngredientePorId(id: int) -> 'Ingrediente' or None:
+    @retryTransitorio
+    async def selectIngredientePorId(id: int) -> 'Ingrediente' or None:
         """Seleciona um Ingrediente na tabela ingrediente por id
         :param id: int: id do ingrediente
         :return: Ingrediente or None: Retorna o objeto Ingrediente se encontrado, None caso contrário
@@ -111,8 +113,9 @@ class Ingrediente(ModelBase):
             if not id:
                 raise ValueError('id do Ingrediente não informado!')
     
-            with createSession() as session:
-                ingrediente = session.query(Ingrediente).filter(Ingrediente.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Ingrediente).where(Ingrediente.id == id)
+                ingrediente = (await session.scalars(consulta)).first()
                 return ingrediente
     
         except TypeError as te:
@@ -122,10 +125,11 @@ class Ingrediente(ModelBase):
             raise ValueError(ve)
     
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Ingrediente: {exc}')
 
     @staticmethod
-    def selectIngredientePorNome(nome: str) -> 'Ingrediente' or None:
+    @retryTransitorio
+    async def selectIngredientePorNome(nome: str) -> 'Ingrediente' or None:
         """Seleciona um Ingrediente na tabela ingrediente por nome
         :param nome: str: nome do ingrediente
         :return: Ingrediente or None: Retorna o objeto Ingrediente se encontrado, None caso contrário
@@ -144,8 +148,9 @@ class Ingrediente(ModelBase):
             if not nome:
                 raise ValueError('nome do Ingrediente não informado!')
     
-            with createSession() as session:
-                ingrediente = session.query(Ingrediente).filter(Ingrediente.nome == nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_INGREDIENTE_POR_NOME
+                ingrediente = (await session.scalars(consulta, {'nome': nome})).first()
                 return ingrediente
     
         except TypeError as te:
@@ -155,11 +160,22 @@ class Ingrediente(ModelBase):
             raise ValueError(ve)
     
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Ingrediente: {exc}')
+
 
+    @staticmethod
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'Ingrediente']:
+        """Seleciona vários Ingrediente por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de Ingrediente, repetições são ignoradas
+        :return: dict[int, Ingrediente]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(Ingrediente, ids)
 
     @staticmethod
-    def updateIngrediente(id_ingrediente: int, nome: str = '') -> 'Ingrediente':
+    @retryTransitorio
+    async def updateIngrediente(id_ingrediente: int, nome: str = '') -> 'Ingrediente':
         """Atualiza um Ingrediente na tabela ingrediente
         :param id_ingrediente: int: id do ingrediente
         :param nome: str: nome do ingrediente
@@ -184,8 +200,9 @@ class Ingrediente(ModelBase):
 
             nome = nome.strip().upper()
 
-            with createSession() as session:
-                ingrediente = session.query(Ingrediente).filter_by(id=id_ingrediente).first()
+            async with sessionScope() as session:
+                consulta = sa.select(Ingrediente).where(Ingrediente.id == id_ingrediente)
+                ingrediente = (await session.scalars(consulta)).first()
 
                 if not ingrediente:
                     raise ValueError(f'Ingrediente com id={id_ingrediente} não cadastrado na base!')
@@ -197,7 +214,7 @@ class Ingrediente(ModelBase):
 
                 ingrediente.data_atualizacao = datetime.now()
 
-                session.commit()
+                await session.flush()
                 return ingrediente
 
         except IntegrityError as intg_error:
@@ -219,54 +236,60 @@ class Ingrediente(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Ingrediente: {exp}')
 
     @staticmethod
-    def deleteIngredienteById(id_ingrediente: int) -> 'Ingrediente':
-        """Deleta um Ingrediente cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteIngredienteById(id_ingrediente: int) -> int:
+        """Deleta um Ingrediente cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_ingrediente: int: identificador do Ingrediente
-        :return: Ingrediente: Retorna o objeto Ingrediente deletado
-        :raises TypeError: Se o id não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o Ingrediente, especificado para o
-        id, caso o Ingrediente esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :return: int: Retorna o id do Ingrediente deletado
+        :raises TypeError: Se o id_ingrediente não for um inteiro
+        :raises RuntimeError: Se o Ingrediente estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o Ingrediente não for encontrado na base
         """
         try:
             if not isinstance(id_ingrediente, int):
                 raise TypeError('id do Ingrediente deve ser um inteiro!')
 
-            with createSession() as session:
-                ingrediente: Ingrediente = session.query(Ingrediente). \
-                    filter_by(id=id_ingrediente).first()
+            return await DataBaseFeatures.deleteById(model=Ingrediente, id=id_ingrediente)
 
-                if not ingrediente:
-                    raise ValueError(f'Ingrediente com id={id_ingrediente} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(ingrediente)
-                session.commit()
-                return ingrediente
-
-        except TypeError as te:
-            raise TypeError(te)
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar Ingrediente: {exc}')
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários Ingrediente em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de Ingrediente
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum Ingrediente estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(Ingrediente, ids)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=Ingrediente.__tablename__)
-                raise RuntimeError(f'Ingrediente com id={id_ingrediente} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de Ingrediente que atendem aos filtros informados, ex.: Ingrediente.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum Ingrediente estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(Ingrediente, *filtros)
 
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar Ingrediente: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar Ingrediente: {exc}')
+# consulta de Ingrediente.selectIngredientePorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_INGREDIENTE_POR_NOME = sa.select(Ingrediente).where(Ingrediente.nome == sa.bindparam('nome'))
 
 
 if __name__ == '__main__':
     try:
-        Ingrediente.insertIngrediente(nome='sal2')
+        asyncio.run(Ingrediente.insertIngrediente(nome='sal2'))
     except Exception as e:
         print(f'Erro ao inserir Ingrediente: {e}')
 
@@ -281,7 +304,7 @@ if __name__ == '__main__':
     # print('ingrediente')
 
     try:
-        ingrediente = Ingrediente.deleteIngredienteById(id_ingrediente=98)
+        ingrediente = asyncio.run(Ingrediente.deleteIngredienteById(id_ingrediente=98))
         print(ingrediente)
     except Exception as e:
         print(f'Erro ao deletar Ingrediente: {e}')
@@ -7,8 +7,16 @@ from datetime import datetime
 from models.model_base import ModelBase
 from models.picole import Picole
 from models.ingrediente import Ingrediente
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+
+log = getLogger('ingrediente_picole')
 
 
 class IngredientePicole(ModelBase):
@@ -46,6 +54,7 @@ class IngredientePicole(ModelBase):
                 )
 
     @staticmethod
+    @retryTransitorio
     async def insertIngredientePicole(picole_fk: int, ingrediente_fk: int) -> 'IngredientePicole' or None:
         """Insere um IngredientePicole na tabela ingrediente_picole
         :param picole_fk: int: id do picolé
@@ -56,7 +65,6 @@ class IngredientePicole(ModelBase):
         contrário, retorna um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(picole_fk, int):
@@ -69,18 +77,9 @@ class IngredientePicole(ModelBase):
                                                    ingrediente_picole=f'{ingrediente_fk}-{picole_fk}'
                                                    )
             # Verificar se já existe um registro com o nome e a fórmula informados
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo IngredientePicole: {ingrediente_picole}')
-                session.add(ingrediente_picole)
-                await session.commit()
-
-                print(f'IngredientePicole inserido com sucesso!')
-                print(f'ID do IngredientePicole inserido: {ingrediente_picole.id}')
-                print(f'picole_fk do IngredientePicole inserido: {ingrediente_picole.picole_fk}')
-                print(f'picole.sabor do IngredientePicole inserido: {ingrediente_picole.picole.sabor}')
-                print(f'ingrediente_fk do IngredientePicole inserido: {ingrediente_picole.ingrediente_fk}')
-                print(f'ingrediente_fk.nome do IngredientePicole inserido: {ingrediente_picole.ingrediente.nome}')
+            await persistir(ingrediente_picole)
+            log.debug('IngredientePicole inserido: id=%s picole_fk=%s ingrediente_fk=%s',
+                      ingrediente_picole.id, ingrediente_picole.picole_fk, ingrediente_picole.ingrediente_fk)
             return ingrediente_picole
 
         except IntegrityError as intg_error:
@@ -99,15 +98,16 @@ class IngredientePicole(ModelBase):
         except TypeError as te:
             raise TypeError(te)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir IngredientePicole: {exc}')
 
     @staticmethod
-    def selectIngredientePicolePorId(id: int) -> 'IngredientePicole' or None:
+    @retryTransitorio
+    async def selectIngredientePicolePorId(id: int) -> 'IngredientePicole' or None:
         """Seleciona um IngredientePicole na tabela ingrediente_picole
         :param id: int: id do ingrediente_picole
         :return: IngredientePicole or None: Retorna o objeto IngredientePicole se encontrado, None caso contrário
@@ -120,8 +120,9 @@ class IngredientePicole(ModelBase):
             if not isinstance(id, int):
                 raise TypeError('id do IngredientePicole deve ser um inteiro!')
 
-            with createSession() as session:
-                ingrediente_picole = session.query(IngredientePicole).filter(IngredientePicole.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(IngredientePicole).where(IngredientePicole.id == id)
+                ingrediente_picole = (await session.scalars(consulta)).first()
                 if ingrediente_picole:
                     return ingrediente_picole
 
@@ -129,24 +130,27 @@ class IngredientePicole(ModelBase):
             raise TypeError(te)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar IngredientePicole: {exc}')
 
     @staticmethod
-    def selectAllIngredientePicole() -> list['IngredientePicole'] or []:
+    @retryTransitorio
+    async def selectAllIngredientePicole() -> list['IngredientePicole'] or []:
         """Seleciona todos os IngredientesPicole na tabela ingrediente_picole
         :raises Exception: Informando erro inesperado ao selecionar os ingredientes_picole
         :return: list[IngredientePicole] or []: Retorna uma lista de objetos IngredientePicole se encontrado, [] caso contrário
         """
         try:
-            with createSession() as session:
-                ingredientes_picole = session.query(IngredientePicole).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(IngredientePicole)
+                ingredientes_picole = (await session.scalars(consulta)).all()
                 return ingredientes_picole
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos IngredientePicole: {exc}')
 
     @staticmethod
-    def selectAllIngPicPorPicoleFK(picole_fk: int) -> list['IngredientePicole'] or []:
+    @retryTransitorio
+    async def selectAllIngPicPorPicoleFK(picole_fk: int) -> list['IngredientePicole'] or []:
         """Seleciona todos os IngredientesPicole na tabela ingrediente_picole por picole_fk
         :param picole_fk: int: id do picolé
         :return: list or []: Retorna uma lista de objetos IngredientePicole se encontrado, [] caso contrário
@@ -159,9 +163,9 @@ class IngredientePicole(ModelBase):
             if not isinstance(picole_fk, int):
                 raise TypeError('picole_fk do IngredientePicole deve ser um inteiro!')
 
-            with createSession() as session:
-                ingredientes_picole = session.query(IngredientePicole).filter(
-                    IngredientePicole.picole_fk == picole_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(IngredientePicole).where(IngredientePicole.picole_fk == picole_fk)
+                ingredientes_picole = (await session.scalars(consulta)).all()
                 return ingredientes_picole
 
         except TypeError as te:
@@ -171,7 +175,8 @@ class IngredientePicole(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar todos IngredientePicole: {exc}')
 
     @staticmethod
-    def selectAllIngPicPorIngredienteFK(ingrediente_fk: int) -> list['IngredientePicole'] or []:
+    @retryTransitorio
+    async def selectAllIngPicPorIngredienteFK(ingrediente_fk: int) -> list['IngredientePicole'] or []:
         """Seleciona todos os IngredientesPicole na tabela ingrediente_picole por ingrediente_fk
         :param ingrediente_fk: int: id do ingrediente
         :return: list or []: Retorna uma lista de objetos IngredientePicole se encontrado, [] caso contrário
@@ -184,9 +189,9 @@ class IngredientePicole(ModelBase):
             if not isinstance(ingrediente_fk, int):
                 raise TypeError('ingrediente_fk do IngredientePicole deve ser um inteiro!')
 
-            with createSession() as session:
-                ingredientes_picole = session.query(IngredientePicole).filter(
-                    IngredientePicole.ingrediente_fk == ingrediente_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(IngredientePicole).where(IngredientePicole.ingrediente_fk == ingrediente_fk)
+                ingredientes_picole = (await session.scalars(consulta)).all()
                 return ingredientes_picole
 
         except TypeError as te:
@@ -196,9 +201,20 @@ class IngredientePicole(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar todos IngredientePicole: {exc}')
 
     @staticmethod
-    def updateIngredientePicole(id_ing_picole: int,
-                                picole_fk: Union[int, None],
-                                ingrediente_fk: Union[int, None]) -> 'IngredientePicole':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'IngredientePicole']:
+        """Seleciona vários IngredientePicole por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de IngredientePicole, repetições são ignoradas
+        :return: dict[int, IngredientePicole]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(IngredientePicole, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateIngredientePicole(id_ing_picole: int,
+                                      picole_fk: Union[int, None],
+                                      ingrediente_fk: Union[int, None]) -> 'IngredientePicole':
         """Atualiza um IngredientePicole na tabela ingrediente_picole
         :param id_ing_picole: int: id do IngredientePicole
         :param picole_fk: int: id do picolé
@@ -220,9 +236,9 @@ class IngredientePicole(ModelBase):
             if not isinstance(ingrediente_fk, int) and ingrediente_fk is not None:
                 raise TypeError('ingrediente_fk do IngredientePicole deve ser um inteiro ou não deve ser informado!')
 
-            with createSession() as session:
-                ingrediente_picole = session.query(IngredientePicole). \
-                    filter_by(id=id_ing_picole).first()
+            async with sessionScope() as session:
+                consulta = sa.select(IngredientePicole).where(IngredientePicole.id == id_ing_picole)
+                ingrediente_picole = (await session.scalars(consulta)).first()
 
                 if not ingrediente_picole:
                     raise ValueError(f'IngredientePicole com id={id_ing_picole} não encontrado!')
@@ -240,7 +256,7 @@ class IngredientePicole(ModelBase):
                 ingrediente_picole.ingrediente_picole = (f'{ingrediente_picole.ingrediente_fk}-'
                                                          f'{ingrediente_picole.picole_fk}')
                 ingrediente_picole.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return ingrediente_picole
 
         except TypeError as te:
@@ -266,36 +282,50 @@ class IngredientePicole(ModelBase):
             raise RuntimeError(f'Erro inesperado ao atualizar IngredientePicole: {exc}')
 
     @staticmethod
-    def deleteIngredientePicoleById(id_ingr_picole: int) -> 'IngredientePicole':
-        """Deleta um IngredientePicole na tabela ingrediente_picole
-        :param id_ingr_picole: int: id do IngredientePicole
+    @retryTransitorio
+    async def deleteIngredientePicoleById(id_ingr_picole: int) -> int:
+        """Deleta um IngredientePicole cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
+        :param id_ingr_picole: int: identificador do IngredientePicole
+        :return: int: Retorna o id do IngredientePicole deletado
         :raises TypeError: Se o id_ingr_picole não for um inteiro
-        :raises ValueError: Se o IngredientePicole não for encontrado
-        :raises RuntimeError: Se ocorrer um erro ao deletar o IngredientePicole
+        :raises RuntimeError: Se o IngredientePicole estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
+        :raises ValueError: Se o IngredientePicole não for encontrado na base
         """
-
         try:
             if not isinstance(id_ingr_picole, int):
                 raise TypeError('id_ingr_picole do IngredientePicole deve ser um inteiro!')
 
-            with createSession() as session:
-                ingrediente_picole = session.query(IngredientePicole).filter_by(
-                    id=id_ingr_picole).first()
-                if not ingrediente_picole:
-                    raise ValueError(f'IngredientePicole com id={id_ingr_picole} não encontrado!')
+            return await DataBaseFeatures.deleteById(model=IngredientePicole, id=id_ingr_picole)
 
-                session.delete(ingrediente_picole)
-                session.commit()
-                return ingrediente_picole
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-        except TypeError as te:
-            raise TypeError(te)
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar IngredientePicole: {exc}')
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários IngredientePicole em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de IngredientePicole
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum IngredientePicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(IngredientePicole, ids)
 
-        except Exception as exc:
-            raise RuntimeError(f'Erro inesperado ao deletar IngredientePicole: {exc}')
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de IngredientePicole que atendem aos filtros informados, ex.: IngredientePicole.picole_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum IngredientePicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(IngredientePicole, *filtros)
 
 
 if __name__ == '__main__':
@@ -325,7 +355,7 @@ if __name__ == '__main__':
     # print(ingredientes_picole)
 
     try:
-        ingredientes_picole = IngredientePicole.deleteIngredientePicoleById(id_ingr_picole='1')
+        ingredientes_picole = asyncio.run(IngredientePicole.deleteIngredientePicoleById(id_ingr_picole='1'))
         print(ingredientes_picole)
     except Exception as e:
         print(f'Erro ao deletar IngredientePicole: {e}')
\ No newline at end of file
@@ -6,10 +6,17 @@ from datetime import datetime
 from models.model_base import ModelBase
 from models.picole import Picole
 from sqlalchemy.exc import NoForeignKeysError, IntegrityError
-from conf.db_session import createSession
+from conf.db_session import sessionScope, conexaoLeitura
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('lote')
+
+
 class Lote(ModelBase):
     __tablename__ = 'lote'
 
@@ -34,6 +41,7 @@ class Lote(ModelBase):
 
 
     @staticmethod
+    @retryTransitorio
     async def insertLote(picole_fk: int, quantidade: int) -> 'Lote' or None:
         """Insere um Lote na tabela lote
         :param picole_fk: int: id do picolé
@@ -44,7 +52,6 @@ class Lote(ModelBase):
         seja por outro motivo, será lançado um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(picole_fk, int):
@@ -58,17 +65,9 @@ class Lote(ModelBase):
                 raise ValueError('quantidade de picolés do Lote deve ser maior que zero!')
 
             lote = Lote(picole_fk=picole_fk, quantidade=quantidade)
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo lote: {lote}')
-                session.add(lote)
-                await session.commit()
-
-                print(f'Lote inserido com sucesso!')
-                print(f'ID do Lote inserido: {lote.id}')
-                print(f'Sabor do Picole inserido no Lote inserido: {lote.picole.sabor.nome}')
-                print(f'Quantidade de picolé do Lote inserido: {lote.quantidade}')
-                return lote
+            await persistir(lote)
+            log.debug('Lote inserido: id=%s picole_fk=%s quantidade=%s', lote.id, lote.picole_fk, lote.quantidade)
+            return lote
 
         except IntegrityError as intg_error:
             if 'FOREIGN KEY constraint failed' in str(intg_error):
@@ -83,22 +82,24 @@ class Lote(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir Lote: {exc}')
 
     @staticmethod
-    def selectAllLotes() -> list['Lote'] or []:
+    @retryTransitorio
+    async def selectAllLotes() -> list['Lote'] or []:
         """Seleciona todos os Lotes na tabela lote
         :raises Exception: Informa erro inesperado ao selecionar Lotes
         :return: list[Lote] or []: Retorna uma lista de objetos Lote se encontrado, [] caso contrário
         """
         try:
-            with createSession() as session:
-                lotes = session.query(Lote).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Lote)
+                lotes = (await session.scalars(consulta)).all()
                 return lotes
 
         except Exception as exc:
@@ -106,7 +107,8 @@ class Lote(ModelBase):
 
 
     @staticmethod
-    def selectLotePorId(id: int) -> 'Lote' or None:
+    @retryTransitorio
+    async def selectLotePorId(id: int) -> 'Lote' or None:
         """Seleciona um Lote na tabela lote por id
         :param id: int: id do lote
         :raises TypeError: Se o id não for um inteiro
@@ -122,8 +124,9 @@ class Lote(ModelBase):
             if not id:
                 raise ValueError('id do Lote não informado!')
 
-            with createSession() as session:
-                lote = session.query(Lote).filter(Lote.id == id).one_or_none()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Lote).where(Lote.id == id)
+                lote = (await session.scalars(consulta)).one_or_none()
                 return lote
 
         except TypeError as te:
@@ -133,11 +136,12 @@ class Lote(ModelBase):
             raise ValueError(ve)
 
         except Exception as e:
-            print(f'Erro ao selecionar Lote: {e}')
+            raise Exception(f'Erro inesperado ao selecionar Lote: {e}')
 
 
     @staticmethod
-    def selectLotesPorPicoleFk(picole_fk: int) -> list['Lote'] or []:
+    @retryTransitorio
+    async def selectLotesPorPicoleFk(picole_fk: int) -> list['Lote'] or []:
         """Seleciona um Lote na tabela lote por picole_fk
         :param picole_fk: int: id do picolé
         :raises TypeError: Se o picole_fk não for um inteiro
@@ -152,8 +156,9 @@ class Lote(ModelBase):
             if not picole_fk:
                 raise ValueError('picole_fk do Lote não informado!')
 
-            with createSession() as session:
-                lotes = session.query(Lote).filter(Lote.picole_fk == picole_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_LOTES_POR_PICOLE_FK
+                lotes = (await session.scalars(consulta, {'picole_fk': picole_fk})).all()
                 return lotes
 
         except TypeError as te:
@@ -163,11 +168,54 @@ class Lote(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro ao selecionar Lote: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Lote: {exc}')
+
 
 
     @staticmethod
-    def updateLote(id_lote: int, picole_fk: Union[int, None], quantidade: Union[int, None]) -> 'Lote':
+    @retryTransitorio
+    async def selectLinhasLotePorPicoleFk(picole_fk: int) -> list[sa.Row]:
+        """Seleciona os Lotes de um picolé como tuplas (id, picole_fk, quantidade). Caminho rápido para leituras
+        frequentes: executa o select() direto na conexão, sem Session, identity map ou carga do picolé
+        :param picole_fk: int: id do picolé
+        :raises TypeError: Se o picole_fk não for um inteiro
+        :raises ValueError: Se o picole_fk não for informado
+        :return: list[Row]: Retorna uma lista de tuplas, [] se não houver lotes
+        """
+        try:
+            if not isinstance(picole_fk, int):
+                raise TypeError('picole_fk do Lote deve ser um inteiro!')
+
+            # validar se os parâmetros informados são válidos
+            if not picole_fk:
+                raise ValueError('picole_fk do Lote não informado!')
+
+            async with conexaoLeitura() as conexao:
+                lotes = (await conexao.execute(_SELECT_LINHAS_LOTE_POR_PICOLE_FK, {'picole_fk': picole_fk})).all()
+                return lotes
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except ValueError as ve:
+            raise ValueError(ve)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar Lote: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'Lote']:
+        """Seleciona vários Lote por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de Lote, repetições são ignoradas
+        :return: dict[int, Lote]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(Lote, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateLote(id_lote: int, picole_fk: Union[int, None], quantidade: Union[int, None]) -> 'Lote':
         """Atualiza um Lote na tabela lote
         :param id_lote: int: id do lote
         :param picole_fk: int: id do picolé
@@ -191,8 +239,9 @@ class Lote(ModelBase):
             if quantidade is not None and quantidade <= 0:
                 raise ValueError('quantidade de picolés do Lote deve ser maior que zero!')
 
-            with createSession() as session:
-                lote = session.query(Lote).filter_by(id=id_lote).first()
+            async with sessionScope() as session:
+                consulta = sa.select(Lote).where(Lote.id == id_lote)
+                lote = (await session.scalars(consulta)).first()
 
                 if not lote:
                     raise ValueError(f'Lote com id={id_lote} não cadastrado na base!')
@@ -205,7 +254,7 @@ class Lote(ModelBase):
                 if quantidade:
                     lote.quantidade = quantidade
 
-                session.commit()
+                await session.flush()
                 return lote
 
         except IntegrityError as intg_error:
@@ -225,49 +274,68 @@ class Lote(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Lote: {exc}')
 
     @staticmethod
-    def deleteLoteById(id_lote: int) -> 'Lote':
-        """Deleta um Lote cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteLoteById(id_lote: int) -> int:
+        """Deleta um Lote cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_lote: int: identificador do Lote
-        :return: Lote: Retorna o objeto Lote deletado
-        :raises TypeError: Se o id não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o Lote, especificado para o
-        id, caso o Lote esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :return: int: Retorna o id do Lote deletado
+        :raises TypeError: Se o id_lote não for um inteiro
+        :raises RuntimeError: Se o Lote estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o Lote não for encontrado na base
         """
         try:
             if not isinstance(id_lote, int):
                 raise TypeError('id do Lote deve ser um inteiro!')
 
-            with createSession() as session:
-                lote: Lote = session.query(Lote). \
-                    filter_by(id=id_lote).first()
+            return await DataBaseFeatures.deleteById(model=Lote, id=id_lote)
 
-                if not lote:
-                    raise ValueError(f'Lote com id={id_lote} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(lote)
-                session.commit()
-                return lote
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar Lote: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários Lote em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de Lote
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum Lote estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(Lote, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de Lote que atendem aos filtros informados, ex.: Lote.picole_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum Lote estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(Lote, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=Lote.__tablename__)
-                raise RuntimeError(f'Lote com id={id_lote} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar Lote: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar Lote: {exc}')
+# índice de cobertura das unidades por picolé (ScriptsAuxiliares/Relatorios.py): o GROUP BY percorre o índice já na
+# ordem de picole_fk, sem ordenação temporária; também atende Lote.selectLotesPorPicoleFk
+sa.Index('ix_lote_picole_fk_quantidade', Lote.picole_fk, Lote.quantidade)
+
+
+# consulta de Lote.selectLotesPorPicoleFk, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_LOTES_POR_PICOLE_FK = sa.select(Lote).where(Lote.picole_fk == sa.bindparam('picole_fk'))
 
+# consulta Core de Lote.selectLinhasLotePorPicoleFk
+_tabela_lote = Lote.__table__
+_SELECT_LINHAS_LOTE_POR_PICOLE_FK = sa.select(
+    _tabela_lote.c.id,
+    _tabela_lote.c.picole_fk,
+    _tabela_lote.c.quantidade,
+).where(_tabela_lote.c.picole_fk == sa.bindparam('picole_fk'))
 
 
 if __name__ == '__main__':
@@ -282,7 +350,7 @@ if __name__ == '__main__':
     # print(f'Lote atualizado: {lote}')
 
     try:
-        lote = Lote.deleteLoteById(id_lote=12)
+        lote = asyncio.run(Lote.deleteLoteById(id_lote=12))
         print(f'Lote deletado: {lote}')
     except Exception as e:
         print(f'Erro ao deletar Lote: {e}')
@@ -7,8 +7,16 @@ from datetime import datetime
 from models.model_base import ModelBase
 from models.lote import Lote
 from models.nota_fiscal import NotaFiscal
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+
+log = getLogger('lote_nota_fiscal')
 
 
 class LoteNotaFiscal(ModelBase):
@@ -43,6 +51,7 @@ class LoteNotaFiscal(ModelBase):
         return f'LoteNotaFiscal(id={self.id}, lote_fk={self.lote_fk}, nota_fiscal_fk={self.nota_fiscal_fk})'
 
     @staticmethod
+    @retryTransitorio
     async def insertLoteNotaFiscal(nota_fiscal_fk: int, lote_fk: int) -> 'LoteNotaFiscal' or None:
         """Insere um LoteNotaFiscal na tabela lote_nota_fiscal
         :param nota_fiscal_fk: int: id da nota fiscal
@@ -54,7 +63,6 @@ class LoteNotaFiscal(ModelBase):
         contrário, retorna um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(nota_fiscal_fk, int):
@@ -67,19 +75,9 @@ class LoteNotaFiscal(ModelBase):
                                               lote_nota_fiscal=f'{lote_fk}-{nota_fiscal_fk}'
                                               )
             # Verificar se já existe um registro com o nome e a fórmula informados
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo LoteNotaFiscal: {lote_nota_fiscal}')
-                session.add(lote_nota_fiscal)
-                await session.commit()
-
-                print(f'Lote Nota Fiscal inserido com sucesso!')
-                print(f'ID do LoteNotaFiscal inserido: {lote_nota_fiscal.id}')
-                print(f'nota_fiscal_fk do LoteNotaFiscal inserido: {lote_nota_fiscal.nota_fiscal_fk}')
-                print(
-                    f'nota_fiscal.numero_serie LoteNotaFiscal inserido: {str(lote_nota_fiscal.nota_fiscal.numero_serie)}')
-                print(f'lote_fk do LoteNotaFiscal inserido: {lote_nota_fiscal.lote_fk}')
-                print(f'lote.quantidade do LoteNotaFiscal inserido: {lote_nota_fiscal.lote.quantidade}')
+            await persistir(lote_nota_fiscal)
+            log.debug('LoteNotaFiscal inserido: id=%s nota_fiscal_fk=%s lote_fk=%s',
+                      lote_nota_fiscal.id, lote_nota_fiscal.nota_fiscal_fk, lote_nota_fiscal.lote_fk)
             return lote_nota_fiscal
 
         except IntegrityError as intg_error:
@@ -101,28 +99,31 @@ class LoteNotaFiscal(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir LoteNotaFiscal: {exc}')
 
     @staticmethod
-    def selectAllLoteNotaFiscal() -> list['LoteNotaFiscal'] or []:
+    @retryTransitorio
+    async def selectAllLoteNotaFiscal() -> list['LoteNotaFiscal'] or []:
         """Seleciona todos os registros da tabela lote_nota_fiscal
         :raises Exception: Informando erro inesperado ao selecionar os LoteNotaFiscal
         :return: list[LoteNotaFiscal] or []: Retorna uma lista de objetos LoteNotaFiscal se houver registros, [] caso contrário
         """
         try:
-            with createSession() as session:
-                lote_nota_fiscal = session.query(LoteNotaFiscal).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(LoteNotaFiscal)
+                lote_nota_fiscal = (await session.scalars(consulta)).all()
                 return lote_nota_fiscal
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos LoteNotaFiscal: {exc}')
 
     @staticmethod
-    def selectLoteNotaFiscalPorId(id: int) -> 'LoteNotaFiscal' or None:
+    @retryTransitorio
+    async def selectLoteNotaFiscalPorId(id: int) -> 'LoteNotaFiscal' or None:
         """Seleciona um registro da tabela lote_nota_fiscal por ID
         :param id: int: id do LoteNotaFiscal
         :raise TypeError: Se o id não for um inteiro
@@ -135,8 +136,9 @@ class LoteNotaFiscal(ModelBase):
             if not id:
                 raise ValueError('id do LoteNotaFiscal não foi informado!')
 
-            with createSession() as session:
-                lote_nota_fiscal = session.query(LoteNotaFiscal).filter(LoteNotaFiscal.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(LoteNotaFiscal).where(LoteNotaFiscal.id == id)
+                lote_nota_fiscal = (await session.scalars(consulta)).first()
                 return lote_nota_fiscal
 
         except TypeError as te:
@@ -149,7 +151,8 @@ class LoteNotaFiscal(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar LoteNotaFiscal por ID: {exc}')
 
     @staticmethod
-    def selectAllLoteNotaFiscalPorNotaFiscal(nota_fiscal_fk: int) -> list['LoteNotaFiscal'] or []:
+    @retryTransitorio
+    async def selectAllLoteNotaFiscalPorNotaFiscal(nota_fiscal_fk: int) -> list['LoteNotaFiscal'] or []:
         """Seleciona todos os registros da tabela lote_nota_fiscal por nota_fiscal_fk
         :param nota_fiscal_fk: int: id da nota fiscal
         :raise TypeError: Se o nota_fiscal_fk não for um inteiro
@@ -162,9 +165,9 @@ class LoteNotaFiscal(ModelBase):
             if not nota_fiscal_fk:
                 raise ValueError('nota_fiscal_fk do LoteNotaFiscal não foi informado!')
 
-            with createSession() as session:
-                lote_nota_fiscal = session.query(LoteNotaFiscal).filter(
-                    LoteNotaFiscal.nota_fiscal_fk == nota_fiscal_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(LoteNotaFiscal).where(LoteNotaFiscal.nota_fiscal_fk == nota_fiscal_fk)
+                lote_nota_fiscal = (await session.scalars(consulta)).all()
                 return lote_nota_fiscal
 
         except TypeError as te:
@@ -177,7 +180,8 @@ class LoteNotaFiscal(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar LoteNotaFiscal por nota_fiscal_fk: {exc}')
 
     @staticmethod
-    def selectLoteNotaFiscalPorLote(lote_fk) -> 'LoteNotaFiscal' or None:
+    @retryTransitorio
+    async def selectLoteNotaFiscalPorLote(lote_fk) -> 'LoteNotaFiscal' or None:
         """Seleciona um registro da tabela lote_nota_fiscal por lote_fk
         :param lote_fk: int: id do lote
         :raise TypeError: Se o lote_fk não for um inteiro
@@ -190,8 +194,9 @@ class LoteNotaFiscal(ModelBase):
             if not lote_fk:
                 raise ValueError('lote_fk do LoteNotaFiscal não foi informado!')
 
-            with createSession() as session:
-                lote_nota_fiscal = session.query(LoteNotaFiscal).filter(LoteNotaFiscal.lote_fk == lote_fk).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(LoteNotaFiscal).where(LoteNotaFiscal.lote_fk == lote_fk)
+                lote_nota_fiscal = (await session.scalars(consulta)).first()
                 return lote_nota_fiscal
 
         except TypeError as te:
@@ -204,9 +209,20 @@ class LoteNotaFiscal(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar LoteNotaFiscal por lote_fk: {exc}')
 
     @staticmethod
-    def updateLoteNotaFiscal(id_lote_nf: int,
-                             lote_fk: Union[int, None],
-                             nota_fiscal_fk: Union[int, None]) -> 'LoteNotaFiscal':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'LoteNotaFiscal']:
+        """Seleciona vários LoteNotaFiscal por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de LoteNotaFiscal, repetições são ignoradas
+        :return: dict[int, LoteNotaFiscal]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(LoteNotaFiscal, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateLoteNotaFiscal(id_lote_nf: int,
+                                   lote_fk: Union[int, None],
+                                   nota_fiscal_fk: Union[int, None]) -> 'LoteNotaFiscal':
         """Atualiza um LoteNotaFiscal na tabela lote_nota_fiscal
         :param id_lote_nf: int: id do LoteNotaFiscal
         :param lote_fk: int: id do lote
@@ -229,9 +245,9 @@ class LoteNotaFiscal(ModelBase):
                 raise TypeError(
                     'nota_fiscal_fk do LoteNotaFiscal deve ser um inteiro ou não deve ser informado!')
 
-            with createSession() as session:
-                lote_nota_fiscal = session.query(LoteNotaFiscal). \
-                    filter_by(id=id_lote_nf).first()
+            async with sessionScope() as session:
+                consulta = sa.select(LoteNotaFiscal).where(LoteNotaFiscal.id == id_lote_nf)
+                lote_nota_fiscal = (await session.scalars(consulta)).first()
 
                 if not lote_nota_fiscal:
                     raise ValueError(f'LoteNotaFiscal com id={id_lote_nf} não encontrado!')
@@ -248,7 +264,7 @@ class LoteNotaFiscal(ModelBase):
 
                 lote_nota_fiscal.lote_nota_fiscal = f'{lote_fk}-{nota_fiscal_fk}'
                 lote_nota_fiscal.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return lote_nota_fiscal
 
         except TypeError as te:
@@ -274,37 +290,50 @@ class LoteNotaFiscal(ModelBase):
             raise RuntimeError(f'Erro inesperado ao atualizar LoteNotaFiscal: {exc}')
 
     @staticmethod
-    def deleteLoteNotaFiscalById(id_lote_nf: int) -> 'LoteNotaFiscal':
-        """Deleta um LoteNotaFiscal na tabela lote_nota_fiscal
-        :param id_lote_nf: int: id do LoteNotaFiscal
+    @retryTransitorio
+    async def deleteLoteNotaFiscalById(id_lote_nf: int) -> int:
+        """Deleta um LoteNotaFiscal cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
+        :param id_lote_nf: int: identificador do LoteNotaFiscal
+        :return: int: Retorna o id do LoteNotaFiscal deletado
         :raises TypeError: Se o id_lote_nf não for um inteiro
-        :raises ValueError: Se o LoteNotaFiscal não for encontrado
-        :raises RuntimeError: Se ocorrer um erro ao deletar o LoteNotaFiscal
+        :raises RuntimeError: Se o LoteNotaFiscal estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
+        :raises ValueError: Se o LoteNotaFiscal não for encontrado na base
         """
-
         try:
             if not isinstance(id_lote_nf, int):
                 raise TypeError('id_lote_nf do LoteNotaFiscal deve ser um inteiro!')
 
-            with createSession() as session:
-                lote_nota_fiscal = session.query(LoteNotaFiscal).filter_by(
-                    id=id_lote_nf).first()
-                if not lote_nota_fiscal:
-                    raise ValueError(f'LoteNotaFiscal com id={id_lote_nf} não encontrado!')
+            return await DataBaseFeatures.deleteById(model=LoteNotaFiscal, id=id_lote_nf)
 
-                session.delete(lote_nota_fiscal)
-                session.commit()
-                return lote_nota_fiscal
-
-        except TypeError as te:
-            raise TypeError(te)
-
-        except ValueError as ve:
-            raise ValueError(ve)
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
         except Exception as exc:
-            raise RuntimeError(f'Erro inesperado ao deletar LoteNotaFiscal: {exc}')
+            raise Exception(f'Erro inesperado ao deletar LoteNotaFiscal: {exc}')
 
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários LoteNotaFiscal em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de LoteNotaFiscal
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum LoteNotaFiscal estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(LoteNotaFiscal, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de LoteNotaFiscal que atendem aos filtros informados, ex.: LoteNotaFiscal.nota_fiscal_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum LoteNotaFiscal estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(LoteNotaFiscal, *filtros)
 
 
 if __name__ == '__main__':
@@ -324,7 +353,7 @@ if __name__ == '__main__':
     #     print(f'Erro ao inserir LoteNotaFiscal: {e}')
 
     try:
-        lote_nf = LoteNotaFiscal.deleteLoteNotaFiscalById(id_lote_nf=2)
+        lote_nf = asyncio.run(LoteNotaFiscal.deleteLoteNotaFiscalById(id_lote_nf=2))
         print(f'deletado:\n{lote_nf}')
     except Exception as e:
         print(f'Erro ao deletar LoteNotaFiscal: {e}')
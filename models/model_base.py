@@ -6,3 +6,6 @@ import sqlalchemy.ext.declarative
 
 # ModelBase is a class that will be inherited by all the models we create
 ModelBase = sqlalchemy.ext.declarative.declarative_base()
+# os models usam anotações simples (ex.: 'sabor: Sabor') nos relacionamentos, sem Mapped[],
+# o que o SQLAlchemy 2.0 só aceita com esta opção habilitada
+ModelBase.__allow_unmapped__ = True
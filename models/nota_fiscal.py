@@ -5,12 +5,19 @@ from datetime import datetime
 from models.model_base import ModelBase
 from models.revendedor import Revendedor
 from typing import List, Union
-from conf.db_session import createSession
+from conf.db_session import sessionScope, conexaoLeitura
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
 
+log = getLogger('nota_fiscal')
+
+
 class NotaFiscal(ModelBase):
     __tablename__ = 'nota_fiscal'
 
@@ -39,6 +46,7 @@ class NotaFiscal(ModelBase):
 
 
     @staticmethod
+    @retryTransitorio
     async def insertNotaFiscal(valor: float, numero_serie: str, descricao: str, revendedor_fk: int) -> 'NotaFiscal' or None:
         """Insere uma NotaFiscal na tabela nota_fiscal
         :param valor: float: valor da nota fiscal, duas casas decimais
@@ -53,13 +61,12 @@ class NotaFiscal(ModelBase):
         um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(valor, float) and not isinstance(valor, int):
                 raise TypeError('valor da NotaFiscal deve ser um número!')
             if not isinstance(numero_serie, str):
-                raise TypeError('numero_serie da NotaFiscal deve ser uma string!')
+                raise TypeError('numero_serie da Nota Fiscal deve ser uma string!')
             if not isinstance(descricao, str):
                 raise TypeError('descricao da NotaFiscal deve ser uma string!')
             if not isinstance(revendedor_fk, int):
@@ -70,7 +77,7 @@ class NotaFiscal(ModelBase):
             valor = round(float(valor), 2)
 
             if not numero_serie:
-                raise ValueError('numero_serie da NotaFiscal não informado!')
+                raise ValueError('numero_serie da Nota Fiscal não informado!')
             if not descricao:
                 raise ValueError('descricao da NotaFiscal não informada!')
 
@@ -79,20 +86,10 @@ class NotaFiscal(ModelBase):
                                      revendedor_fk=revendedor_fk)
 
             # Verificar se já existe um registro com o nome e a fórmula informados
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo NotaFiscal: {nota_fiscal}')
-                session.add(nota_fiscal)
-                await session.commit()
-
-                print(f'Nota fiscal inserida com sucesso!')
-                print(f'ID da NotaFiscal inserida: {nota_fiscal.id}')
-                print(f'valor da NotaFiscal inserida: {nota_fiscal.valor}')
-                print(f'numero_serie da NotaFiscal inserida: {nota_fiscal.numero_serie}')
-                print(f'descricao da NotaFiscal inserida: {nota_fiscal.descricao}')
-                print(f'revendedor_fk da NotaFiscal inserida: {nota_fiscal.revendedor_fk}')
-                print(f'revendedor.nome da NotaFiscal inserida: {nota_fiscal.revendedor.nome}')
-                return nota_fiscal
+            await persistir(nota_fiscal)
+            log.debug('NotaFiscal inserida: id=%s numero_serie=%s valor=%s revendedor_fk=%s',
+                      nota_fiscal.id, nota_fiscal.numero_serie, nota_fiscal.valor, nota_fiscal.revendedor_fk)
+            return nota_fiscal
         except IntegrityError as intg_error:
             if 'UNIQUE constraint failed' in str(intg_error):
                 if 'nota_fiscal.numero_serie' in str(intg_error):
@@ -111,29 +108,32 @@ class NotaFiscal(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir NotaFiscal: {exc}')
 
     @staticmethod
-    def selectAllNotasFiscal() -> List['NotaFiscal'] or []:
+    @retryTransitorio
+    async def selectAllNotasFiscal() -> List['NotaFiscal'] or []:
         """Seleciona todas as Notas Fiscais na tabela nota_fiscal
         :return: List[NotaFiscal] or []: Retorna uma lista de objetos NotaFiscal se encontrados, [] caso contrário
         :raises Exception: Se ocorrer um erro inesperado ao selecionar Notas Fiscais
         """
         try:
-            with createSession() as session:
-                notas_fiscais = session.query(NotaFiscal).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(NotaFiscal)
+                notas_fiscais = (await session.scalars(consulta)).all()
                 return notas_fiscais
 
         except Exception as e:
             raise Exception(f'Erro inesperado ao selecionar todas NotaFiscal: {e}')
 
     @staticmethod
-    def selectNotaFiscalPorId(id: int) -> 'NotaFiscal' or None:
+    @retryTransitorio
+    async def selectNotaFiscalPorId(id: int) -> 'NotaFiscal' or None:
         """Seleciona uma Nota Fiscal na tabela nota_fiscal por id
         :param id: int: id da Nota Fiscal
         :return: NotaFiscal or None: Retorna o objeto NotaFiscal se encontrado, None caso contrário
@@ -150,8 +150,9 @@ class NotaFiscal(ModelBase):
             if not id:
                 raise ValueError('id da Nota Fiscal não informado!')
 
-            with createSession() as session:
-                nota_fiscal = session.query(NotaFiscal).filter(NotaFiscal.id == id).one_or_none()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(NotaFiscal).where(NotaFiscal.id == id)
+                nota_fiscal = (await session.scalars(consulta)).one_or_none()
                 return nota_fiscal
 
         except TypeError as te:
@@ -161,10 +162,11 @@ class NotaFiscal(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar NotaFiscal: {exc}')
 
     @staticmethod
-    def selectNotaFiscalPorNumeroSerie(numero_serie: str) -> 'NotaFiscal' or None:
+    @retryTransitorio
+    async def selectNotaFiscalPorNumeroSerie(numero_serie: str) -> 'NotaFiscal' or None:
         """Seleciona uma Nota Fiscal na tabela nota_fiscal por número de série
         :param numero_serie: str: número de série da Nota Fiscal
         :return: NotaFiscal or None: Retorna o objeto NotaFiscal se encontrado, None caso contrário
@@ -178,12 +180,13 @@ class NotaFiscal(ModelBase):
                 raise TypeError('numero_serie da Nota Fiscal deve ser uma string!')
 
             # validar se os parâmetros informados são válidos
-            numero_series = numero_serie.strip().upper()
+            numero_serie = numero_serie.strip().upper()
             if not numero_serie:
                 raise ValueError('numero_serie da Nota Fiscal não informado!')
 
-            with createSession() as session:
-                nota_fiscal = session.query(NotaFiscal).filter(NotaFiscal.numero_serie == numero_serie).one_or_none()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_NOTA_FISCAL_POR_NUMERO_SERIE
+                nota_fiscal = (await session.scalars(consulta, {'numero_serie': numero_serie})).one_or_none()
                 return nota_fiscal
 
         except TypeError as te:
@@ -193,10 +196,47 @@ class NotaFiscal(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar NotaFiscal: {exc}')
+
+
+    @staticmethod
+    @retryTransitorio
+    async def selectCabecalhoNotaFiscalPorNumeroSerie(numero_serie: str) -> sa.RowMapping or None:
+        """Seleciona o cabeçalho de uma NotaFiscal por numero_serie. Caminho rápido para leituras frequentes: executa o
+        select() direto na conexão, sem Session, identity map e sem o join com revendedor
+        :param numero_serie: str: número de série da nota fiscal
+        :raises TypeError: Se o numero_serie não for string
+        :raises ValueError: Se o numero_serie não for informado
+        :return: RowMapping or None: Retorna id, numero_serie, valor, descricao, revendedor_fk e data_criacao se
+        encontrada, None caso contrário
+        """
+        try:
+            if not isinstance(numero_serie, str):
+                raise TypeError('numero_serie da Nota Fiscal deve ser uma string!')
+
+            # validar se os parâmetros informados são válidos; numero_serie é gravado sem espaços e em maiúsculas
+            numero_serie = numero_serie.strip().upper()
+            if not numero_serie:
+                raise ValueError('numero_serie da Nota Fiscal não informado!')
+
+            async with conexaoLeitura() as conexao:
+                resultado = await conexao.execute(_SELECT_CABECALHO_NOTA_FISCAL_POR_NUMERO_SERIE,
+                                                  {'numero_serie': numero_serie})
+                cabecalho = resultado.mappings().one_or_none()
+                return cabecalho
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except ValueError as ve:
+            raise ValueError(ve)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar cabeçalho da NotaFiscal: {exc}')
 
     @staticmethod
-    def selectNotasFiscaisPorRevendedorFk(revendedor_fk: int) -> List['NotaFiscal'] or []:
+    @retryTransitorio
+    async def selectNotasFiscaisPorRevendedorFk(revendedor_fk: int) -> List['NotaFiscal'] or []:
         """Seleciona Notas Fiscais na tabela nota_fiscal por revendedor_fk
         :param revendedor_fk: int: id do revendedor
         :return: List[NotaFiscal] or None: Retorna uma lista de objetos NotaFiscal se encontrado, None caso contrário
@@ -213,8 +253,9 @@ class NotaFiscal(ModelBase):
             if not revendedor_fk:
                 raise ValueError('revendedor_fk da Nota Fiscal não informado!')
 
-            with createSession() as session:
-                notas_fiscais = session.query(NotaFiscal).filter(NotaFiscal.revendedor_fk == revendedor_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(NotaFiscal).where(NotaFiscal.revendedor_fk == revendedor_fk)
+                notas_fiscais = (await session.scalars(consulta)).all()
                 return notas_fiscais
 
         except TypeError as te:
@@ -224,12 +265,23 @@ class NotaFiscal(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar NotaFiscal: {exc}')
 
 
     @staticmethod
-    def updateNotaFiscal(id_nf: int, valor: Union[float, None], revendedor_fk: Union[int, None],
-                         numero_serie: str = '', descricao: str = '') -> 'NotaFiscal':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'NotaFiscal']:
+        """Seleciona vários NotaFiscal por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de NotaFiscal, repetições são ignoradas
+        :return: dict[int, NotaFiscal]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(NotaFiscal, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateNotaFiscal(id_nf: int, valor: Union[float, None], revendedor_fk: Union[int, None],
+                               numero_serie: str = '', descricao: str = '') -> 'NotaFiscal':
         """Atualiza uma NotaFiscal na tabela nota_fiscal
         :param id: int: id da NotaFiscal
         :param valor: float: valor da nota fiscal, duas casas decimais
@@ -250,7 +302,7 @@ class NotaFiscal(ModelBase):
             if not isinstance(valor, float) and not isinstance(valor, int):
                 raise TypeError('valor da NotaFiscal deve ser um número ou não deve informado!')
             if not isinstance(numero_serie, str):
-                raise TypeError('numero_serie da NotaFiscal deve ser uma string!')
+                raise TypeError('numero_serie da Nota Fiscal deve ser uma string!')
             if not isinstance(descricao, str):
                 raise TypeError('descricao da NotaFiscal deve ser uma string!')
             if not isinstance(revendedor_fk, int):
@@ -266,8 +318,9 @@ class NotaFiscal(ModelBase):
             descricao = descricao.strip().upper()
             valor = round(float(valor), 2) if valor else None
 
-            with createSession() as session:
-                nota_fiscal = session.query(NotaFiscal).filter_by(id=id_nf).first()
+            async with sessionScope() as session:
+                consulta = sa.select(NotaFiscal).where(NotaFiscal.id == id_nf)
+                nota_fiscal = (await session.scalars(consulta)).first()
 
                 if not nota_fiscal:
                     raise ValueError(f'Nota Fiscal com id={id_nf} não cadastrada na base!')
@@ -288,7 +341,7 @@ class NotaFiscal(ModelBase):
                 else:
                     revendedor_fk = nota_fiscal.revendedor_fk
 
-                session.commit()
+                await session.flush()
                 return nota_fiscal
 
         except IntegrityError as intg_error:
@@ -313,48 +366,72 @@ class NotaFiscal(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Ingrediente: {exp}')
 
     @staticmethod
-    def deleteNotaFiscalById(id_nota_fiscal: int) -> 'NotaFiscal':
-        """Deleta um NotaFiscal cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteNotaFiscalById(id_nota_fiscal: int) -> int:
+        """Deleta um NotaFiscal cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_nota_fiscal: int: identificador do NotaFiscal
-        :return: NotaFiscal: Retorna o objeto NotaFiscal deletado
+        :return: int: Retorna o id do NotaFiscal deletado
         :raises TypeError: Se o id_nota_fiscal não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o NotaFiscal, especificado para o
-        id_nota_fiscal, caso o NotaFiscal esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :raises RuntimeError: Se o NotaFiscal estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o NotaFiscal não for encontrado na base
         """
         try:
             if not isinstance(id_nota_fiscal, int):
                 raise TypeError('id_nota_fiscal do NotaFiscal deve ser um inteiro!')
 
-            with createSession() as session:
-                inota_fiscal: NotaFiscal = session.query(NotaFiscal). \
-                    filter_by(id=id_nota_fiscal).first()
+            return await DataBaseFeatures.deleteById(model=NotaFiscal, id=id_nota_fiscal)
 
-                if not inota_fiscal:
-                    raise ValueError(f'NotaFiscal com id={id_nota_fiscal} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(inota_fiscal)
-                session.commit()
-                return inota_fiscal
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar NotaFiscal: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários NotaFiscal em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de NotaFiscal
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum NotaFiscal estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(NotaFiscal, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de NotaFiscal que atendem aos filtros informados, ex.: NotaFiscal.revendedor_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum NotaFiscal estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(NotaFiscal, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=NotaFiscal.__tablename__)
-                raise RuntimeError(f'NotaFiscal com id={id_nota_fiscal} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar NotaFiscal: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar NotaFiscal: {exc}')
+# índice de cobertura dos relatórios por período (ScriptsAuxiliares/Relatorios.py): a receita por revendedor e as notas
+# por dia são calculadas somente com o índice, sem ler as linhas da tabela
+sa.Index('ix_nota_fiscal_data_criacao_revendedor_fk_valor',
+         NotaFiscal.data_criacao, NotaFiscal.revendedor_fk, NotaFiscal.valor)
+
+
+# consulta de NotaFiscal.selectNotaFiscalPorNumeroSerie, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_NOTA_FISCAL_POR_NUMERO_SERIE = sa.select(NotaFiscal).where(NotaFiscal.numero_serie == sa.bindparam('numero_serie'))
+
+# consulta Core de NotaFiscal.selectCabecalhoNotaFiscalPorNumeroSerie, somente as colunas da própria tabela
+_tabela_nota_fiscal = NotaFiscal.__table__
+_SELECT_CABECALHO_NOTA_FISCAL_POR_NUMERO_SERIE = sa.select(
+    _tabela_nota_fiscal.c.id,
+    _tabela_nota_fiscal.c.numero_serie,
+    _tabela_nota_fiscal.c.valor,
+    _tabela_nota_fiscal.c.descricao,
+    _tabela_nota_fiscal.c.revendedor_fk,
+    _tabela_nota_fiscal.c.data_criacao,
+).where(_tabela_nota_fiscal.c.numero_serie == sa.bindparam('numero_serie'))
 
 
 if __name__ == '__main__':
@@ -376,7 +453,7 @@ if __name__ == '__main__':
     #     print(f'Erro ao inserir Nota Fiscal: {e}')
 
     try:
-        nota_fiscal = NotaFiscal.deleteNotaFiscalById(id_nota_fiscal='201')
+        nota_fiscal = asyncio.run(NotaFiscal.deleteNotaFiscalById(id_nota_fiscal='201'))
         print(f'Nota Fiscal deletada: {nota_fiscal}')
     except Exception as e:
         print(f'Erro ao deletar Nota Fiscal: {e}')
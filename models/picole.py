@@ -1,4 +1,5 @@
 import asyncio
+from collections import defaultdict
 from typing import Union
 
 import sqlalchemy as sa
@@ -8,12 +9,28 @@ from models.model_base import ModelBase
 from models.sabor import Sabor
 from models.tipo_picole import TipoPicole
 from models.tipo_embalagem import TipoEmbalagem
-from conf.db_session import createSession
+from models.ingrediente import Ingrediente
+from models.conservante import Conservante
+from models.aditivo_nutritivo import AditivoNutritivo
+from conf.db_session import sessionScope, conexaoLeitura
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('picole')
+
+
 class Picole(ModelBase):
+    """Classe que representa a tabela 'picole' no banco de dados.
+    As coleções da composição (ingredientes, conservantes e aditivos_nutritivos) usam lazy='raise', e não
+    lazy='selectin': por decisão deliberada, uma consulta comum de Picole não as carrega, e acessá-las sem carregar
+    levanta InvalidRequestError. Para ter a composição, use selectComposicaoPicoles (4 consultas para N picolés),
+    selectPicolePorId(id, composicao=True) ou .options(*opcoesComposicao()) em uma consulta própria.
+    """
     __tablename__ = 'picole'
 
     id: int = sa.Column(sa.BigInteger().with_variant(sa.Integer, "sqlite"),  # para funcionar o autoincrement no sqlite
@@ -37,6 +54,18 @@ class Picole(ModelBase):
                                     nullable=False)
     tipo_picole: TipoPicole = orm.relationship('TipoPicole', lazy='joined')
 
+    # composição do picolé, através das tabelas de associação. Somente leitura: as associações são gravadas pelos
+    # models IngredientePicole, ConservantePicole e AditivoNutritivoPicole, que têm colunas próprias.
+    # lazy='raise' no lugar do selectin, ver a docstring da classe: o selectin custava 3 consultas a mais em toda
+    # consulta de Picole, inclusive nas que não usam a composição.
+    ingredientes: list[Ingrediente] = orm.relationship('Ingrediente', secondary='ingrediente_picole',
+                                                       lazy='raise', viewonly=True)
+    conservantes: list[Conservante] = orm.relationship('Conservante', secondary='conservante_picole',
+                                                       lazy='raise', viewonly=True)
+    aditivos_nutritivos: list[AditivoNutritivo] = orm.relationship('AditivoNutritivo',
+                                                                   secondary='aditivo_nutritivo_picole',
+                                                                   lazy='raise', viewonly=True)
+
     # chave forte para evitar duplicidades
     # chave forte para imedir se ser inserido o mesmo par de lote e nota fiscal
     sabor_tipoPicole_tipoEmbalagem: str = sa.Column(sa.String(200),
@@ -60,6 +89,7 @@ class Picole(ModelBase):
 
 
     @staticmethod
+    @retryTransitorio
     async def insertPicole(preco: float, sabor_fk: int, tipo_embalagem_fk: int, tipo_picole_fk: int) -> 'Picole' or None:
         """Insere um Picole na tabela picole
         :param preco: float: preço do picolé
@@ -73,7 +103,6 @@ class Picole(ModelBase):
         integridade, caso contrário, retorna um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(preco, float) and not isinstance(preco, int):
@@ -96,19 +125,9 @@ class Picole(ModelBase):
             picole = Picole(preco=preco, sabor_fk=sabor_fk, tipo_embalagem_fk=tipo_embalagem_fk,
                             tipo_picole_fk=tipo_picole_fk)
             picole.sabor_tipoPicole_tipoEmbalagem = f'{picole.sabor_fk}_{picole.tipo_picole_fk}_{picole.tipo_embalagem_fk}'
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo Picole: {picole}')
-                session.add(picole)
-                await session.commit()
-
-                print(f'Picole inserido com sucesso!')
-                print(f'ID do Pciole inserido: {picole.id}')
-                print(f'preco do Picole inserido: {picole.preco}')
-                print(f'sabor do Picole inserido: {picole.sabor.nome}')
-                print(f'tipo_embalagem do Picole inserido: {picole.tipo_embalagem.nome}')
-                print(f'tipo_picole do Picole inserido: {picole.tipo_picole.nome}')
-
+            await persistir(picole)
+            log.debug('Picole inserido: id=%s preco=%s sabor_fk=%s tipo_embalagem_fk=%s tipo_picole_fk=%s',
+                      picole.id, picole.preco, picole.sabor_fk, picole.tipo_embalagem_fk, picole.tipo_picole_fk)
             return picole
         except IntegrityError as e:
             if 'FOREIGN KEY constraint failed' in str(e):
@@ -123,31 +142,36 @@ class Picole(ModelBase):
         except TypeError as te:
             raise TypeError(te)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir Picole: {exc}')
 
     @staticmethod
-    def selectAllPicoles() -> list['Picole'] or []:
+    @retryTransitorio
+    async def selectAllPicoles() -> list['Picole'] or []:
         """Seleciona todos os Picoles na tabela picole
         :raises Exception: Informa erro inesperado ao selecionar Picoles
         :return: list[Picole] or []: Retorna uma lista de objetos Picole se encontrado, [] caso contrário
         """
         try:
-            with createSession() as session:
-                picoles = session.query(Picole).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Picole)
+                picoles = (await session.scalars(consulta)).all()
                 return picoles
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos Picole: {exc}')
 
     @staticmethod
-    def selectPicolePorId(id: int) -> 'Picole' or None:
+    @retryTransitorio
+    async def selectPicolePorId(id: int, composicao: bool = False) -> 'Picole' or None:
         """Seleciona um Picole na tabela picole por id
         :param id: int: id do picolé
+        :param composicao: bool: se True, carrega também os ingredientes, conservantes e aditivos nutritivos, com uma
+            consulta adicional para cada coleção
         :return: Picole or None: Retorna o objeto Picole se encontrado, None caso contrário
         :raises TypeError: Se o id não for um inteiro
         :raises ValueError: Se o id não for informado
@@ -161,8 +185,11 @@ class Picole(ModelBase):
             if not id:
                 raise ValueError('id do Picole não informado!')
 
-            with createSession() as session:
-                picole = session.query(Picole).filter(Picole.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_PICOLE_POR_ID
+                if composicao:
+                    consulta = consulta.options(*opcoesComposicao())
+                picole = (await session.scalars(consulta, {'id': id})).first()
                 return picole
 
         except TypeError as te:
@@ -172,10 +199,43 @@ class Picole(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Picole: {exc}')
+
+
+    @staticmethod
+    @retryTransitorio
+    async def selectPrecoPicolePorId(id: int) -> float or None:
+        """Seleciona somente o preço de um Picole por id. Caminho rápido para leituras frequentes: executa o select()
+        direto na conexão, sem Session, identity map ou carga dos relacionamentos
+        :param id: int: id do picolé
+        :raises TypeError: Se o id não for um inteiro
+        :raises ValueError: Se o id não for informado
+        :return: float or None: Retorna o preço do Picole se encontrado, None caso contrário
+        """
+        try:
+            if not isinstance(id, int):
+                raise TypeError('id do Picole deve ser um inteiro!')
+
+            # validar se os parâmetros informados são válidos
+            if not id:
+                raise ValueError('id do Picole não informado!')
+
+            async with conexaoLeitura() as conexao:
+                preco = (await conexao.execute(_SELECT_PRECO_PICOLE_POR_ID, {'id': id})).scalar_one_or_none()
+                return preco
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except ValueError as ve:
+            raise ValueError(ve)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar preço do Picole: {exc}')
 
     @staticmethod
-    def selectPicolePorSabor(sabor_fk: int) -> list['Picole'] or []:
+    @retryTransitorio
+    async def selectPicolePorSabor(sabor_fk: int) -> list['Picole'] or []:
         """Seleciona Picoles na tabela picole por sabor
         :param sabor_fk: int: id do sabor
         :raises TypeError: Se o sabor_fk não for um inteiro
@@ -190,8 +250,9 @@ class Picole(ModelBase):
             if not sabor_fk:
                 raise ValueError('sabor_fk do Picole não informado!')
 
-            with createSession() as session:
-                picoles = session.query(Picole).filter(Picole.sabor_fk == sabor_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Picole).where(Picole.sabor_fk == sabor_fk)
+                picoles = (await session.scalars(consulta)).all()
                 return picoles
 
         except TypeError as te:
@@ -201,10 +262,11 @@ class Picole(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Picole: {exc}')
 
     @staticmethod
-    def selectPicolesPorTipoEmbalagem(tipo_embalagem_fk: int) -> list['Picole'] or []:
+    @retryTransitorio
+    async def selectPicolesPorTipoEmbalagem(tipo_embalagem_fk: int) -> list['Picole'] or []:
         """Seleciona Picoles na tabela picole por tipo de embalagem
         :param tipo_embalagem_fk: int: id do tipo de embalagem
         :raises TypeError: Se o tipo_embalagem_fk não for um inteiro
@@ -219,8 +281,9 @@ class Picole(ModelBase):
             if not tipo_embalagem_fk:
                 raise ValueError('tipo_embalagem_fk do Picole não informado!')
 
-            with createSession() as session:
-                picoles = session.query(Picole).filter(Picole.tipo_embalagem_fk == tipo_embalagem_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Picole).where(Picole.tipo_embalagem_fk == tipo_embalagem_fk)
+                picoles = (await session.scalars(consulta)).all()
                 return picoles
 
         except TypeError as te:
@@ -230,10 +293,11 @@ class Picole(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Picole: {exc}')
 
     @staticmethod
-    def selectPicolesPorTipoPicole(tipo_picole_fk: int) -> list['Picole'] or []:
+    @retryTransitorio
+    async def selectPicolesPorTipoPicole(tipo_picole_fk: int) -> list['Picole'] or []:
         """Seleciona Picoles na tabela picole por tipo de picolé
         :param tipo_picole_fk: int: id do tipo de picolé
         :raises TypeError: Se o tipo_picole_fk não for um inteiro
@@ -248,8 +312,9 @@ class Picole(ModelBase):
             if not tipo_picole_fk:
                 raise ValueError('tipo_picole_fk do Picole não informado!')
 
-            with createSession() as session:
-                picoles = session.query(Picole).filter(Picole.tipo_picole_fk == tipo_picole_fk).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Picole).where(Picole.tipo_picole_fk == tipo_picole_fk)
+                picoles = (await session.scalars(consulta)).all()
                 return picoles
 
         except TypeError as te:
@@ -259,12 +324,70 @@ class Picole(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Picole: {exc}')
 
 
     @staticmethod
-    def updatePicole(id_picole: int, preco: Union[float, None], sabor_fk: [int, None],
-                     tipo_embalagem_fk: Union[float, None], tipo_picole_fk: Union[float, None]) -> 'Picole':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'Picole']:
+        """Seleciona vários Picole por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de Picole, repetições são ignoradas
+        :return: dict[int, Picole]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(Picole, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def selectComposicaoPicoles(ids: list[int]) -> dict[int, 'Picole']:
+        """Seleciona vários Picole por id com a composição completa (ingredientes, conservantes e aditivos nutritivos),
+        sempre em 4 consultas, qualquer que seja a quantidade de picolés: uma para os picolés, com sabor, tipo de
+        embalagem e tipo de picolé, e uma para cada coleção. Os ids vão em um único parâmetro, sem blocos.
+        :param ids: list[int]: ids dos picolés, repetições são ignoradas
+        :return: dict[int, Picole]: picolés encontrados por id, com as coleções carregadas
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        from models.ingrediente_picole import IngredientePicole
+        from models.conservante_picole import ConservantePicole
+        from models.aditivo_nutritivo_picole import AditivoNutritivoPicole
+
+        ids = list(dict.fromkeys(ids))
+        if not all(isinstance(id_, int) for id_ in ids):
+            raise TypeError('ids do Picole devem ser inteiros!')
+        if not ids:
+            return {}
+
+        colecoes = (
+            ('ingredientes', IngredientePicole, IngredientePicole.ingrediente_fk, Ingrediente),
+            ('conservantes', ConservantePicole, ConservantePicole.conservante_fk, Conservante),
+            ('aditivos_nutritivos', AditivoNutritivoPicole, AditivoNutritivoPicole.aditivo_nutritivo_fk,
+             AditivoNutritivo),
+        )
+
+        async with sessionScope(savepoint=False) as session:
+            dialeto = (await session.connection()).dialect.name
+
+            # as coleções são carregadas pelas consultas abaixo, e não pelo selectinload, que quebra os ids em blocos
+            consulta = sa.select(Picole).where(DataBaseFeatures.filtroIdsParametroUnico(Picole.id, ids, dialeto))
+            picoles = {picole.id: picole for picole in (await session.scalars(consulta)).unique()}
+
+            for nome, associacao, fk_item, model_item in colecoes:
+                consulta = (sa.select(associacao.picole_fk, model_item)
+                            .join(model_item, model_item.id == fk_item)
+                            .where(DataBaseFeatures.filtroIdsParametroUnico(associacao.picole_fk, ids, dialeto))
+                            .order_by(associacao.id))
+                itens = defaultdict(list)
+                for picole_fk, item in (await session.execute(consulta)).all():
+                    itens[picole_fk].append(item)
+                for id_, picole in picoles.items():
+                    orm.attributes.set_committed_value(picole, nome, itens.get(id_, []))
+
+        return picoles
+
+    @staticmethod
+    @retryTransitorio
+    async def updatePicole(id_picole: int, preco: Union[float, None], sabor_fk: [int, None],
+                           tipo_embalagem_fk: Union[float, None], tipo_picole_fk: Union[float, None]) -> 'Picole':
         """Atualiza um Picole na tabela picole
         :param id_picole: int: id do picolé
         :param preco: float: preço do picolé
@@ -300,8 +423,9 @@ class Picole(ModelBase):
 
             preco = round(float(preco), 2) if preco else None
 
-            with createSession() as session:
-                picole = session.query(Picole).filter(Picole.id == id_picole).first()
+            async with sessionScope() as session:
+                consulta = sa.select(Picole).where(Picole.id == id_picole)
+                picole = (await session.scalars(consulta)).first()
                 if not picole:
                     raise ValueError(f'Picole com id={id_picole} não cadastrado na base!')
 
@@ -325,7 +449,7 @@ class Picole(ModelBase):
 
                 picole.sabor_tipoPicole_tipoEmbalagem = f'{picole.sabor_fk}_{picole.tipo_picole_fk}_{picole.tipo_embalagem_fk}'
                 picole.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return picole
 
         except IntegrityError as e:
@@ -348,48 +472,68 @@ class Picole(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Lote: {exc}')
 
     @staticmethod
-    def deletePicoleById(id_picole: int) -> 'Picole':
-        """Deleta um Picole cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deletePicoleById(id_picole: int) -> int:
+        """Deleta um Picole cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_picole: int: identificador do Picole
-        :return: Picole: Retorna o objeto Picole deletado
+        :return: int: Retorna o id do Picole deletado
         :raises TypeError: Se o id_picole não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o Picole, especificado para o
-        id_picole, caso o Picole esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :raises RuntimeError: Se o Picole estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o Picole não for encontrado na base
         """
         try:
             if not isinstance(id_picole, int):
                 raise TypeError('id_picole do Picole deve ser um inteiro!')
 
-            with createSession() as session:
-                picole: Picole = session.query(Picole). \
-                    filter_by(id=id_picole).first()
+            return await DataBaseFeatures.deleteById(model=Picole, id=id_picole)
 
-                if not picole:
-                    raise ValueError(f'Picole com id={id_picole} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(picole)
-                session.commit()
-                return picole
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar Picole: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários Picole em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de Picole
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum Picole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(Picole, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de Picole que atendem aos filtros informados, ex.: Picole.sabor_fk == 1
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum Picole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(Picole, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=Picole.__tablename__)
-                raise RuntimeError(f'Picole com id={id_picole} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar Picole: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar Picole: {exc}')
+def opcoesComposicao() -> tuple:
+    """Opções que carregam a composição do picolé em consultas de Picole, com uma consulta IN para cada coleção, ex.:
+    sa.select(Picole).where(...).options(*opcoesComposicao()). Montadas a cada chamada, e não na importação do
+    módulo: o selectinload configura os mappers, o que exige todos os models importados.
+    :return: tuple: opções selectinload das três coleções
+    """
+    return (orm.selectinload(Picole.ingredientes), orm.selectinload(Picole.conservantes),
+            orm.selectinload(Picole.aditivos_nutritivos))
+
+
+# consulta de Picole.selectPicolePorId, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_PICOLE_POR_ID = sa.select(Picole).where(Picole.id == sa.bindparam('id'))
+
+# consulta Core de Picole.selectPrecoPicolePorId, somente a coluna preco
+_SELECT_PRECO_PICOLE_POR_ID = sa.select(Picole.__table__.c.preco).where(Picole.__table__.c.id == sa.bindparam('id'))
 
 
 if __name__ == '__main__':
@@ -409,7 +553,7 @@ if __name__ == '__main__':
     #     print(f'Erro ao inserir Picole: {e}')
 
     try:
-        picole = Picole.deletePicoleById(id_picole=133)
+        picole = asyncio.run(Picole.deletePicoleById(id_picole=133))
         print(f'Picole deletado: {picole}')
     except Exception as e:
         print(f'Erro ao deletar Picole: {e}')
\ No newline at end of file
@@ -0,0 +1,232 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+import sqlalchemy as sa
+from models.model_base import ModelBase
+from models.picole import Picole
+from models.sabor import Sabor
+from models.tipo_embalagem import TipoEmbalagem
+from models.tipo_picole import TipoPicole
+from models.ingrediente import Ingrediente
+from models.conservante import Conservante
+from models.aditivo_nutritivo import AditivoNutritivo
+from models.ingrediente_picole import IngredientePicole
+from models.conservante_picole import ConservantePicole
+from models.aditivo_nutritivo_picole import AditivoNutritivoPicole
+from conf.db_session import sessionScope
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+# Este módulo é responsável pelo catálogo de picolés, uma tabela somente de leitura com uma linha por picolé, já com
+# os nomes do sabor, do tipo de embalagem e do tipo de picolé, o preço e as listas de nomes dos ingredientes,
+# conservantes e aditivos nutritivos em JSON. A página de catálogo lê tudo com uma única consulta, sem joins.
+#
+# No sqlite a tabela é mantida por triggers, criados junto com as tabelas (createTables) ou por rebuildCatalogo: toda
+# alteração em picole, nas tabelas de associação ou nos nomes de sabor, tipo_embalagem, tipo_picole, ingrediente,
+# conservante e aditivo_nutritivo atualiza somente as linhas afetadas, qualquer que seja o caminho da escrita (models,
+# deletes em lote, WriteBatcher, SqliteWriter ou outro processo).
+# Nos demais bancos, ou para recuperar um catálogo inconsistente, PicoleCatalog.rebuildCatalogo() recria a tabela
+# inteira a partir das tabelas de origem:
+#     python rebuild_catalog_main.py
+# Nos demais bancos o catálogo não acompanha as escritas entre uma reconstrução e outra: a criação das tabelas e a
+# primeira leitura do catálogo no processo registram um aviso no log (DataBaseFeatures.avisarSemTriggers).
+
+log = getLogger('picole_catalog')
+
+TABELA_CATALOGO = 'picole_catalog'
+# comando que recria o catálogo nos bancos sem os triggers, ver o comentário acima
+REBUILD_CATALOGO = 'python rebuild_catalog_main.py'
+
+
+class PicoleCatalog(ModelBase):
+    __tablename__ = TABELA_CATALOGO
+
+    # sem FK para picole: o catálogo não pode impedir a exclusão de um picolé
+    picole_id: int = sa.Column(sa.BigInteger().with_variant(sa.Integer, "sqlite"), primary_key=True,
+                               autoincrement=False)
+    preco: float = sa.Column(sa.DECIMAL(decimal_return_scale=2).with_variant(sa.Float(), "sqlite"), nullable=False)
+    sabor: str = sa.Column(sa.String(45), nullable=False, index=True)
+    tipo_embalagem: str = sa.Column(sa.String(45), nullable=False)
+    tipo_picole: str = sa.Column(sa.String(45), nullable=False)
+    ingredientes: list = sa.Column(sa.JSON, nullable=False, default=list)
+    conservantes: list = sa.Column(sa.JSON, nullable=False, default=list)
+    aditivos_nutritivos: list = sa.Column(sa.JSON, nullable=False, default=list)
+    data_atualizacao: datetime = sa.Column(sa.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        """Retorna uma representação do objeto em forma de 'string'."""
+        return f'<PicoleCatalog(picole_id={self.picole_id}, sabor={self.sabor}, preco={self.preco})>'
+
+    @staticmethod
+    @retryTransitorio
+    async def selectCatalogo() -> list['PicoleCatalog'] or []:
+        """Seleciona o catálogo completo, ordenado pelo id do picolé, com uma única consulta
+        :return: list[PicoleCatalog] or []: Retorna uma lista de objetos PicoleCatalog, [] se o catálogo estiver vazio
+        """
+        try:
+            async with sessionScope(savepoint=False) as session:
+                DataBaseFeatures.avisarSemTriggers(TABELA_CATALOGO, session.get_bind().dialect.name, REBUILD_CATALOGO)
+                consulta = sa.select(PicoleCatalog).order_by(PicoleCatalog.picole_id)
+                catalogo = (await session.scalars(consulta)).all()
+                return catalogo
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar PicoleCatalog: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def selectCatalogoPorSabor(sabor: str) -> list['PicoleCatalog'] or []:
+        """Seleciona as linhas do catálogo de um sabor, pelo índice da coluna sabor
+        :param sabor: str: nome do sabor
+        :raises TypeError: Se o sabor não for string
+        :raises ValueError: Se o sabor não for informado
+        :return: list[PicoleCatalog] or []: Retorna uma lista de objetos PicoleCatalog, [] se não houver picolés
+        """
+        try:
+            if not isinstance(sabor, str):
+                raise TypeError('sabor do PicoleCatalog deve ser uma string!')
+
+            sabor = sabor.strip().upper()
+            if not sabor:
+                raise ValueError('sabor do PicoleCatalog não informado!')
+
+            async with sessionScope(savepoint=False) as session:
+                DataBaseFeatures.avisarSemTriggers(TABELA_CATALOGO, session.get_bind().dialect.name, REBUILD_CATALOGO)
+                consulta = sa.select(PicoleCatalog).where(PicoleCatalog.sabor == sabor)
+                catalogo = (await session.scalars(consulta)).all()
+                return catalogo
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except ValueError as ve:
+            raise ValueError(ve)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar PicoleCatalog: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def rebuildCatalogo() -> int:
+        """Recria o catálogo inteiro a partir das tabelas de origem, em uma única transação. No sqlite, também cria a
+        tabela e os triggers de manutenção, caso o banco seja anterior ao catálogo.
+        :return: int: quantidade de picolés no catálogo
+        """
+        async with sessionScope() as session:
+            conexao = await session.connection()
+            await conexao.run_sync(lambda conn: PicoleCatalog.__table__.create(conn, checkfirst=True))
+            if conexao.dialect.name == 'sqlite':
+                for ddl in _ddlTriggersCatalogo():
+                    await conexao.exec_driver_sql(ddl)
+
+            consulta = (sa.select(Picole.id, Picole.preco,
+                                  Sabor.nome.label('sabor'),
+                                  TipoEmbalagem.nome.label('tipo_embalagem'),
+                                  TipoPicole.nome.label('tipo_picole'))
+                        .join(Sabor, Sabor.id == Picole.sabor_fk)
+                        .join(TipoEmbalagem, TipoEmbalagem.id == Picole.tipo_embalagem_fk)
+                        .join(TipoPicole, TipoPicole.id == Picole.tipo_picole_fk))
+            picoles = (await conexao.execute(consulta)).all()
+
+            nomes = {}
+            for coluna, associacao, fk_item, model_item in _COLECOES:
+                consulta = (sa.select(associacao.picole_fk, model_item.nome)
+                            .join(model_item, model_item.id == fk_item)
+                            .order_by(associacao.id))
+                nomes[coluna] = defaultdict(list)
+                for picole_fk, nome in (await conexao.execute(consulta)).all():
+                    nomes[coluna][picole_fk].append(nome)
+
+            agora = datetime.now()
+            linhas = [{'picole_id': picole.id,
+                       'preco': picole.preco,
+                       'sabor': picole.sabor,
+                       'tipo_embalagem': picole.tipo_embalagem,
+                       'tipo_picole': picole.tipo_picole,
+                       **{coluna: nomes[coluna].get(picole.id, []) for coluna, *_ in _COLECOES},
+                       'data_atualizacao': agora}
+                      for picole in picoles]
+
+            await conexao.execute(sa.delete(PicoleCatalog.__table__))
+            # blocos de linhas abaixo do limite de variáveis do sqlite (9 colunas por linha)
+            for inicio in range(0, len(linhas), 100):
+                await conexao.execute(sa.insert(PicoleCatalog.__table__), linhas[inicio:inicio + 100])
+
+        log.info('PicoleCatalog reconstruído com %s picolé(s)', len(linhas))
+        return len(linhas)
+
+
+# coluna do catálogo, tabela de associação, FK do item na associação e model do item
+_COLECOES = (
+    ('ingredientes', IngredientePicole, IngredientePicole.ingrediente_fk, Ingrediente),
+    ('conservantes', ConservantePicole, ConservantePicole.conservante_fk, Conservante),
+    ('aditivos_nutritivos', AditivoNutritivoPicole, AditivoNutritivoPicole.aditivo_nutritivo_fk, AditivoNutritivo),
+)
+
+
+def _sqlAtualizarCatalogo(filtro: str) -> str:
+    """Monta o comando que recalcula as linhas do catálogo dos picolés que atendem ao filtro (sobre o alias p)"""
+    listas = []
+    for coluna, associacao, fk_item, model_item in _COLECOES:
+        tabela_assoc = associacao.__tablename__
+        tabela_item = model_item.__tablename__
+        # a subconsulta ordenada garante a ordem de inserção das associações na lista JSON
+        listas.append(f"(SELECT json_group_array(nome) FROM (SELECT i.nome AS nome FROM {tabela_assoc} a "
+                      f"JOIN {tabela_item} i ON i.id = a.{fk_item.key} WHERE a.picole_fk = p.id ORDER BY a.id))")
+    return (f"INSERT OR REPLACE INTO {TABELA_CATALOGO} (picole_id, preco, sabor, tipo_embalagem, tipo_picole, "
+            f"ingredientes, conservantes, aditivos_nutritivos, data_atualizacao) "
+            f"SELECT p.id, p.preco, s.nome, te.nome, tp.nome, {', '.join(listas)}, datetime('now', 'localtime') "
+            f"FROM picole p "
+            f"JOIN sabor s ON s.id = p.sabor_fk "
+            f"JOIN tipo_embalagem te ON te.id = p.tipo_embalagem_fk "
+            f"JOIN tipo_picole tp ON tp.id = p.tipo_picole_fk "
+            f"WHERE {filtro};")
+
+
+def _ddlTriggersCatalogo() -> list[str]:
+    """Monta os triggers do sqlite que mantêm o catálogo atualizado a cada alteração nas tabelas de origem"""
+    triggers = {
+        'picole_insert': ('AFTER INSERT ON picole', _sqlAtualizarCatalogo('p.id = NEW.id')),
+        'picole_update': ('AFTER UPDATE ON picole', _sqlAtualizarCatalogo('p.id = NEW.id')),
+        'picole_delete': ('AFTER DELETE ON picole', f'DELETE FROM {TABELA_CATALOGO} WHERE picole_id = OLD.id;'),
+    }
+
+    for _, associacao, fk_item, model_item in _COLECOES:
+        tabela_assoc = associacao.__tablename__
+        tabela_item = model_item.__tablename__
+        triggers[f'{tabela_assoc}_insert'] = (f'AFTER INSERT ON {tabela_assoc}',
+                                              _sqlAtualizarCatalogo('p.id = NEW.picole_fk'))
+        triggers[f'{tabela_assoc}_delete'] = (f'AFTER DELETE ON {tabela_assoc}',
+                                              _sqlAtualizarCatalogo('p.id = OLD.picole_fk'))
+        triggers[f'{tabela_assoc}_update'] = (f'AFTER UPDATE ON {tabela_assoc}',
+                                              _sqlAtualizarCatalogo('p.id IN (OLD.picole_fk, NEW.picole_fk)'))
+        triggers[f'{tabela_item}_nome'] = (f'AFTER UPDATE OF nome ON {tabela_item}',
+                                           _sqlAtualizarCatalogo(f'p.id IN (SELECT picole_fk FROM {tabela_assoc} '
+                                                                 f'WHERE {fk_item.key} = NEW.id)'))
+
+    for tabela, fk in (('sabor', 'sabor_fk'), ('tipo_embalagem', 'tipo_embalagem_fk'),
+                       ('tipo_picole', 'tipo_picole_fk')):
+        triggers[f'{tabela}_nome'] = (f'AFTER UPDATE OF nome ON {tabela}', _sqlAtualizarCatalogo(f'p.{fk} = NEW.id'))
+
+    return [f'CREATE TRIGGER IF NOT EXISTS trg_{TABELA_CATALOGO}_{nome} {evento} FOR EACH ROW BEGIN {corpo} END'
+            for nome, (evento, corpo) in triggers.items()]
+
+
+@sa.event.listens_for(ModelBase.metadata, 'after_create')
+def _criarTriggersCatalogo(target, connection, **kw):
+    # os triggers dependem de todas as tabelas, por isso são criados depois do metadata inteiro
+    if TABELA_CATALOGO not in target.tables:
+        return
+    if connection.dialect.name == 'sqlite':
+        for ddl in _ddlTriggersCatalogo():
+            connection.exec_driver_sql(ddl)
+    else:
+        DataBaseFeatures.avisarSemTriggers(TABELA_CATALOGO, connection.dialect.name, REBUILD_CATALOGO)
+
+
+if __name__ == '__main__':
+    catalogo = asyncio.run(PicoleCatalog.selectCatalogo())
+    for linha in catalogo:
+        print(linha, linha.ingredientes, linha.conservantes, linha.aditivos_nutritivos)
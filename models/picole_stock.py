@@ -0,0 +1,212 @@
+import asyncio
+from datetime import datetime
+
+import sqlalchemy as sa
+from models.model_base import ModelBase
+from models.lote import Lote
+from models.lote_nota_fiscal import LoteNotaFiscal
+from conf.db_session import sessionScope, conexaoLeitura
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+# Este módulo é responsável pelo rollup do estoque por picolé: uma linha por picole_fk com a quantidade de lotes, as
+# unidades produzidas (soma dos lotes) e as unidades vendidas (soma dos lotes vinculados a uma nota fiscal). O estoque
+# de um picolé é consultado pela chave primária, sem percorrer lote e lote_nota_fiscal.
+#
+# No sqlite a tabela é mantida por triggers em lote e lote_nota_fiscal, criados junto com as tabelas, qualquer que
+# seja o caminho da escrita. A linha só existe enquanto o picolé tiver lotes.
+# Nos demais bancos, ou para corrigir divergências, PicoleStock.verificarRollup() recalcula o rollup a partir das
+# tabelas de origem e repara as linhas divergentes:
+#     python repair_rollups_main.py
+# Nos demais bancos a tabela não acompanha as escritas entre um reparo e outro: a criação das tabelas e a primeira
+# leitura do rollup no processo registram um aviso no log (DataBaseFeatures.avisarSemTriggers).
+
+log = getLogger('picole_stock')
+
+TABELA_ESTOQUE = 'picole_stock'
+# comando que recalcula o rollup nos bancos sem os triggers, ver o comentário acima
+REPARO_ROLLUP = 'python repair_rollups_main.py'
+
+
+class PicoleStock(ModelBase):
+    __tablename__ = TABELA_ESTOQUE
+
+    # sem FK para picole: o rollup não é dependente do picolé para DataBaseFeatures
+    picole_fk: int = sa.Column(sa.BigInteger().with_variant(sa.Integer, "sqlite"), primary_key=True,
+                               autoincrement=False)
+    lotes: int = sa.Column(sa.BigInteger, nullable=False)
+    unidades_produzidas: int = sa.Column(sa.BigInteger, nullable=False)
+    unidades_vendidas: int = sa.Column(sa.BigInteger, nullable=False)
+    data_atualizacao: datetime = sa.Column(sa.DateTime, nullable=False, default=datetime.now)
+
+    @property
+    def estoque(self) -> int:
+        """Unidades produzidas ainda não vendidas"""
+        return self.unidades_produzidas - self.unidades_vendidas
+
+    def __repr__(self):
+        """Retorna uma representação do objeto em forma de 'string'."""
+        return (f'<PicoleStock(picole_fk={self.picole_fk}, lotes={self.lotes}, '
+                f'unidades_produzidas={self.unidades_produzidas}, unidades_vendidas={self.unidades_vendidas})>')
+
+    @staticmethod
+    @retryTransitorio
+    async def selectEstoquePicole(picole_fk: int) -> int:
+        """Seleciona o estoque de um picolé pela chave primária do rollup
+        :param picole_fk: int: id do picolé
+        :raises TypeError: Se o picole_fk não for inteiro
+        :return: int: unidades em estoque, 0 se o picolé não tiver lotes
+        """
+        try:
+            if not isinstance(picole_fk, int):
+                raise TypeError('picole_fk do PicoleStock deve ser um inteiro!')
+
+            async with conexaoLeitura() as conexao:
+                DataBaseFeatures.avisarSemTriggers(TABELA_ESTOQUE, conexao.dialect.name, REPARO_ROLLUP)
+                estoque = (await conexao.execute(_SELECT_ESTOQUE_PICOLE, {'picole_fk': picole_fk})).scalar_one_or_none()
+            return estoque or 0
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar PicoleStock: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def selectAllEstoques() -> list['PicoleStock'] or []:
+        """Seleciona o estoque de todos os picolés com lotes
+        :return: list[PicoleStock] or []: ordenada pelo id do picolé
+        """
+        try:
+            async with sessionScope(savepoint=False) as session:
+                DataBaseFeatures.avisarSemTriggers(TABELA_ESTOQUE, session.get_bind().dialect.name, REPARO_ROLLUP)
+                estoques = (await session.scalars(sa.select(PicoleStock).order_by(PicoleStock.picole_fk))).all()
+                return estoques
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar PicoleStock: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def verificarRollup(reparar: bool = True) -> int:
+        """Recalcula o estoque a partir de lote e lote_nota_fiscal e compara com o rollup. No sqlite, também cria a
+        tabela e os triggers de manutenção, caso o banco seja anterior ao rollup.
+        :param reparar: bool: se True, corrige as linhas divergentes, na mesma transação
+        :return: int: quantidade de linhas divergentes (faltando, sobrando ou com valores diferentes)
+        """
+        async with sessionScope() as session:
+            conexao = await session.connection()
+            await conexao.run_sync(lambda conn: PicoleStock.__table__.create(conn, checkfirst=True))
+            if conexao.dialect.name == 'sqlite':
+                for ddl in _ddlTriggersEstoque():
+                    await conexao.exec_driver_sql(ddl)
+
+            vendidas = (sa.select(Lote.picole_fk, sa.func.sum(Lote.quantidade).label('unidades'))
+                        .join(LoteNotaFiscal, LoteNotaFiscal.lote_fk == Lote.id)
+                        .group_by(Lote.picole_fk)
+                        .subquery())
+            produzidas = (sa.select(Lote.picole_fk, sa.func.count().label('lotes'),
+                                    sa.func.sum(Lote.quantidade).label('unidades'))
+                          .group_by(Lote.picole_fk)
+                          .subquery())
+            consulta = (sa.select(produzidas.c.picole_fk, produzidas.c.lotes, produzidas.c.unidades,
+                                  sa.func.coalesce(vendidas.c.unidades, 0))
+                        .outerjoin(vendidas, vendidas.c.picole_fk == produzidas.c.picole_fk))
+            esperado = {picole_fk: tuple(valores) for picole_fk, *valores in (await conexao.execute(consulta)).all()}
+
+            tabela = PicoleStock.__table__
+            consulta = sa.select(tabela.c.picole_fk, tabela.c.lotes, tabela.c.unidades_produzidas,
+                                 tabela.c.unidades_vendidas)
+            atual = {picole_fk: tuple(valores) for picole_fk, *valores in (await conexao.execute(consulta)).all()}
+
+            # ordenadas, para que o reparo grave as linhas sempre na mesma ordem
+            divergentes = sorted(chave for chave in esperado.keys() | atual.keys()
+                                 if esperado.get(chave) != atual.get(chave))
+            if divergentes:
+                log.warning('PicoleStock: %s linha(s) divergente(s)%s', len(divergentes),
+                            ', reparando' if reparar else '')
+
+            if reparar and divergentes:
+                for inicio in range(0, len(divergentes), 900):
+                    await conexao.execute(sa.delete(tabela).where(tabela.c.picole_fk.in_(divergentes[inicio:inicio + 900])))
+                agora = datetime.now()
+                linhas = [{'picole_fk': picole_fk, 'lotes': esperado[picole_fk][0],
+                           'unidades_produzidas': esperado[picole_fk][1], 'unidades_vendidas': esperado[picole_fk][2],
+                           'data_atualizacao': agora}
+                          for picole_fk in divergentes if picole_fk in esperado]
+                for inicio in range(0, len(linhas), 150):
+                    await conexao.execute(sa.insert(tabela), linhas[inicio:inicio + 150])
+
+        return len(divergentes)
+
+
+# consulta Core de PicoleStock.selectEstoquePicole, somente pela chave primária
+_tabela_estoque = PicoleStock.__table__
+_SELECT_ESTOQUE_PICOLE = sa.select(
+    _tabela_estoque.c.unidades_produzidas - _tabela_estoque.c.unidades_vendidas
+).where(_tabela_estoque.c.picole_fk == sa.bindparam('picole_fk'))
+
+
+def _sqlSomarLote(linha: str) -> str:
+    """Soma o lote da linha (NEW) ao picolé, inclusive as unidades já vendidas, criando a linha do rollup se necessário"""
+    return (f"INSERT INTO {TABELA_ESTOQUE} (picole_fk, lotes, unidades_produzidas, unidades_vendidas, "
+            f"data_atualizacao) "
+            f"VALUES ({linha}.picole_fk, 1, {linha}.quantidade, "
+            f"{linha}.quantidade * (SELECT count(*) FROM lote_nota_fiscal WHERE lote_fk = {linha}.id), "
+            f"datetime('now', 'localtime')) "
+            f"ON CONFLICT (picole_fk) DO UPDATE SET lotes = lotes + 1, "
+            f"unidades_produzidas = unidades_produzidas + excluded.unidades_produzidas, "
+            f"unidades_vendidas = unidades_vendidas + excluded.unidades_vendidas, "
+            f"data_atualizacao = excluded.data_atualizacao;")
+
+
+def _sqlSubtrairLote(linha: str) -> str:
+    """Subtrai o lote da linha (OLD) do picolé, removendo a linha do rollup que ficar sem lotes"""
+    return (f"UPDATE {TABELA_ESTOQUE} SET lotes = lotes - 1, "
+            f"unidades_produzidas = unidades_produzidas - {linha}.quantidade, "
+            f"unidades_vendidas = unidades_vendidas - "
+            f"{linha}.quantidade * (SELECT count(*) FROM lote_nota_fiscal WHERE lote_fk = {linha}.id), "
+            f"data_atualizacao = datetime('now', 'localtime') WHERE picole_fk = {linha}.picole_fk; "
+            f"DELETE FROM {TABELA_ESTOQUE} WHERE picole_fk = {linha}.picole_fk AND lotes <= 0;")
+
+
+def _sqlVenda(linha: str, sinal: str) -> str:
+    """Soma (+) ou subtrai (-) das unidades vendidas do picolé as unidades do lote vinculado pela linha de
+    lote_nota_fiscal"""
+    return (f"UPDATE {TABELA_ESTOQUE} SET "
+            f"unidades_vendidas = unidades_vendidas {sinal} (SELECT quantidade FROM lote WHERE id = {linha}.lote_fk), "
+            f"data_atualizacao = datetime('now', 'localtime') "
+            f"WHERE picole_fk = (SELECT picole_fk FROM lote WHERE id = {linha}.lote_fk);")
+
+
+def _ddlTriggersEstoque() -> list[str]:
+    """Monta os triggers do sqlite que mantêm o rollup a cada alteração em lote e lote_nota_fiscal"""
+    triggers = {
+        'lote_insert': ('AFTER INSERT ON lote', _sqlSomarLote('NEW')),
+        'lote_update': ('AFTER UPDATE OF picole_fk, quantidade ON lote',
+                        _sqlSomarLote('NEW') + ' ' + _sqlSubtrairLote('OLD')),
+        'lote_delete': ('AFTER DELETE ON lote', _sqlSubtrairLote('OLD')),
+        'lote_nota_fiscal_insert': ('AFTER INSERT ON lote_nota_fiscal', _sqlVenda('NEW', '+')),
+        'lote_nota_fiscal_update': ('AFTER UPDATE OF lote_fk ON lote_nota_fiscal',
+                                    _sqlVenda('OLD', '-') + ' ' + _sqlVenda('NEW', '+')),
+        'lote_nota_fiscal_delete': ('AFTER DELETE ON lote_nota_fiscal', _sqlVenda('OLD', '-')),
+    }
+    return [f'CREATE TRIGGER IF NOT EXISTS trg_{TABELA_ESTOQUE}_{nome} {evento} FOR EACH ROW BEGIN {corpo} END'
+            for nome, (evento, corpo) in triggers.items()]
+
+
+@sa.event.listens_for(ModelBase.metadata, 'after_create')
+def _criarTriggersEstoque(target, connection, **kw):
+    if TABELA_ESTOQUE not in target.tables:
+        return
+    if connection.dialect.name == 'sqlite':
+        for ddl in _ddlTriggersEstoque():
+            connection.exec_driver_sql(ddl)
+    else:
+        DataBaseFeatures.avisarSemTriggers(TABELA_ESTOQUE, connection.dialect.name, REPARO_ROLLUP)
+
+
+if __name__ == '__main__':
+    print(asyncio.run(PicoleStock.verificarRollup(reparar=False)))
@@ -1,11 +1,19 @@
+import asyncio
 import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('revendedor')
+
+
 class Revendedor(ModelBase):
     __tablename__ = 'revendedor'
 
@@ -24,6 +32,7 @@ class Revendedor(ModelBase):
         return f'<Revendedor (nome={self.nome}, cnpj={self.cnpj}, razao_social={self.razao_social})>'
 
     @staticmethod
+    @retryTransitorio
     async def insertRevendedor(nome: str, cnpj: str, razao_social: str, contato: str) -> 'Revendedor' or None:
         """Insere um Revendedor na tabela revendedor
         :param nome: str: nome do revendedor
@@ -37,7 +46,6 @@ class Revendedor(ModelBase):
         seja por outro motivo, será lançado um erro genérico.
         """
 
-        session = None
         try:
             if not isinstance(nome, str):
                 raise TypeError('nome do Revendedor deve ser uma string!')
@@ -66,19 +74,8 @@ class Revendedor(ModelBase):
                 raise ValueError('contato do Revendedor não informado!')
 
             revendedor = Revendedor(nome=nome, cnpj=cnpj, razao_social=razao_social, contato=contato)
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo Revendedor: {revendedor}')
-                session.add(revendedor)
-                await session.commit()
-
-                print(f'Revendedor inserido com sucesso!')
-                print(f'ID do Revendedor inserido: {revendedor.id}')
-                print(f'Nome do Revendedor inserido: {revendedor.nome}')
-                print(f'CPNJ do Revendedor inserido: {revendedor.cnpj}')
-                print(f'Razão Social do Revendedor inserido: {revendedor.razao_social}')
-                print(f'Contato do Revendedor inserido: {revendedor.contato}')
-                print(f'Data de criação do Revendedor inserido: {revendedor.data_criacao}')
+            await persistir(revendedor)
+            log.debug('Revendedor inserido: id=%s nome=%s cnpj=%s', revendedor.id, revendedor.nome, revendedor.cnpj)
             return revendedor
 
         except IntegrityError as intg_error:
@@ -96,29 +93,32 @@ class Revendedor(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir Revendedor: {exc}')
 
     @staticmethod
-    def selectAllRevendedores() -> list['Revendedor'] or []:
+    @retryTransitorio
+    async def selectAllRevendedores() -> list['Revendedor'] or []:
         """Seleciona todos os Revendedores na tabela revendedor
         :return: list[Revendedor] or []: Retorna a lista de objetos Revendedor se encontrado, [] caso contrário
         :raises Exception: Informa erro inesperado ao selecionar Revendedores
         """
         try:
-            with createSession() as session:
-                revendedores = session.query(Revendedor).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Revendedor)
+                revendedores = (await session.scalars(consulta)).all()
                 return revendedores
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos Revendedor: {exc}')
 
     @staticmethod
-    def selectRevendedorPorId(id: int) -> 'Revendedor' or None:
+    @retryTransitorio
+    async def selectRevendedorPorId(id: int) -> 'Revendedor' or None:
         """Seleciona um Revendedor na tabela revendedor por id
         :param id: int: id do revendedor
         :return: Revendedor or None: Retorna o objeto Revendedor se encontrado, None caso contrário
@@ -132,8 +132,9 @@ class Revendedor(ModelBase):
             if not id:
                 raise ValueError('id do Revendedor não informado!')
 
-            with createSession() as session:
-                revendedor = session.query(Revendedor).filter(Revendedor.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Revendedor).where(Revendedor.id == id)
+                revendedor = (await session.scalars(consulta)).first()
                 return revendedor
 
         except TypeError as te:
@@ -143,10 +144,11 @@ class Revendedor(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Revendedor: {exc}')
 
     @staticmethod
-    def selectRevendedorPorCnpj(cnpj: str) -> 'Revendedor' or None:
+    @retryTransitorio
+    async def selectRevendedorPorCnpj(cnpj: str) -> 'Revendedor' or None:
         """Seleciona um Revendedor na tabela revendedor por cnpj
         :param cnpj: str: CNPJ do revendedor
         :return: Revendedor or None: Retorna o objeto Revendedor se encontrado, None caso contrário
@@ -162,8 +164,9 @@ class Revendedor(ModelBase):
             if not cnpj:
                 raise ValueError('cnpj do Revendedor não informado!')
 
-            with createSession() as session:
-                revendedor = session.query(Revendedor).filter(Revendedor.cnpj == cnpj).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Revendedor).where(Revendedor.cnpj == cnpj)
+                revendedor = (await session.scalars(consulta)).first()
                 return revendedor
 
         except TypeError as te:
@@ -173,10 +176,11 @@ class Revendedor(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Revendedor: {exc}')
 
     @staticmethod
-    def selectRevendedoresPorNome(nome: str) -> list['Revendedor'] or []:
+    @retryTransitorio
+    async def selectRevendedoresPorNome(nome: str) -> list['Revendedor'] or []:
         """Seleciona os Revendedore na tabela revendedor por nome
         :param nome: str: nome do revendedor
         :return: list[Revendedor] or []: Retorna a lista de objetos Revendedor se encontrado, [] caso contrário
@@ -191,8 +195,9 @@ class Revendedor(ModelBase):
             if not nome:
                 raise ValueError('nome do Revendedor não informado!')
 
-            with createSession() as session:
-                revendedores = session.query(Revendedor).filter(Revendedor.nome == nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_REVENDEDOR_POR_NOME
+                revendedores = (await session.scalars(consulta, {'nome': nome})).first()
                 return revendedores
 
         except TypeError as te:
@@ -202,10 +207,11 @@ class Revendedor(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Revendedor: {exc}')
 
     @staticmethod
-    def selectRendedoresPorRaizSocial(razao_social: str) -> list['Revendedor'] or []:
+    @retryTransitorio
+    async def selectRendedoresPorRaizSocial(razao_social: str) -> list['Revendedor'] or []:
         """Seleciona os Revendedore na tabela revendedor por razao_social
         :param razao_social: str: razao_social do revendedor
         :return: list[Revendedor] or []: Retorna a lista de objetos Revendedor se encontrado, [] caso contrário
@@ -220,8 +226,9 @@ class Revendedor(ModelBase):
             if not razao_social:
                 raise ValueError('razao_social do Revendedor não informado!')
 
-            with createSession() as session:
-                revendedores = session.query(Revendedor).filter(Revendedor.razao_social == razao_social).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Revendedor).where(Revendedor.razao_social == razao_social)
+                revendedores = (await session.scalars(consulta)).first()
                 return revendedores
 
         except TypeError as te:
@@ -231,11 +238,22 @@ class Revendedor(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar Revendedor: {exc}')
 
     
     @staticmethod
-    def updateRevendedor(id_revendedor: int, nome: str, cnpj: str, razao_social: str, contato: str) -> 'Revendedor':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'Revendedor']:
+        """Seleciona vários Revendedor por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de Revendedor, repetições são ignoradas
+        :return: dict[int, Revendedor]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(Revendedor, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateRevendedor(id_revendedor: int, nome: str, cnpj: str, razao_social: str, contato: str) -> 'Revendedor':
         """Atualiza um Revendedor na tabela revendedor
         :param id_revendedor: int: id do revendedor
         :param nome: str: nome do revendedor
@@ -277,8 +295,9 @@ class Revendedor(ModelBase):
             razao_social = razao_social.strip().upper()
             contato = contato.strip().upper()
 
-            with createSession() as session:
-                revendedor = session.query(Revendedor).filter_by(id=id_revendedor).first()
+            async with sessionScope() as session:
+                consulta = sa.select(Revendedor).where(Revendedor.id == id_revendedor)
+                revendedor = (await session.scalars(consulta)).first()
 
                 if not revendedor:
                     raise ValueError(f'Revendedor com id={id_revendedor} não cadastrado na base!')
@@ -298,7 +317,7 @@ class Revendedor(ModelBase):
                     revendedor.contato = contato
 
                 revendedor.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return revendedor
 
         except IntegrityError as intg_error:
@@ -320,50 +339,57 @@ class Revendedor(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Ingrediente: {exp}')
 
     @staticmethod
-    def deleteRevendedorById(id_revendedor: int) -> 'Revendedor':
-        """Deleta um Revendedor cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteRevendedorById(id_revendedor: int) -> int:
+        """Deleta um Revendedor cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_revendedor: int: identificador do Revendedor
-        :return: Revendedor: Retorna o objeto Revendedor deletado
+        :return: int: Retorna o id do Revendedor deletado
         :raises TypeError: Se o id_revendedor não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o Revendedor, especificado para o
-        id_revendedor, caso o Revendedor esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :raises RuntimeError: Se o Revendedor estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o Revendedor não for encontrado na base
         """
         try:
             if not isinstance(id_revendedor, int):
                 raise TypeError('id_revendedor do Revendedor deve ser um inteiro!')
 
-            with createSession() as session:
-                revendedor: Revendedor = session.query(Revendedor). \
-                    filter_by(id=id_revendedor).first()
+            return await DataBaseFeatures.deleteById(model=Revendedor, id=id_revendedor)
 
-                if not revendedor:
-                    raise ValueError(f'Revendedor com id={id_revendedor} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(revendedor)
-                session.commit()
-                return revendedor
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar Revendedor: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários Revendedor em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de Revendedor
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum Revendedor estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(Revendedor, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de Revendedor que atendem aos filtros informados, ex.: Revendedor.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum Revendedor estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(Revendedor, *filtros)
+
+
+# consulta de Revendedor.selectRevendedoresPorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_REVENDEDOR_POR_NOME = sa.select(Revendedor).where(Revendedor.nome == sa.bindparam('nome'))
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=Revendedor.__tablename__)
-                raise RuntimeError(f'Revendedor com id={id_revendedor} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar Revendedor: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar Revendedor: {exc}')
-        
-        
 if __name__ == '__main__':
     # try:
     #     Revendedor.insertRevendedor(nome='Sorbato de Potássio', cnpj='12345678901234',
@@ -383,7 +409,7 @@ if __name__ == '__main__':
 
 
     try:
-        revendedor = Revendedor.deleteRevendedorById(id_revendedor=55)
+        revendedor = asyncio.run(Revendedor.deleteRevendedorById(id_revendedor=55))
         print(revendedor)
     except Exception as e:
         print(f'Erro ao deletar Revendedor: {e}')
@@ -0,0 +1,206 @@
+import asyncio
+from datetime import date, datetime
+
+import sqlalchemy as sa
+from models.model_base import ModelBase
+from models.nota_fiscal import NotaFiscal
+from conf.db_session import sessionScope, conexaoLeitura
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
+from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
+
+# Este módulo é responsável pelo rollup das vendas diárias por revendedor: uma linha por (revendedor_fk, dia) com a
+# quantidade de notas fiscais e a receita do dia. O painel consulta o total de um revendedor pela chave primária, sem
+# percorrer a tabela nota_fiscal.
+#
+# No sqlite a tabela é mantida por triggers em nota_fiscal (insert, update de valor/revendedor_fk/data_criacao e
+# delete), criados junto com as tabelas, qualquer que seja o caminho da escrita. A linha só existe enquanto o
+# revendedor tiver notas no dia.
+# Nos demais bancos, ou para corrigir divergências, RevendedorDailySales.verificarRollup() recalcula o rollup a partir
+# de nota_fiscal e repara as linhas divergentes:
+#     python repair_rollups_main.py
+# Nos demais bancos a tabela não acompanha as escritas entre um reparo e outro: a criação das tabelas e a primeira
+# leitura do rollup no processo registram um aviso no log (DataBaseFeatures.avisarSemTriggers).
+
+log = getLogger('revendedor_daily_sales')
+
+TABELA_VENDAS_DIARIAS = 'revendedor_daily_sales'
+# comando que recalcula o rollup nos bancos sem os triggers, ver o comentário acima
+REPARO_ROLLUP = 'python repair_rollups_main.py'
+
+
+class RevendedorDailySales(ModelBase):
+    __tablename__ = TABELA_VENDAS_DIARIAS
+
+    # sem FK para revendedor: o rollup não é dependente do revendedor para DataBaseFeatures
+    revendedor_fk: int = sa.Column(sa.BigInteger().with_variant(sa.Integer, "sqlite"), primary_key=True,
+                                   autoincrement=False)
+    dia: date = sa.Column(sa.Date, primary_key=True)
+    notas: int = sa.Column(sa.BigInteger, nullable=False)
+    receita: float = sa.Column(sa.DECIMAL(decimal_return_scale=2).with_variant(sa.Float(), "sqlite"), nullable=False)
+    data_atualizacao: datetime = sa.Column(sa.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        """Retorna uma representação do objeto em forma de 'string'."""
+        return (f'<RevendedorDailySales(revendedor_fk={self.revendedor_fk}, dia={self.dia}, notas={self.notas}, '
+                f'receita={self.receita})>')
+
+    @staticmethod
+    @retryTransitorio
+    async def selectVendasRevendedor(revendedor_fk: int, inicio: date = None,
+                                     fim: date = None) -> list['RevendedorDailySales'] or []:
+        """Seleciona as vendas diárias de um revendedor no intervalo [inicio, fim), pela chave primária
+        :param revendedor_fk: int: id do revendedor
+        :param inicio: date: dia inicial, inclusivo; sem limite se não informado
+        :param fim: date: dia final, exclusivo; sem limite se não informado
+        :raises TypeError: Se o revendedor_fk não for inteiro, ou se inicio ou fim não forem datas
+        :return: list[RevendedorDailySales] or []: ordenada por dia
+        """
+        try:
+            if not isinstance(revendedor_fk, int):
+                raise TypeError('revendedor_fk do RevendedorDailySales deve ser um inteiro!')
+            for nome, valor in (('inicio', inicio), ('fim', fim)):
+                if valor is not None and not isinstance(valor, date):
+                    raise TypeError(f'{nome} do RevendedorDailySales deve ser uma data!')
+
+            consulta = sa.select(RevendedorDailySales).where(RevendedorDailySales.revendedor_fk == revendedor_fk)
+            if inicio is not None:
+                consulta = consulta.where(RevendedorDailySales.dia >= inicio)
+            if fim is not None:
+                consulta = consulta.where(RevendedorDailySales.dia < fim)
+
+            async with sessionScope(savepoint=False) as session:
+                DataBaseFeatures.avisarSemTriggers(TABELA_VENDAS_DIARIAS, session.get_bind().dialect.name,
+                                                   REPARO_ROLLUP)
+                vendas = (await session.scalars(consulta.order_by(RevendedorDailySales.dia))).all()
+                return vendas
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar RevendedorDailySales: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def selectTotalRevendedor(revendedor_fk: int) -> tuple[int, float]:
+        """Soma as notas e a receita de todos os dias de um revendedor, pela chave primária do rollup
+        :param revendedor_fk: int: id do revendedor
+        :raises TypeError: Se o revendedor_fk não for inteiro
+        :return: tuple[int, float]: quantidade de notas e receita total
+        """
+        try:
+            if not isinstance(revendedor_fk, int):
+                raise TypeError('revendedor_fk do RevendedorDailySales deve ser um inteiro!')
+
+            async with conexaoLeitura() as conexao:
+                DataBaseFeatures.avisarSemTriggers(TABELA_VENDAS_DIARIAS, conexao.dialect.name, REPARO_ROLLUP)
+                notas, receita = (await conexao.execute(_SELECT_TOTAL_REVENDEDOR,
+                                                        {'revendedor_fk': revendedor_fk})).one()
+            return notas, round(float(receita), 2)
+
+        except TypeError as te:
+            raise TypeError(te)
+
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao selecionar RevendedorDailySales: {exc}')
+
+    @staticmethod
+    @retryTransitorio
+    async def verificarRollup(reparar: bool = True) -> int:
+        """Recalcula as vendas diárias a partir de nota_fiscal e compara com o rollup. No sqlite, também cria a tabela
+        e os triggers de manutenção, caso o banco seja anterior ao rollup.
+        :param reparar: bool: se True, corrige as linhas divergentes, na mesma transação
+        :return: int: quantidade de linhas divergentes (faltando, sobrando ou com valores diferentes)
+        """
+        async with sessionScope() as session:
+            conexao = await session.connection()
+            await conexao.run_sync(lambda conn: RevendedorDailySales.__table__.create(conn, checkfirst=True))
+            if conexao.dialect.name == 'sqlite':
+                for ddl in _ddlTriggersVendasDiarias():
+                    await conexao.exec_driver_sql(ddl)
+                dia = sa.func.date(NotaFiscal.data_criacao, type_=sa.Date)
+            else:
+                dia = sa.cast(NotaFiscal.data_criacao, sa.Date)
+
+            consulta = (sa.select(NotaFiscal.revendedor_fk, dia, sa.func.count(), sa.func.sum(NotaFiscal.valor))
+                        .group_by(NotaFiscal.revendedor_fk, dia))
+            esperado = {(revendedor_fk, dia_): (notas, round(float(receita), 2))
+                        for revendedor_fk, dia_, notas, receita in (await conexao.execute(consulta)).all()}
+
+            tabela = RevendedorDailySales.__table__
+            consulta = sa.select(tabela.c.revendedor_fk, tabela.c.dia, tabela.c.notas, tabela.c.receita)
+            atual = {(revendedor_fk, dia_): (notas, round(float(receita), 2))
+                     for revendedor_fk, dia_, notas, receita in (await conexao.execute(consulta)).all()}
+
+            # ordenadas, para que o reparo grave as linhas sempre na mesma ordem
+            divergentes = sorted(chave for chave in esperado.keys() | atual.keys()
+                                 if esperado.get(chave) != atual.get(chave))
+            if divergentes:
+                log.warning('RevendedorDailySales: %s linha(s) divergente(s)%s', len(divergentes),
+                            ', reparando' if reparar else '')
+
+            if reparar and divergentes:
+                chave = sa.tuple_(tabela.c.revendedor_fk, tabela.c.dia)
+                for inicio in range(0, len(divergentes), 400):
+                    await conexao.execute(sa.delete(tabela).where(chave.in_(divergentes[inicio:inicio + 400])))
+                agora = datetime.now()
+                linhas = [{'revendedor_fk': revendedor_fk, 'dia': dia_, 'notas': esperado[(revendedor_fk, dia_)][0],
+                           'receita': esperado[(revendedor_fk, dia_)][1], 'data_atualizacao': agora}
+                          for revendedor_fk, dia_ in divergentes if (revendedor_fk, dia_) in esperado]
+                for inicio in range(0, len(linhas), 150):
+                    await conexao.execute(sa.insert(tabela), linhas[inicio:inicio + 150])
+
+        return len(divergentes)
+
+
+# consulta Core de RevendedorDailySales.selectTotalRevendedor, somente pela chave primária
+_tabela_vendas_diarias = RevendedorDailySales.__table__
+_SELECT_TOTAL_REVENDEDOR = sa.select(
+    sa.func.coalesce(sa.func.sum(_tabela_vendas_diarias.c.notas), 0),
+    sa.func.coalesce(sa.func.sum(_tabela_vendas_diarias.c.receita), 0),
+).where(_tabela_vendas_diarias.c.revendedor_fk == sa.bindparam('revendedor_fk'))
+
+
+def _sqlSomarVenda(linha: str) -> str:
+    """Soma a nota fiscal da linha (NEW) ao dia do revendedor, criando a linha do rollup se necessário"""
+    return (f"INSERT INTO {TABELA_VENDAS_DIARIAS} (revendedor_fk, dia, notas, receita, data_atualizacao) "
+            f"VALUES ({linha}.revendedor_fk, date({linha}.data_criacao), 1, {linha}.valor, "
+            f"datetime('now', 'localtime')) "
+            f"ON CONFLICT (revendedor_fk, dia) DO UPDATE SET notas = notas + 1, "
+            f"receita = round(receita + excluded.receita, 2), data_atualizacao = excluded.data_atualizacao;")
+
+
+def _sqlSubtrairVenda(linha: str) -> str:
+    """Subtrai a nota fiscal da linha (OLD) do dia do revendedor, removendo a linha do rollup que ficar sem notas"""
+    chave = f"revendedor_fk = {linha}.revendedor_fk AND dia = date({linha}.data_criacao)"
+    return (f"UPDATE {TABELA_VENDAS_DIARIAS} SET notas = notas - 1, receita = round(receita - {linha}.valor, 2), "
+            f"data_atualizacao = datetime('now', 'localtime') WHERE {chave}; "
+            f"DELETE FROM {TABELA_VENDAS_DIARIAS} WHERE {chave} AND notas <= 0;")
+
+
+def _ddlTriggersVendasDiarias() -> list[str]:
+    """Monta os triggers do sqlite que mantêm o rollup a cada alteração em nota_fiscal"""
+    triggers = {
+        'insert': ('AFTER INSERT ON nota_fiscal', _sqlSomarVenda('NEW')),
+        'update': ('AFTER UPDATE OF valor, revendedor_fk, data_criacao ON nota_fiscal',
+                   _sqlSomarVenda('NEW') + ' ' + _sqlSubtrairVenda('OLD')),
+        'delete': ('AFTER DELETE ON nota_fiscal', _sqlSubtrairVenda('OLD')),
+    }
+    return [f'CREATE TRIGGER IF NOT EXISTS trg_{TABELA_VENDAS_DIARIAS}_{nome} {evento} FOR EACH ROW BEGIN {corpo} END'
+            for nome, (evento, corpo) in triggers.items()]
+
+
+@sa.event.listens_for(ModelBase.metadata, 'after_create')
+def _criarTriggersVendasDiarias(target, connection, **kw):
+    if TABELA_VENDAS_DIARIAS not in target.tables:
+        return
+    if connection.dialect.name == 'sqlite':
+        for ddl in _ddlTriggersVendasDiarias():
+            connection.exec_driver_sql(ddl)
+    else:
+        DataBaseFeatures.avisarSemTriggers(TABELA_VENDAS_DIARIAS, connection.dialect.name, REPARO_ROLLUP)
+
+
+if __name__ == '__main__':
+    print(asyncio.run(RevendedorDailySales.verificarRollup(reparar=False)))
@@ -2,11 +2,18 @@ import asyncio
 import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('sabor')
+
+
 class Sabor(ModelBase):
     __tablename__ = 'sabor'
 
@@ -23,6 +30,7 @@ class Sabor(ModelBase):
 
 
     @staticmethod
+    @retryTransitorio
     async def insertSabor(nome: str) -> 'Sabor' or None:
         """Insere um Sabor na tabela sabor
         :param nome: str: nome do Sabor
@@ -33,7 +41,6 @@ class Sabor(ModelBase):
         seja por outro motivo, será lançado um erro genérico.
         """
 
-        session = None
         try:
             # check if is string
             if not isinstance(nome, str):
@@ -46,16 +53,8 @@ class Sabor(ModelBase):
                 raise ValueError('nome do Sabor não informado!')
 
             sabor = Sabor(nome=nome)
-            session = await createSession()
-            async with session.begin():
-                print(f'Inserindo Sabor: {sabor}')
-                session.add(sabor)
-                await session.commit()
-
-                print(f'Sabor inserido com sucesso!')
-                print(f'ID do Sabor inserido: {sabor.id}')
-                print(f'Nome do Sabor inserido: {sabor.nome}')
-                print(f'Data de criação do Sabor inserido: {sabor.data_criacao}')
+            await persistir(sabor)
+            log.debug('Sabor inserido: id=%s nome=%s', sabor.id, sabor.nome)
             return sabor
 
         except IntegrityError as intg_error:
@@ -73,28 +72,31 @@ class Sabor(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
-        except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
 
-        finally:
-            if session:
-                await session.close()
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao inserir Sabor: {exc}')
 
     @staticmethod
-    def selectAllSabores() -> list['Sabor'] or []:
+    @retryTransitorio
+    async def selectAllSabores() -> list['Sabor'] or []:
         """Seleciona todos os Sabores na tabela sabor
         raises Exception: Informa erro inesperado ao selecionar Sabores
         :return: list[Sabor] or []: Retorna uma lista de objetos Sabor se houver registros, [] caso contrário
         """
         try:
-            with createSession() as session:
-                sabores = session.query(Sabor).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Sabor)
+                sabores = (await session.scalars(consulta)).all()
                 return sabores
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos Sabor: {exc}')
 
     @staticmethod
-    def selectSaborPorId(id: int) -> 'Sabor' or None:
+    @retryTransitorio
+    async def selectSaborPorId(id: int) -> 'Sabor' or None:
         """Seleciona um Sabor na tabela sabor por id
         :param id: int: id do Sabor
         :raises TypeError: Se o id não for um inteiro
@@ -108,8 +110,9 @@ class Sabor(ModelBase):
             if not id:
                 raise ValueError('id do Sabor não informado!')
 
-            with createSession() as session:
-                sabor = session.query(Sabor).filter(Sabor.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(Sabor).where(Sabor.id == id)
+                sabor = (await session.scalars(consulta)).first()
                 return sabor
 
         except TypeError as te:
@@ -122,7 +125,8 @@ class Sabor(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar Sabor por id: {exc}')
 
     @staticmethod
-    def selectSaborPorNome(nome: str) -> 'Sabor' or None:
+    @retryTransitorio
+    async def selectSaborPorNome(nome: str) -> 'Sabor' or None:
         """Seleciona um Sabor na tabela sabor por nome
         :param nome: str: nome do Sabor
         :raises TypeError: Se o nome não for uma string
@@ -137,8 +141,9 @@ class Sabor(ModelBase):
             if not nome:
                 raise ValueError('nome do Sabor não informado!')
 
-            with createSession() as session:
-                sabor = session.query(Sabor).filter(Sabor.nome == nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_SABOR_POR_NOME
+                sabor = (await session.scalars(consulta, {'nome': nome})).first()
                 return sabor
 
         except TypeError as te:
@@ -151,7 +156,18 @@ class Sabor(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar Sabor por nome: {exc}')
 
     @staticmethod
-    def updateSabor(id_sabor: int, nome: str = '') -> 'Sabor':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'Sabor']:
+        """Seleciona vários Sabor por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de Sabor, repetições são ignoradas
+        :return: dict[int, Sabor]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(Sabor, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateSabor(id_sabor: int, nome: str = '') -> 'Sabor':
         """Atualiza um Sabor na tabela sabor
         :param id_sabor: int: id do Sabor
         :param nome: str: nome do Sabor
@@ -177,8 +193,9 @@ class Sabor(ModelBase):
 
             nome = nome.strip().upper()
 
-            with createSession() as session:
-                sabor = session.query(Sabor).filter_by(id=id_sabor).first()
+            async with sessionScope() as session:
+                consulta = sa.select(Sabor).where(Sabor.id == id_sabor)
+                sabor = (await session.scalars(consulta)).first()
 
                 if not sabor:
                     raise ValueError(f'Sabor com o ID {id_sabor} não cadastrado na base!')
@@ -189,7 +206,7 @@ class Sabor(ModelBase):
                     nome = sabor.nome
 
                 sabor.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return sabor
 
         except IntegrityError as intg_error:
@@ -211,48 +228,55 @@ class Sabor(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar Sabor: {exc}')
 
     @staticmethod
-    def deleteSaborById(id_sabor: int) -> 'Sabor':
-        """Deleta um Sabor cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteSaborById(id_sabor: int) -> int:
+        """Deleta um Sabor cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_sabor: int: identificador do Sabor
-        :return: Sabor: Retorna o objeto Sabor deletado
+        :return: int: Retorna o id do Sabor deletado
         :raises TypeError: Se o id_sabor não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o Sabor, especificado para o
-        id_sabor, caso o Sabor esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :raises RuntimeError: Se o Sabor estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o Sabor não for encontrado na base
         """
         try:
             if not isinstance(id_sabor, int):
                 raise TypeError('id_sabor do Sabor deve ser um inteiro!')
 
-            with createSession() as session:
-                sabor: Sabor = session.query(Sabor). \
-                    filter_by(id=id_sabor).first()
+            return await DataBaseFeatures.deleteById(model=Sabor, id=id_sabor)
 
-                if not sabor:
-                    raise ValueError(f'Sabor com id={id_sabor} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(sabor)
-                session.commit()
-                return sabor
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar Sabor: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários Sabor em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de Sabor
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum Sabor estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(Sabor, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de Sabor que atendem aos filtros informados, ex.: Sabor.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum Sabor estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(Sabor, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=Sabor.__tablename__)
-                raise RuntimeError(f'Sabor com id={id_sabor} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar Sabor: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar Sabor: {exc}')
+# consulta de Sabor.selectSaborPorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_SABOR_POR_NOME = sa.select(Sabor).where(Sabor.nome == sa.bindparam('nome'))
 
 
 if __name__ == '__main__':
@@ -278,7 +302,7 @@ if __name__ == '__main__':
     # print(sabor)
     
     try:
-        sabor = Sabor.deleteSaborById(id_sabor=90)
+        sabor = asyncio.run(Sabor.deleteSaborById(id_sabor=90))
         print(sabor)
     except Exception as e:
         print(f'Erro ao deletar Sabor: {e}')
@@ -1,11 +1,19 @@
+import asyncio
 import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('tipo_embalagem')
+
+
 class TipoEmbalagem(ModelBase):
     __tablename__ = 'tipo_embalagem'
 
@@ -22,7 +30,8 @@ class TipoEmbalagem(ModelBase):
 
 
     @staticmethod
-    def insertTipoEmbalagem(nome: str) -> 'TipoEmbalagem' or None:
+    @retryTransitorio
+    async def insertTipoEmbalagem(nome: str) -> 'TipoEmbalagem' or None:
         """Insere um TipoEmbalagem na tabela tipo_embalagem
         :param nome: str: nome do TipoEmbalagem
         :return: TipoEmbalagem or None: Retorna o objeto TipoEmbalagem se inserido com sucesso, None caso contrário
@@ -45,15 +54,8 @@ class TipoEmbalagem(ModelBase):
 
             tipo_embalagem = TipoEmbalagem(nome=nome)
 
-            with createSession() as session:
-                print(f'Inserindo TipoEmbalagem: {tipo_embalagem}')
-                session.add(tipo_embalagem)
-                session.commit()
-
-                print(f'Tipo Embalagem inserido com sucesso!')
-                print(f'ID do TipoEmbalagem inserido: {tipo_embalagem.id}')
-                print(f'Nome do TipoEmbalagem inserido: {tipo_embalagem.nome}')
-                print(f'Data de criação do TipoEmbalagem inserido: {tipo_embalagem.data_criacao}')
+            await persistir(tipo_embalagem)
+            log.debug('TipoEmbalagem inserido: id=%s nome=%s', tipo_embalagem.id, tipo_embalagem.nome)
             return tipo_embalagem
 
         except IntegrityError as intg_error:
@@ -71,25 +73,32 @@ class TipoEmbalagem(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
+
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao inserir TipoEmbalagem: {exc}')
 
     @staticmethod
-    def selectAllTipoEmbalagens() -> list['TipoEmbalagem'] or []:
+    @retryTransitorio
+    async def selectAllTipoEmbalagens() -> list['TipoEmbalagem'] or []:
         """Seleciona todos os TipoEmbalagens na tabela tipo_embalagem
         :raises Exception: Informa erro inesperado ao selecionar TipoEmbalagens
         :return: list[TipoEmbalagem] or []: Retorna uma lista de objetos TipoEmbalagem se houver registros, [] caso contrário
         """
         try:
-            with createSession() as session:
-                tipo_embalagens = session.query(TipoEmbalagem).all()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(TipoEmbalagem)
+                tipo_embalagens = (await session.scalars(consulta)).all()
                 return tipo_embalagens
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos TipoEmbalagem: {exc}')
 
     @staticmethod
-    def selectTipoEmbalagemPorId(id: int) -> 'TipoEmbalagem' or None:
+    @retryTransitorio
+    async def selectTipoEmbalagemPorId(id: int) -> 'TipoEmbalagem' or None:
         """Seleciona um TipoEmbalagem na tabela tipo_embalagem por id
         :param id: int: id do TipoEmbalagem
         :raises TypeError: Se o id não for um inteiro
@@ -103,8 +112,9 @@ class TipoEmbalagem(ModelBase):
             if not id:
                 raise ValueError('id do TipoEmbalagem não informado!')
 
-            with createSession() as session:
-                tipo_embalagem = session.query(TipoEmbalagem).filter(TipoEmbalagem.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(TipoEmbalagem).where(TipoEmbalagem.id == id)
+                tipo_embalagem = (await session.scalars(consulta)).first()
                 return tipo_embalagem
 
         except TypeError as te:
@@ -117,7 +127,8 @@ class TipoEmbalagem(ModelBase):
             raise Exception(f'Erro inesperado ao selecionar TipoEmbalagem por id: {exc}')
 
     @staticmethod
-    def selectTipoEmbalagemPorNome(nome: str) -> 'TipoEmbalagem' or None:
+    @retryTransitorio
+    async def selectTipoEmbalagemPorNome(nome: str) -> 'TipoEmbalagem' or None:
         """Seleciona um TipoEmbalagem na tabela tipo_embalagem por nome
         :param nome: str: nome do TipoEmbalagem
         :raises TypeError: Se o nome não for uma string
@@ -132,8 +143,9 @@ class TipoEmbalagem(ModelBase):
             if not nome:
                 raise ValueError('nome do TipoEmbalagem não informado!')
 
-            with createSession() as session:
-                tipo_embalagem = session.query(TipoEmbalagem).filter(TipoEmbalagem.nome == nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_TIPO_EMBALAGEM_POR_NOME
+                tipo_embalagem = (await session.scalars(consulta, {'nome': nome})).first()
                 return tipo_embalagem
 
         except TypeError as te:
@@ -147,7 +159,18 @@ class TipoEmbalagem(ModelBase):
 
     
     @staticmethod
-    def updateTipoEmbalagem(id_tipo_embalagem: int, nome: str = '') -> 'TipoEmbalagem':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'TipoEmbalagem']:
+        """Seleciona vários TipoEmbalagem por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de TipoEmbalagem, repetições são ignoradas
+        :return: dict[int, TipoEmbalagem]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(TipoEmbalagem, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateTipoEmbalagem(id_tipo_embalagem: int, nome: str = '') -> 'TipoEmbalagem':
         """Atualiza um TipoEmbalagem na tabela tipo_embalagaem
         :param id_tipo_embalagem: int: id do tipo_embalagaem
         :param nome: str: nome do tipo_embalagaem
@@ -173,8 +196,9 @@ class TipoEmbalagem(ModelBase):
 
             nome = nome.strip().upper()
 
-            with createSession() as session:
-                tipo_embalagaem = session.query(TipoEmbalagem).filter_by(id=id_tipo_embalagem).first()
+            async with sessionScope() as session:
+                consulta = sa.select(TipoEmbalagem).where(TipoEmbalagem.id == id_tipo_embalagem)
+                tipo_embalagaem = (await session.scalars(consulta)).first()
 
                 if not tipo_embalagaem:
                     raise ValueError(f'TipoEmbalagem com id={id_tipo_embalagem} não cadastrado na base!')
@@ -185,7 +209,7 @@ class TipoEmbalagem(ModelBase):
                     nome = tipo_embalagaem.nome
 
                 tipo_embalagaem.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return tipo_embalagaem
 
         except IntegrityError as intg_error:
@@ -207,49 +231,55 @@ class TipoEmbalagem(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar TipoEmbalagem: {exp}')
 
     @staticmethod
-    def deleteTipoEmbalagemById(id_tipo_embalagem: int) -> 'TipoEmbalagem':
-        """Deleta um TipoEmbalagem cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteTipoEmbalagemById(id_tipo_embalagem: int) -> int:
+        """Deleta um TipoEmbalagem cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_tipo_embalagem: int: identificador do TipoEmbalagem
-        :return: TipoEmbalagem: Retorna o objeto TipoEmbalagem deletado
+        :return: int: Retorna o id do TipoEmbalagem deletado
         :raises TypeError: Se o id_tipo_embalagem não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o TipoEmbalagem, especificado para o
-        id_tipo_embalagem, caso o TipoEmbalagem esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :raises RuntimeError: Se o TipoEmbalagem estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o TipoEmbalagem não for encontrado na base
         """
         try:
             if not isinstance(id_tipo_embalagem, int):
                 raise TypeError('id do TipoEmbalagem deve ser um inteiro!')
 
-            with createSession() as session:
-                tipo_embalagem: TipoEmbalagem = session.query(TipoEmbalagem). \
-                    filter_by(id=id_tipo_embalagem).first()
+            return await DataBaseFeatures.deleteById(model=TipoEmbalagem, id=id_tipo_embalagem)
 
-                if not tipo_embalagem:
-                    raise ValueError(f'TipoEmbalagem com id={id_tipo_embalagem} não cadastrado na base!')
-
-                session.delete(tipo_embalagem)
-                session.commit()
-                return tipo_embalagem
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-        except TypeError as te:
-            raise TypeError(te)
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar TipoEmbalagem: {exc}')
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários TipoEmbalagem em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de TipoEmbalagem
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum TipoEmbalagem estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(TipoEmbalagem, ids)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=TipoEmbalagem.__tablename__)
-                raise RuntimeError(f'TipoEmbalagem com id={id_tipo_embalagem} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar TipoEmbalagem: {intg_error}')
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de TipoEmbalagem que atendem aos filtros informados, ex.: TipoEmbalagem.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum TipoEmbalagem estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(TipoEmbalagem, *filtros)
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar TipoEmbalagem: {exc}')
 
+# consulta de TipoEmbalagem.selectTipoEmbalagemPorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_TIPO_EMBALAGEM_POR_NOME = sa.select(TipoEmbalagem).where(TipoEmbalagem.nome == sa.bindparam('nome'))
 
 
 if __name__ == '__main__':
@@ -275,7 +305,7 @@ if __name__ == '__main__':
 
 
     try:
-        tipo_embalagen = TipoEmbalagem.deleteTipoEmbalagemById(id_tipo_embalagem=71)
+        tipo_embalagen = asyncio.run(TipoEmbalagem.deleteTipoEmbalagemById(id_tipo_embalagem=71))
         print(tipo_embalagen)
     except Exception as e:
         print(f'Erro ao deletar TipoEmbalagem: {e}')
@@ -1,11 +1,19 @@
+import asyncio
 import sqlalchemy as sa
 from datetime import datetime
 from models.model_base import ModelBase
-from conf.db_session import createSession
+from conf.db_session import sessionScope
+from conf.write_batcher import persistir
+from conf.sqlite_writer import FilaEscritaCheiaError, PrazoEscritaExcedidoError
+from conf.logger import getLogger
+from conf.retry import retryTransitorio
 from sqlalchemy.exc import IntegrityError
 from ScriptsAuxiliares.DataBaseFeatures import DataBaseFeatures
 
 
+log = getLogger('tipo_picole')
+
+
 class TipoPicole(ModelBase):
     __tablename__ = 'tipo_picole'
 
@@ -23,7 +31,8 @@ class TipoPicole(ModelBase):
 
 
     @staticmethod
-    def insertTipoPicole(nome: str) -> 'TipoPicole' or None:
+    @retryTransitorio
+    async def insertTipoPicole(nome: str) -> 'TipoPicole' or None:
         """Insere um TipoPicole na tabela tipo_picole
         :param nome: str: nome do TipoPicole
         :return: TipoPicole or None: Retorna o objeto TipoPicole se inserido com sucesso, None caso contrário
@@ -45,15 +54,8 @@ class TipoPicole(ModelBase):
                 raise ValueError('nome do TipoPicole não informado!')
 
             tipo_picole = TipoPicole(nome=nome)
-            with createSession() as session:
-                print(f'Inserindo TipoPicole: {tipo_picole}')
-                session.add(tipo_picole)
-                session.commit()
-
-            print(f'Tipo Picolé inserido com sucesso!')
-            print(f'ID do TipoPicole inserido: {tipo_picole.id}')
-            print(f'Nome TipoPicole inserido: {tipo_picole.nome}')
-            print(f'Data de criação do TipoPicole inserido: {tipo_picole.data_criacao}')
+            await persistir(tipo_picole)
+            log.debug('TipoPicole inserido: id=%s nome=%s', tipo_picole.id, tipo_picole.nome)
             return tipo_picole
 
         except IntegrityError as intg_error:
@@ -71,24 +73,30 @@ class TipoPicole(ModelBase):
         except ValueError as ve:
             raise ValueError(ve)
 
+        except (FilaEscritaCheiaError, PrazoEscritaExcedidoError):
+            # backpressure do SqliteWriter: o chamador decide se tenta novamente
+            raise
+
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao inserir TipoPicole: {exc}')
 
     @staticmethod
-    def selectAllTipoPicoles() -> list['TipoPicole'] or []:
+    @retryTransitorio
+    async def selectAllTipoPicoles() -> list['TipoPicole'] or []:
         """Retorna uma lista com todos os registros da tabela tipo_picole
         raises Exception: Informa erro inesperado ao selecionar TipoPicole
         :return: list[TipoPicole] or []: Retorna uma lista com os objetos TipoPicole encontrados, [] caso contrário
         """
         try:
-            with createSession() as session:
-                return session.query(TipoPicole).all()
+            async with sessionScope(savepoint=False) as session:
+                return (await session.scalars(sa.select(TipoPicole))).all()
 
         except Exception as exc:
             raise Exception(f'Erro inesperado ao selecionar todos TipoPicole: {exc}')
 
     @staticmethod
-    def selectTipoPicolePorId(id: int) -> 'TipoPicole' or None:
+    @retryTransitorio
+    async def selectTipoPicolePorId(id: int) -> 'TipoPicole' or None:
         """Seleciona um TipoPicole na tabela tipo_picole por id
         :param id: int: id do TipoPicole a ser selecionado
         :return: TipoPicole or None: Retorna o objeto TipoPicole se encontrado, None caso contrário
@@ -106,8 +114,9 @@ class TipoPicole(ModelBase):
             if not id:
                 raise ValueError('id do TipoPicole não informado!')
 
-            with createSession() as session:
-                tipo_picole = session.query(TipoPicole).filter(TipoPicole.id == id).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = sa.select(TipoPicole).where(TipoPicole.id == id)
+                tipo_picole = (await session.scalars(consulta)).first()
                 if tipo_picole:
                     return tipo_picole
 
@@ -118,10 +127,11 @@ class TipoPicole(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar TipoPicole: {exc}')
 
     @staticmethod
-    def selectTipoPicolePorNome(nome: str) -> 'TipoPicole':
+    @retryTransitorio
+    async def selectTipoPicolePorNome(nome: str) -> 'TipoPicole':
         """Seleciona um TipoPicole na tabela tipo_picole por nome
         :param nome: str: nome do TipoPicole a ser selecionado
         :return: TipoPicole: Retorna o objeto TipoPicole se encontrado, None caso contrário
@@ -140,8 +150,9 @@ class TipoPicole(ModelBase):
             if not nome:
                 raise ValueError('nome do TipoPicole não informado!')
 
-            with createSession() as session:
-                tipo_picole = session.query(TipoPicole).filter(TipoPicole.nome == nome).first()
+            async with sessionScope(savepoint=False) as session:
+                consulta = _SELECT_TIPO_PICOLE_POR_NOME
+                tipo_picole = (await session.scalars(consulta, {'nome': nome})).first()
                 if tipo_picole:
                     return tipo_picole
 
@@ -154,10 +165,21 @@ class TipoPicole(ModelBase):
             raise ValueError(ve)
 
         except Exception as exc:
-            print(f'Erro inesperado: {exc}')
+            raise Exception(f'Erro inesperado ao selecionar TipoPicole: {exc}')
 
     @staticmethod
-    def updateTipoPicole(id_tipo_picole: int, nome: str = '') -> 'TipoPicole':
+    @retryTransitorio
+    async def selectManyById(ids: list[int]) -> dict[int, 'TipoPicole']:
+        """Seleciona vários TipoPicole por id, com uma consulta por bloco de ids, em vez de uma consulta por id.
+        :param ids: list[int]: ids dos registros de TipoPicole, repetições são ignoradas
+        :return: dict[int, TipoPicole]: registros encontrados por id; ids não encontrados ficam de fora
+        :raises TypeError: Se algum id não for um inteiro
+        """
+        return await DataBaseFeatures.selectManyById(TipoPicole, ids)
+
+    @staticmethod
+    @retryTransitorio
+    async def updateTipoPicole(id_tipo_picole: int, nome: str = '') -> 'TipoPicole':
         """Atualiza um TipoPicole na tabela tipo_picole
         :param id_tipo_picole: int: id do tipo_picole
         :param nome: str: nome do tipo_picole
@@ -183,8 +205,9 @@ class TipoPicole(ModelBase):
 
             nome = nome.strip().upper()
 
-            with createSession() as session:
-                tipo_picole = session.query(TipoPicole).filter_by(id=id_tipo_picole).first()
+            async with sessionScope() as session:
+                consulta = sa.select(TipoPicole).where(TipoPicole.id == id_tipo_picole)
+                tipo_picole = (await session.scalars(consulta)).first()
 
                 if not tipo_picole:
                     raise ValueError(f'TipoPicole com id={id_tipo_picole} não cadastrado na base!')
@@ -195,7 +218,7 @@ class TipoPicole(ModelBase):
                     nome = tipo_picole.nome
 
                 tipo_picole.data_atualizacao = datetime.now()
-                session.commit()
+                await session.flush()
                 return tipo_picole
 
         except IntegrityError as intg_error:
@@ -217,48 +240,55 @@ class TipoPicole(ModelBase):
             raise Exception(f'Erro inesperado ao atualizar TipoPicole: {exp}')
 
     @staticmethod
-    def deleteTipoPicoleById(id_tipo_picole: int) -> 'TipoPicole':
-        """Deleta um TipoPicole cadastrado no banco de dados a partir do id.
+    @retryTransitorio
+    async def deleteTipoPicoleById(id_tipo_picole: int) -> int:
+        """Deleta um TipoPicole cadastrado no banco de dados a partir do id, com um único DELETE ... RETURNING id, sem
+        carregar a entidade e seus relacionamentos.
         :param id_tipo_picole: int: identificador do TipoPicole
-        :return: TipoPicole: Retorna o objeto TipoPicole deletado
+        :return: int: Retorna o id do TipoPicole deletado
         :raises TypeError: Se o id_tipo_picole não for um inteiro
-        :raises RuntimeError: Se ocorrer um erro de integridade ao deletar o TipoPicole, especificado para o
-        id_tipo_picole, caso o TipoPicole esteja associado a um ou mais alimentos em outras tabelas. Caso seja por outro
-        motivo, será lançado um erro genérico.
+        :raises RuntimeError: Se o TipoPicole estiver associado a um ou mais elementos em outras tabelas. Caso seja por
+        outro motivo, será lançado um erro genérico.
         :raises ValueError: Se o TipoPicole não for encontrado na base
         """
         try:
             if not isinstance(id_tipo_picole, int):
                 raise TypeError('id do TipoPicole deve ser um inteiro!')
 
-            with createSession() as session:
-                tipo_picole: TipoPicole = session.query(TipoPicole). \
-                    filter_by(id=id_tipo_picole).first()
+            return await DataBaseFeatures.deleteById(model=TipoPicole, id=id_tipo_picole)
 
-                if not tipo_picole:
-                    raise ValueError(f'TipoPicole com id={id_tipo_picole} não cadastrado na base!')
+        except (TypeError, ValueError, RuntimeError):
+            raise
 
-                session.delete(tipo_picole)
-                session.commit()
-                return tipo_picole
+        except Exception as exc:
+            raise Exception(f'Erro inesperado ao deletar TipoPicole: {exc}')
 
-        except TypeError as te:
-            raise TypeError(te)
+    @staticmethod
+    @retryTransitorio
+    async def deleteMany(ids: list[int]) -> int:
+        """Deleta vários TipoPicole em uma única transação, em blocos abaixo do limite de variáveis do SQLite.
+        :param ids: list[int]: ids dos registros de TipoPicole
+        :return: int: quantidade de registros deletados
+        :raises TypeError: Se algum id não for um inteiro
+        :raises RuntimeError: Se algum TipoPicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteMany(TipoPicole, ids)
 
-        except ValueError as ve:
-            raise ValueError(ve)
+    @staticmethod
+    @retryTransitorio
+    async def deleteWhere(*filtros) -> int:
+        """Deleta os registros de TipoPicole que atendem aos filtros informados, ex.: TipoPicole.nome == 'NOME'
+        :param filtros: expressões booleanas do SQLAlchemy
+        :return: int: quantidade de registros deletados
+        :raises ValueError: Se nenhum filtro for informado
+        :raises RuntimeError: Se algum TipoPicole estiver associado a elementos em outras tabelas
+        """
+        return await DataBaseFeatures.deleteWhere(TipoPicole, *filtros)
 
-        except IntegrityError as intg_error:
-            if 'FOREIGN KEY constraint failed' in str(intg_error):
-                tabelas = DataBaseFeatures.findTabelsWithFkTo(table_name=TipoPicole.__tablename__)
-                raise RuntimeError(f'TipoPicole com id={id_tipo_picole} não pode ser deletado, '
-                                   f'pois pode está associado a um ou mais elementos na(s) tabela(s): {tabelas}')
-            else:
-                # Tratar outros erros de integridade do SQLAlchemy
-                raise RuntimeError(f'Erro de integridade ao deletar TipoPicole: {intg_error}')
 
-        except Exception as exc:
-            raise Exception(f'Erro inesperado ao deletar TipoPicole: {exc}')
+# consulta de TipoPicole.selectTipoPicolePorNome, montada uma única vez: a cada chamada muda somente o parâmetro,
+# e o SQL compilado é reaproveitado do cache da engine
+_SELECT_TIPO_PICOLE_POR_NOME = sa.select(TipoPicole).where(TipoPicole.nome == sa.bindparam('nome'))
 
 
 if __name__ == '__main__':
@@ -283,7 +313,7 @@ if __name__ == '__main__':
     # print(tipo_picole)
 
     try:
-        tipo_picole = TipoPicole.deleteTipoPicoleById(id_tipo_picole=100)
+        tipo_picole = asyncio.run(TipoPicole.deleteTipoPicoleById(id_tipo_picole=100))
         print(tipo_picole)
     except Exception as e:
         print(f'Erro ao deletar TipoPicole: {e}')
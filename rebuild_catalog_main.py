@@ -0,0 +1,10 @@
+import asyncio
+
+from conf.profiler import perfilarEntrada
+from models.picole_catalog import PicoleCatalog
+
+
+if __name__ == '__main__':
+    # recria o catálogo de picolés a partir das tabelas de origem, ver models/picole_catalog.py
+    total = asyncio.run(perfilarEntrada('rebuild_catalog', PicoleCatalog.rebuildCatalogo()))
+    print(f'Catálogo reconstruído com {total} picolé(s)')
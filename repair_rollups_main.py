@@ -0,0 +1,23 @@
+import asyncio
+import sys
+
+from conf.profiler import perfilarEntrada
+from models.revendedor_daily_sales import RevendedorDailySales
+from models.picole_stock import PicoleStock
+
+
+async def main(reparar: bool) -> int:
+    # recalcula os rollups a partir das tabelas de origem, ver models/revendedor_daily_sales.py e models/picole_stock.py
+    divergentes = 0
+    for model in (RevendedorDailySales, PicoleStock):
+        total = await model.verificarRollup(reparar=reparar)
+        print(f'{model.__tablename__}: {total} linha(s) divergente(s){" reparada(s)" if reparar and total else ""}')
+        divergentes += total
+    return divergentes
+
+
+if __name__ == '__main__':
+    # --verificar: somente verifica, sem reparar; o código de saída é 1 se houver divergências
+    somente_verificar = '--verificar' in sys.argv[1:]
+    divergentes = asyncio.run(perfilarEntrada('repair_rollups', main(reparar=not somente_verificar)))
+    sys.exit(1 if somente_verificar and divergentes else 0)